@@ -0,0 +1,32 @@
+"""
+Anomaly detection for MyMoney Pro
+Scores every user's expense history in one vectorized pass (see detect_anomalies
+in backend/app.py): flags unusually large charges for their category and likely
+duplicate charges, and refreshes the per-category statistics that new
+transactions are scored against at insert time. Run nightly, e.g. from cron.
+
+Usage: python anomalies.py [--days 90] [--user USER_ID ...]
+"""
+
+import argparse
+import datetime
+import time
+
+from backend.app import app, detect_anomalies
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--days', type=int, default=90, help='flag transactions dated within this many days (default 90)')
+    parser.add_argument('--user', type=int, action='append', dest='users', help='only score this user (repeatable)')
+    args = parser.parse_args()
+
+    since = (datetime.date.today() - datetime.timedelta(days=args.days)).isoformat()
+    print(f"Scoring expenses (flagging those dated from {since})...")
+    start = time.perf_counter()
+    with app.app_context():
+        result = detect_anomalies(args.users, since)
+    print(f"✓ Scored {result['lines']} expense lines in {time.perf_counter() - start:.1f}s: "
+          f"{result['outlier']} outliers, {result['duplicate']} possible duplicates")
+
+if __name__ == '__main__':
+    main()
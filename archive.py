@@ -0,0 +1,34 @@
+"""
+Transaction archival for MyMoney Pro
+Moves transactions older than the archive horizon out of the hot transaction
+table into compressed per-user segments (see archive_transactions in
+backend/app.py). Safe to run repeatedly, e.g. nightly from cron.
+
+Usage: python archive.py [--days 730] [--user USER_ID ...]
+"""
+
+import argparse
+import datetime
+import time
+
+from backend.app import app, archive_transactions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--days', type=int, default=app.config['ARCHIVE_AFTER_DAYS'],
+                        help='archive transactions dated more than this many days ago (default: ARCHIVE_AFTER_DAYS)')
+    parser.add_argument('--user', type=int, action='append', dest='users', help='only archive this user (repeatable)')
+    args = parser.parse_args()
+
+    cutoff = (datetime.date.today() - datetime.timedelta(days=args.days)).isoformat()
+    print(f"Archiving transactions dated before {cutoff}...")
+    start = time.perf_counter()
+    with app.app_context():
+        archived = archive_transactions(cutoff, args.users)
+    for user_id, count in sorted(archived.items()):
+        print(f"  user {user_id}: {count} transactions")
+    print(f"✓ Archived {sum(archived.values())} transactions for {len(archived)} users "
+          f"in {time.perf_counter() - start:.1f}s")
+
+if __name__ == '__main__':
+    main()
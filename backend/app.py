@@ -1,9 +1,39 @@
-from flask import Flask, jsonify, request, send_from_directory, g
+from flask import Flask, jsonify, request, send_from_directory, g, has_request_context, stream_with_context
 from flask_cors import CORS
 from flask_sqlalchemy import SQLAlchemy
-import os, jwt, datetime
+from sqlalchemy import event, select, insert, update, func, case, and_, or_, exists, literal, inspect as sa_inspect, text
+from sqlalchemy.orm import selectinload, defer
+from sqlalchemy.engine import Engine
+import os, re, io, csv, gzip, json, math, time, zlib, asyncio, inspect, itertools, threading, contextlib, jwt, datetime
+import numpy as np
+import random, secrets
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
 from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.middleware.proxy_fix import ProxyFix
 from functools import wraps
+from collections import Counter, defaultdict, deque
+
+try:
+    from backend.cache import VersionedCache, create_store
+    from backend.events import StreamLost, create_bus
+except ImportError:  # started as `python backend/app.py`
+    from cache import VersionedCache, create_store
+    from events import StreamLost, create_bus
+
+try:
+    import brotli
+except ImportError:  # optional; responses fall back to gzip
+    brotli = None
+
+try:
+    import fcntl  # cross-process locking for the columnar store (POSIX only)
+except ImportError:
+    fcntl = None
+try:
+    import greenlet  # required by SQLAlchemy's asyncio extension
+    from sqlalchemy.ext.asyncio import create_async_engine
+except ImportError:  # async views fall back to db.session
+    create_async_engine = None
 
 app = Flask(__name__, static_folder='../build', static_url_path='/')
 CORS(app)
@@ -11,6 +41,9 @@ CORS(app)
 # Secret key for JWT (in production use env var)
 JWT_SECRET = os.environ.get('JWT_SECRET') or 'change-this-secret'
 JWT_ALGO = 'HS256'
+# Shared market prices (POST /api/investments/prices) are written by a price feed that
+# sends this token in X-Price-Feed-Token, not by users; unset turns the endpoint off
+app.config['PRICE_FEED_TOKEN'] = os.environ.get('PRICE_FEED_TOKEN') or None
 
 # Database config (SQLite by default). To use MySQL set DATABASE_URL env var.
 # Default to using the instance directory to match Docker/.env.example and avoid
@@ -43,6 +76,208 @@ db = SQLAlchemy()
 # Bind to app after config and directory checks
 db.init_app(app)
 
+# Query guard (development/tests only). Counts the statements each request runs,
+# warns when the same statement shape repeats more than QUERY_REPEAT_THRESHOLD
+# times (the usual N+1 signature) and logs queries slower than SLOW_QUERY_MS with
+# their bound parameters and EXPLAIN plan. Enable with QUERY_GUARD=1.
+app.config['QUERY_GUARD'] = os.environ.get('QUERY_GUARD', '0') == '1'
+app.config['QUERY_REPEAT_THRESHOLD'] = int(os.environ.get('QUERY_REPEAT_THRESHOLD', 5))
+app.config['SLOW_QUERY_MS'] = float(os.environ.get('SLOW_QUERY_MS', 100))
+# Max statements per endpoint, enforced by the pytest plugin in backend_tests/conftest.py
+app.config['QUERY_BUDGETS'] = {}
+
+# Transactions dated more than ARCHIVE_AFTER_DAYS ago are moved to compressed archive
+# segments by archive.py; hot queries only ever see the newer rows
+app.config['ARCHIVE_AFTER_DAYS'] = int(os.environ.get('ARCHIVE_AFTER_DAYS', 730))
+app.config['ARCHIVE_SEGMENT_ROWS'] = 50000
+
+# Anomaly detection: an expense is an outlier when its robust z-score against the last
+# ANOMALY_WINDOW amounts in its category is above ANOMALY_Z and it is at least
+# ANOMALY_MIN_RATIO times their median; the same amount at the same merchant within
+# DUPLICATE_WINDOW_DAYS days is a likely duplicate charge
+app.config['ANOMALY_WINDOW'] = int(os.environ.get('ANOMALY_WINDOW', 50))
+app.config['ANOMALY_MIN_HISTORY'] = 5
+app.config['ANOMALY_Z'] = float(os.environ.get('ANOMALY_Z', 3.5))
+app.config['ANOMALY_MIN_RATIO'] = float(os.environ.get('ANOMALY_MIN_RATIO', 3.0))
+app.config['ANOMALY_EWMA_ALPHA'] = 0.1
+app.config['DUPLICATE_WINDOW_DAYS'] = int(os.environ.get('DUPLICATE_WINDOW_DAYS', 3))
+
+# Result cache shared by the workers: 'memory' (per process), 'sqlite' (CACHE_URL is
+# the file, default instance/cache.db) or 'redis' (CACHE_URL redis://..., or 'local'
+# for the in-process stand-in)
+app.config['CACHE_BACKEND'] = os.environ.get('CACHE_BACKEND', 'memory')
+app.config['CACHE_URL'] = os.environ.get('CACHE_URL')
+app.config['CACHE_TTL'] = int(os.environ.get('CACHE_TTL', 3600))
+
+# Server-sent events (/api/events): 'redis' reaches the clients on every worker (the
+# default when the cache is on Redis, sharing CACHE_URL), 'local' only this process.
+# Each open stream holds one request thread, so by default streams may take half of a
+# worker's WEB_THREADS (gunicorn --threads, see Procfile) and the rest serve requests.
+app.config['EVENTS_BACKEND'] = os.environ.get('EVENTS_BACKEND', 'redis' if app.config['CACHE_BACKEND'] == 'redis' else 'local')
+app.config['EVENTS_URL'] = os.environ.get('EVENTS_URL', app.config['CACHE_URL'])
+app.config['WEB_THREADS'] = int(os.environ.get('WEB_THREADS', 32))
+app.config['EVENTS_MAX_CONNECTIONS'] = int(os.environ.get('EVENTS_MAX_CONNECTIONS', max(1, app.config['WEB_THREADS'] // 2)))
+if app.config['EVENTS_BACKEND'] == 'local' and int(os.environ.get('WEB_CONCURRENCY', 1)) > 1:
+    print(f"[app] WARNING: EVENTS_BACKEND=local with WEB_CONCURRENCY={os.environ['WEB_CONCURRENCY']} workers: "
+          "/api/events streams only see writes made on their own worker, so most events never arrive. "
+          "Set EVENTS_BACKEND=redis (and EVENTS_URL) or run a single worker.", flush=True)
+app.config['EVENTS_HEARTBEAT'] = float(os.environ.get('EVENTS_HEARTBEAT', 15))  # seconds between keep-alive comments
+
+# Rate limiting: token buckets (capacity, refill tokens/second) per client IP, per
+# signed-in user and per login username, kept in the result cache's store so all
+# workers share them. Routes cost ROUTE_COSTS tokens (default 1); HEAVY_ROUTES also
+# run at most RATE_LIMIT_CONCURRENCY at a time per user. Behind a reverse proxy set
+# TRUSTED_PROXIES to the number of hops in front of the app, or every client's
+# requests arrive from the proxy's address and share one IP bucket.
+app.config['TRUSTED_PROXIES'] = int(os.environ.get('TRUSTED_PROXIES', 0))
+if app.config['TRUSTED_PROXIES']:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['TRUSTED_PROXIES'], x_proto=app.config['TRUSTED_PROXIES'])
+app.config['RATE_LIMIT_ENABLED'] = os.environ.get('RATE_LIMIT', '1').lower() in ('1', 'true', 'yes')
+app.config['RATE_LIMIT_IP'] = (300, 10.0)
+app.config['RATE_LIMIT_USER'] = (120, 4.0)
+app.config['RATE_LIMIT_LOGIN'] = (10, 1 / 12)  # per username and IP: 10 tries, then 5 a minute
+app.config['RATE_LIMIT_CONCURRENCY'] = int(os.environ.get('RATE_LIMIT_CONCURRENCY', 2))
+ROUTE_COSTS = {'export_transactions': 20, 'analytics_report': 10, 'investments_performance': 10,
+               'spending_trend': 5, 'category_breakdown': 5, 'forecast': 5, 'login': 5, 'register': 5}
+HEAVY_ROUTES = {'export_transactions', 'analytics_report', 'investments_performance',
+                'spending_trend', 'category_breakdown', 'forecast'}
+
+# Password hashing runs on a pool of PASSWORD_HASH_WORKERS threads per process, with at
+# most PASSWORD_HASH_QUEUE more waiting, so a burst of logins can't take every core;
+# past that, or after PASSWORD_HASH_TIMEOUT seconds, the request gets a 503. Any
+# werkzeug method works (e.g. 'pbkdf2:sha256:600000'); existing hashes made with other
+# parameters are upgraded the next time their owner signs in.
+app.config['PASSWORD_HASH_METHOD'] = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt')
+app.config['PASSWORD_HASH_WORKERS'] = int(os.environ.get('PASSWORD_HASH_WORKERS', max(1, (os.cpu_count() or 2) // 2)))
+app.config['PASSWORD_HASH_QUEUE'] = int(os.environ.get('PASSWORD_HASH_QUEUE', 16))
+app.config['PASSWORD_HASH_TIMEOUT'] = float(os.environ.get('PASSWORD_HASH_TIMEOUT', 5))
+
+# Background jobs: a running job not heard from for JOB_VISIBILITY_TIMEOUT seconds is
+# handed to another worker; finished jobs and their files are kept JOB_RETENTION_DAYS
+app.config['JOB_VISIBILITY_TIMEOUT'] = int(os.environ.get('JOB_VISIBILITY_TIMEOUT', 300))
+app.config['JOB_RETENTION_DAYS'] = int(os.environ.get('JOB_RETENTION_DAYS', 7))
+
+# Delta sync (/api/sync): change-log entries returned per call, and how often worker.py
+# drops superseded change-log entries
+app.config['SYNC_PAGE_SIZE'] = int(os.environ.get('SYNC_PAGE_SIZE', 1000))
+app.config['CHANGE_LOG_COMPACT_INTERVAL'] = int(os.environ.get('CHANGE_LOG_COMPACT_INTERVAL', 600))
+
+# Optional per-user columnar copy of the transactions (memory-mapped NumPy arrays)
+# that analytics read instead of aggregating in SQL
+app.config['COLUMNAR_STORE'] = os.environ.get('COLUMNAR_STORE', '0').lower() in ('1', 'true', 'yes')
+app.config['COLUMNAR_DIR'] = os.environ.get('COLUMNAR_DIR') or os.path.abspath(os.path.join('instance', 'columnar'))
+
+# One entry per finished request while the guard is on (read by the test plugin); only the
+# newest are kept, so a long-running dev server doesn't grow it forever
+query_guard_log = deque(maxlen=1000)
+
+def _query_guard_active():
+    return app.config['QUERY_GUARD'] and has_request_context() and not g.get('_qg_explaining')
+
+def statement_shape(statement):
+    """Normalize SQL so the same query with different IN-list sizes or literals compares equal"""
+    shape = re.sub(r'\s+', ' ', statement).strip()
+    shape = re.sub(r'\((?:\s*(?:\?|%\(\w+\)s|%s|:\w+)\s*,?)+\)', '(?)', shape)
+    shape = re.sub(r"'[^']*'|\b\d+(?:\.\d+)?\b", '?', shape)
+    return shape
+
+def _explain(conn, statement, parameters):
+    """Return the query plan for a slow SELECT, or None if the dialect isn't supported"""
+    if not statement.lstrip().upper().startswith('SELECT'):
+        return None
+    prefix = {'sqlite': 'EXPLAIN QUERY PLAN ', 'postgresql': 'EXPLAIN '}.get(conn.dialect.name)
+    if not prefix:
+        return None
+    g._qg_explaining = True
+    try:
+        rows = conn.exec_driver_sql(prefix + statement, parameters).fetchall()
+        return [' '.join(str(c) for c in row) for row in rows]
+    except Exception as e:
+        return [f'explain failed: {e}']
+    finally:
+        g._qg_explaining = False
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _query_guard_before(conn, cursor, statement, parameters, context, executemany):
+    if _query_guard_active():
+        conn.info.setdefault('qg_start', []).append(time.perf_counter())
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _query_guard_after(conn, cursor, statement, parameters, context, executemany):
+    if not _query_guard_active() or not conn.info.get('qg_start'):
+        return
+    elapsed_ms = (time.perf_counter() - conn.info['qg_start'].pop()) * 1000
+    if 'qg_shapes' not in g:
+        g.qg_shapes = Counter()
+        g.qg_slow = []
+    g.qg_shapes[statement_shape(statement)] += 1
+    if elapsed_ms >= app.config['SLOW_QUERY_MS']:
+        plan = _explain(conn, statement, parameters)
+        g.qg_slow.append({'statement': statement, 'ms': round(elapsed_ms, 2)})
+        app.logger.warning('[query-guard] slow query (%.1f ms) on %s: %s params=%r plan=%r',
+                           elapsed_ms, request.path, statement, parameters, plan)
+
+@app.after_request
+def _query_guard_report(response):
+    if not app.config['QUERY_GUARD']:
+        return response
+    shapes = g.get('qg_shapes') or Counter()
+    count = sum(shapes.values())
+    threshold = app.config['QUERY_REPEAT_THRESHOLD']
+    repeated = {s: n for s, n in shapes.items() if n > threshold}
+    for shape, n in repeated.items():
+        app.logger.warning('[query-guard] possible N+1 on %s: statement ran %d times: %s', request.path, n, shape)
+    query_guard_log.append({'endpoint': request.endpoint, 'path': request.path, 'count': count,
+                            'repeated': repeated, 'slow': g.get('qg_slow', [])})
+    response.headers['X-Query-Count'] = str(count)
+    return response
+
+# Response compression for API payloads. Picks br or gzip from Accept-Encoding,
+# skips bodies under COMPRESS_MIN_SIZE bytes and compresses streamed responses
+# (e.g. the CSV export) chunk by chunk. Brotli is optional.
+app.config['COMPRESS_MIN_SIZE'] = int(os.environ.get('COMPRESS_MIN_SIZE', 1024))
+app.config['COMPRESS_LEVEL'] = int(os.environ.get('COMPRESS_LEVEL', 6))  # gzip 1-9
+app.config['COMPRESS_BR_LEVEL'] = int(os.environ.get('COMPRESS_BR_LEVEL', 4))  # brotli 0-11
+COMPRESSIBLE_MIMETYPES = {'application/json', 'text/csv', 'text/plain'}
+
+def _compressor(encoding):
+    """Return (compress(chunk), flush()) callables for a single response body"""
+    if encoding == 'br':
+        c = brotli.Compressor(quality=app.config['COMPRESS_BR_LEVEL'])
+        return c.process, c.finish
+    c = zlib.compressobj(app.config['COMPRESS_LEVEL'], zlib.DEFLATED, 31)  # 31 = gzip container
+    return c.compress, c.flush
+
+def _compressed_stream(chunks, encoding):
+    compress, flush = _compressor(encoding)
+    for chunk in chunks:
+        out = compress(chunk.encode('utf-8') if isinstance(chunk, str) else chunk)
+        if out:
+            yield out
+    yield flush()
+
+@app.after_request
+def _compress_response(response):
+    if (not request.path.startswith('/api/') or response.status_code < 200 or response.status_code in (204, 304)
+            or response.direct_passthrough or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = request.accept_encodings.best_match(['br', 'gzip'] if brotli else ['gzip'])
+    if not encoding:
+        return response
+    if response.is_streamed:
+        response.response = _compressed_stream(response.response, encoding)
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < app.config['COMPRESS_MIN_SIZE']:
+            return response
+        compress, flush = _compressor(encoding)
+        response.set_data(compress(data) + flush())
+    response.headers['Content-Encoding'] = encoding
+    return response
+
 # Models
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -59,6 +294,7 @@ class User(db.Model):
 class Transaction(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    account_id = db.Column(db.Integer, db.ForeignKey('account.id'), nullable=True)
     type = db.Column(db.String(10), nullable=False)  # income or expense
     category = db.Column(db.String(64), nullable=False)
     amount = db.Column(db.Float, nullable=False)
@@ -66,6 +302,12 @@ class Transaction(db.Model):
     date = db.Column(db.String(32), nullable=False)
     time = db.Column(db.String(32), nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
+    splits = db.relationship('TransactionSplit', cascade='all, delete-orphan', order_by='TransactionSplit.id')
+    # Running balances and reconciliation walk one account's ledger in date order;
+    # archival and date-range searches scan one user's rows by date
+    __table_args__ = (db.Index('ix_transaction_account_date', 'account_id', 'date', 'id'),
+                      db.Index('ix_transaction_user_date', 'user_id', 'date'))
 
 class Budget(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -74,6 +316,7 @@ class Budget(db.Model):
     limit = db.Column(db.Float, default=0.0)
     spent = db.Column(db.Float, default=0.0)
     color = db.Column(db.String(16), default='#3b82f6')
+    updated_at = db.Column(db.DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
 
 class Goal(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -83,6 +326,7 @@ class Goal(db.Model):
     current = db.Column(db.Float, default=0.0)
     deadline = db.Column(db.String(64), nullable=True)
     priority = db.Column(db.String(16), default='low')
+    updated_at = db.Column(db.DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
 
 class Bill(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -92,6 +336,7 @@ class Bill(db.Model):
     due_date = db.Column(db.String(64), nullable=True)
     status = db.Column(db.String(16), default='pending')  # pending, paid, overdue
     auto = db.Column(db.Boolean, default=False)
+    updated_at = db.Column(db.DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
 
 # YNAB-like Features Models
 class Account(db.Model):
@@ -100,10 +345,12 @@ class Account(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     name = db.Column(db.String(128), nullable=False)
     type = db.Column(db.String(32), default='checking')  # checking, savings, credit, investment
-    balance = db.Column(db.Float, default=0.0)
+    balance = db.Column(db.Float, default=0.0)  # opening_balance + linked transactions, kept by the server
+    opening_balance = db.Column(db.Float, default=0.0)
     institution = db.Column(db.String(128), nullable=True)
     last_reconciled = db.Column(db.DateTime, nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
 
 class EnvelopeBudget(db.Model):
     """Envelope budgeting system - assign every dollar a job"""
@@ -117,6 +364,7 @@ class EnvelopeBudget(db.Model):
     rollover = db.Column(db.Boolean, default=True)
     priority = db.Column(db.Integer, default=5)  # 1-10 for auto-assignment
     notes = db.Column(db.String(256), nullable=True)
+    updated_at = db.Column(db.DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
 
 class RecurringTransaction(db.Model):
     """Automatic recurring transactions"""
@@ -133,6 +381,7 @@ class RecurringTransaction(db.Model):
     end_date = db.Column(db.String(32), nullable=True)
     active = db.Column(db.Boolean, default=True)
     created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
 
 class TransactionSplit(db.Model):
     """Split transactions across multiple categories"""
@@ -142,6 +391,29 @@ class TransactionSplit(db.Model):
     amount = db.Column(db.Float, nullable=False)
     notes = db.Column(db.String(256), nullable=True)
 
+class TransactionArchive(db.Model):
+    """Append-only segment of archived transactions: zlib-compressed JSON rows (with
+    their splits) for one user, covering first_date..last_date"""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    first_date = db.Column(db.String(10), nullable=False)
+    last_date = db.Column(db.String(10), nullable=False)
+    count = db.Column(db.Integer, nullable=False)
+    data = db.Column(db.LargeBinary, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+    __table_args__ = (db.Index('ix_transaction_archive_user_dates', 'user_id', 'last_date', 'first_date'),)
+
+class MonthlyRollup(db.Model):
+    """Monthly totals per type and (split) category of archived transactions"""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    month = db.Column(db.String(7), nullable=False)  # YYYY-MM
+    type = db.Column(db.String(10), nullable=False)
+    category = db.Column(db.String(64), nullable=False)
+    amount = db.Column(db.Float, default=0.0)
+    count = db.Column(db.Integer, default=0)
+    __table_args__ = (db.UniqueConstraint('user_id', 'month', 'type', 'category'),)
+
 class Investment(db.Model):
     """Investment tracking (stocks, bonds, crypto)"""
     id = db.Column(db.Integer, primary_key=True)
@@ -153,9 +425,24 @@ class Investment(db.Model):
     quantity = db.Column(db.Float, default=0.0)
     purchase_price = db.Column(db.Float, default=0.0)
     current_price = db.Column(db.Float, default=0.0)
+    manual_price = db.Column(db.Float, nullable=True)  # set by the owner; overrides the shared price for this holding only
     purchase_date = db.Column(db.String(32), nullable=True)
+    updated_at = db.Column(db.DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
+
+class SecurityPrice(db.Model):
+    """Latest market price per symbol, shared by every holding of that symbol"""
+    symbol = db.Column(db.String(16), primary_key=True)
+    price = db.Column(db.Float, nullable=False)
     updated_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
 
+class PriceHistory(db.Model):
+    """Daily closing prices per symbol, used for time-weighted returns"""
+    id = db.Column(db.Integer, primary_key=True)
+    symbol = db.Column(db.String(16), nullable=False)
+    date = db.Column(db.String(10), nullable=False)  # YYYY-MM-DD
+    price = db.Column(db.Float, nullable=False)
+    __table_args__ = (db.UniqueConstraint('symbol', 'date'),)
+
 class NetWorthSnapshot(db.Model):
     """Track net worth over time"""
     id = db.Column(db.Integer, primary_key=True)
@@ -165,6 +452,7 @@ class NetWorthSnapshot(db.Model):
     liabilities = db.Column(db.Float, default=0.0)
     net_worth = db.Column(db.Float, default=0.0)
     created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
 
 class BudgetTemplate(db.Model):
     """Pre-built budget templates"""
@@ -175,10 +463,175 @@ class BudgetTemplate(db.Model):
     is_public = db.Column(db.Boolean, default=True)
     created_by = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
 
+class Job(db.Model):
+    """Background job run by worker.py (exports, imports, reports)"""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    kind = db.Column(db.String(32), nullable=False)
+    params = db.Column(db.Text, nullable=True)  # JSON
+    status = db.Column(db.String(16), default='queued')  # queued, running, done, failed
+    progress = db.Column(db.Float, default=0.0)  # 0..1
+    checkpoint = db.Column(db.Integer, default=0)  # handler-defined resume point for retries
+    attempts = db.Column(db.Integer, default=0)
+    max_attempts = db.Column(db.Integer, default=3)
+    run_after = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+    locked_by = db.Column(db.String(64), nullable=True)
+    locked_until = db.Column(db.DateTime, nullable=True)  # visibility timeout of a running job
+    result = db.Column(db.Text, nullable=True)  # JSON
+    error = db.Column(db.Text, nullable=True)
+    result_name = db.Column(db.String(128), nullable=True)
+    result_mimetype = db.Column(db.String(64), nullable=True)
+    result_data = db.Column(db.LargeBinary, nullable=True)  # gzip-compressed file
+    created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    __table_args__ = (db.Index('ix_job_claim', 'status', 'run_after'), db.Index('ix_job_user', 'user_id', 'id'))
+
+class CategoryStats(db.Model):
+    """Per-user, per-category expense statistics for scoring new transactions: median and
+    MAD of the last ANOMALY_WINDOW amounts (refreshed by detect_anomalies) and an
+    exponentially weighted mean and second moment, updated on every insert"""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    category = db.Column(db.String(64), nullable=False)
+    count = db.Column(db.Integer, default=0)
+    median = db.Column(db.Float, nullable=True)
+    mad = db.Column(db.Float, nullable=True)
+    ewma = db.Column(db.Float, default=0.0)
+    ewma_sq = db.Column(db.Float, default=0.0)
+    updated_at = db.Column(db.DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
+    __table_args__ = (db.UniqueConstraint('user_id', 'category'),)
+
+class Anomaly(db.Model):
+    """A flagged transaction: 'outlier' (unusual amount for its category) or 'duplicate'"""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    # Flags go with their transaction when it's deleted or archived (explicitly too,
+    # since SQLite doesn't enforce foreign keys and reuses the highest deleted id)
+    transaction_id = db.Column(db.Integer, db.ForeignKey('transaction.id', ondelete='CASCADE'), nullable=False)
+    kind = db.Column(db.String(16), nullable=False)
+    score = db.Column(db.Float, default=0.0)
+    detail = db.Column(db.Text, nullable=True)  # JSON
+    status = db.Column(db.String(16), default='open')  # open, dismissed
+    created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+    __table_args__ = (db.UniqueConstraint('transaction_id', 'kind'), db.Index('ix_anomaly_user', 'user_id', 'status', 'id'))
+
+class ChangeLog(db.Model):
+    """Delta-sync log: one entry per insert, update or delete (tombstone) of a synced
+    row. The autoincrement id is the change sequence clients sync from."""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    resource = db.Column(db.String(32), nullable=False)
+    object_id = db.Column(db.Integer, nullable=False)
+    deleted = db.Column(db.Boolean, default=False, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
+    # /api/sync reads one user's entries after a cursor from this index alone
+    __table_args__ = (db.Index('ix_change_log_user_seq', 'user_id', 'id', 'resource', 'object_id', 'deleted'),
+                      db.Index('ix_change_log_object', 'resource', 'object_id'))
+
+# Delta sync: every write to a synced row is logged in ChangeLog, by the mapper
+# events below for ORM flushes and by record_changes() for bulk statements
+SYNCED_MODELS = {Transaction: 'transactions', Budget: 'budgets', Goal: 'goals', Bill: 'bills', Account: 'accounts',
+                 EnvelopeBudget: 'envelope_budgets', RecurringTransaction: 'recurring_transactions',
+                 Investment: 'investments', NetWorthSnapshot: 'net_worth'}
+
+def _serialize_changes(connection, user_ids):
+    """PostgreSQL hands out sequence values before commit, so a sync could see change 11
+    while change 10 is still uncommitted and skip it for good. Holding a per-user lock
+    until commit keeps each user's change ids in commit order. SQLite serializes writers anyway."""
+    if connection.dialect.name == 'postgresql':
+        for user_id in sorted(set(user_ids)):
+            connection.execute(text('SELECT pg_advisory_xact_lock(:key)'), {'key': user_id})
+
+def _note_changed(session, user_ids, resource):
+    """Remember which users' resources this transaction changed, for the 'sync' event sent on commit"""
+    changed = session.info.setdefault('changed_resources', defaultdict(set))
+    for user_id in user_ids:
+        changed[user_id].add(resource)
+
+def _log_change(target, connection, deleted):
+    _note_changed(sa_inspect(target).session, [target.user_id], SYNCED_MODELS[type(target)])
+    _serialize_changes(connection, [target.user_id])
+    connection.execute(insert(ChangeLog).values(
+        user_id=target.user_id, resource=SYNCED_MODELS[type(target)], object_id=target.id, deleted=deleted,
+        created_at=datetime.datetime.utcnow()))
+
+def _log_insert(mapper, connection, target):
+    _log_change(target, connection, False)
+
+def _log_update(mapper, connection, target):
+    # Flushed objects without net changes (e.g. a PUT that resent the same values) aren't logged
+    if sa_inspect(target).session.is_modified(target):
+        _log_change(target, connection, False)
+
+def _log_delete(mapper, connection, target):
+    _log_change(target, connection, True)
+
+for _model in SYNCED_MODELS:
+    event.listen(_model, 'after_insert', _log_insert)
+    event.listen(_model, 'after_update', _log_update)
+    event.listen(_model, 'after_delete', _log_delete)
+
+def record_changes(model, *where, deleted=False):
+    """Log the `model` rows matching `where` as changed by a bulk statement (which the
+    mapper events don't see): call after a bulk INSERT/UPDATE, before a bulk DELETE"""
+    if db.engine.dialect.name == 'postgresql':
+        _serialize_changes(db.session.connection(),
+                           db.session.execute(select(model.user_id).where(*where).distinct()).scalars())
+    rows = select(model.user_id, literal(SYNCED_MODELS[model]), model.id, literal(deleted),
+                  literal(datetime.datetime.utcnow())).where(*where)
+    user_ids = db.session.execute(insert(ChangeLog).from_select(
+        ['user_id', 'resource', 'object_id', 'deleted', 'created_at'], rows).returning(ChangeLog.user_id)).scalars()
+    _note_changed(db.session(), set(user_ids), SYNCED_MODELS[model])
+
+def drop_superseded_changes(model=None, *where):
+    """Delete entries superseded by a later entry for the same row, either everywhere or
+    only for the rows of `model` matching `where` (an indexed delete, cheap enough to run
+    after each bulk write). Every cursor stays valid, since the newest entry of each row
+    (tombstones included) is kept. Returns the number of entries deleted; the caller commits."""
+    scope = []
+    if model is not None:
+        scope = [ChangeLog.resource == SYNCED_MODELS[model], ChangeLog.object_id.in_(select(model.id).where(*where))]
+    newest = select(func.max(ChangeLog.id)).where(*scope).group_by(ChangeLog.resource, ChangeLog.object_id)
+    return ChangeLog.query.filter(*scope, ChangeLog.id.notin_(newest)).delete(synchronize_session=False)
+
+def compact_change_log():
+    """Drop every superseded entry; worker.py runs this every CHANGE_LOG_COMPACT_INTERVAL seconds"""
+    count = drop_superseded_changes()
+    db.session.commit()
+    return count
+
+def add_missing_columns():
+    """create_all() only creates missing tables; add the columns and indexes introduced
+    since an existing database was created. Returns the added 'table.column' names."""
+    inspector = sa_inspect(db.engine)
+    added = []
+    with db.engine.begin() as conn:
+        for table in db.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {c['name'] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    ddl = column.type.compile(dialect=db.engine.dialect)
+                    conn.execute(text(f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {ddl}'))
+                    added.append(f'{table.name}.{column.name}')
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
+        if 'account.opening_balance' in added:
+            # Until now balances were typed in by hand; treat them as the opening balance.
+            # Logged like record_changes() does, for sync clients and incremental backups.
+            conn.execute(text('UPDATE account SET opening_balance = balance'))
+            conn.execute(insert(ChangeLog).from_select(
+                ['user_id', 'resource', 'object_id', 'deleted', 'created_at'],
+                select(Account.user_id, literal(SYNCED_MODELS[Account]), Account.id, literal(False),
+                       literal(datetime.datetime.utcnow()))))
+    return added
+
 # Create tables at startup (don't crash import if DB isn't accessible; useful in containerized environments)
 try:
     with app.app_context():
         db.create_all()
+        add_missing_columns()
 except Exception as e:
     # Log a helpful message but allow the app to import (init_db.py or subsequent calls can create tables)
     print(f"[app] Warning: could not create database tables at startup: {e}")
@@ -192,29 +645,277 @@ def create_token(user_id):
         token = token.decode('utf-8')
     return token
 
+def _authenticate():
+    """Resolve the bearer token into g.current_user; returns an error response or None"""
+    auth = request.headers.get('Authorization', None)
+    if not auth:
+        return jsonify({'error':'Authorization header missing'}), 401
+    parts = auth.split()
+    if parts[0].lower() != 'bearer' or len(parts) != 2:
+        return jsonify({'error':'Invalid Authorization header'}), 401
+    token = parts[1]
+    try:
+        data = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGO])
+        user = User.query.get(data['user_id'])
+        if not user:
+            return jsonify({'error':'Invalid token user'}), 401
+        g.current_user = user
+    except jwt.ExpiredSignatureError:
+        return jsonify({'error':'Token expired'}), 401
+    except Exception as e:
+        return jsonify({'error':'Invalid token', 'detail': str(e)}), 401
+    return None
+
 def auth_required(f):
+    if inspect.iscoroutinefunction(f):
+        @wraps(f)
+        async def decorated_async(*args, **kwargs):
+            error = _authenticate() or _admit_user()
+            if error:
+                return error
+            return await f(*args, **kwargs)
+        return decorated_async
+
     @wraps(f)
     def decorated(*args, **kwargs):
-        auth = request.headers.get('Authorization', None)
-        if not auth:
-            return jsonify({'error':'Authorization header missing'}), 401
-        parts = auth.split()
-        if parts[0].lower() != 'bearer' or len(parts) != 2:
-            return jsonify({'error':'Invalid Authorization header'}), 401
-        token = parts[1]
-        try:
-            data = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGO])
-            user = User.query.get(data['user_id'])
-            if not user:
-                return jsonify({'error':'Invalid token user'}), 401
-            g.current_user = user
-        except jwt.ExpiredSignatureError:
-            return jsonify({'error':'Token expired'}), 401
-        except Exception as e:
-            return jsonify({'error':'Invalid token', 'detail': str(e)}), 401
+        error = _authenticate() or _admit_user()
+        if error:
+            return error
         return f(*args, **kwargs)
     return decorated
 
+# Async database access for the read-only async views below. Flask runs each async
+# view on a throwaway event loop, where an async engine could only open a connection
+# per query. So under ASGI (backend/asgi.py) their independent queries run concurrently
+# on a pooled aiosqlite/asyncpg engine owned by the server's long-lived loop, and under
+# WSGI they go through db.session.
+ASYNC_DRIVERS = {'sqlite': 'sqlite+aiosqlite', 'postgresql': 'postgresql+asyncpg'}
+_async_engine = None
+_async_loop = None
+
+def use_async_engine(loop):
+    """Send fetch_all() queries to a pooled async engine on `loop`, the ASGI server's event
+    loop. Returns False (and changes nothing) when the async driver isn't installed."""
+    global _async_engine, _async_loop
+    with app.app_context():
+        url = db.engine.url  # the URL the sync engine actually uses
+    driver = ASYNC_DRIVERS.get(url.get_backend_name())
+    if not (driver and create_async_engine):
+        return False
+    try:
+        # The pool's asyncio primitives bind to the loop that first uses them: only `loop` does
+        _async_engine = create_async_engine(url.set(drivername=driver))
+    except ImportError:
+        return False
+    _async_loop = loop
+    return True
+
+async def close_async_engine():
+    """Dispose of the pooled async engine; run on the loop given to use_async_engine()"""
+    global _async_engine, _async_loop
+    if _async_engine is not None:
+        engine, _async_engine, _async_loop = _async_engine, None, None
+        await engine.dispose()
+
+async def fetch_all(*statements):
+    """Run independent SELECTs concurrently and return a list of row lists"""
+    engine, loop = _async_engine, _async_loop
+    if engine is None:
+        return [db.session.execute(stmt).all() for stmt in statements]
+
+    async def run(stmt):
+        async with engine.connect() as conn:
+            return (await conn.execute(stmt)).all()
+
+    async def run_all():
+        return await asyncio.gather(*(run(stmt) for stmt in statements))
+    return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(run_all(), loop))
+
+# Per-user result cache for expensive read endpoints (see backend/cache.py). Writes
+# bump the namespace's version (for one user, or for everyone with user_id=None)
+# instead of tracking down individual keys.
+result_cache = VersionedCache(create_store(app.config['CACHE_BACKEND'], app.config['CACHE_URL']),
+                              ttl=app.config['CACHE_TTL'])
+
+def bump_cache_version(namespace, user_id=None):
+    result_cache.bump(namespace, user_id)
+
+def bump_cache_version_on_commit(namespace, user_id=None, session=None):
+    """bump_cache_version() once the current transaction commits (dropped if it rolls back).
+    Bumping before the commit lets a concurrent reader cache the old rows under the new version."""
+    (session or db.session).info.setdefault('cache_bumps', set()).add((namespace, user_id))
+
+@event.listens_for(db.session, 'after_commit')
+def _bump_committed_caches(session):
+    for namespace, user_id in session.info.pop('cache_bumps', ()):
+        bump_cache_version(namespace, user_id)
+
+@event.listens_for(db.session, 'after_rollback')
+def _forget_cache_bumps(session):
+    session.info.pop('cache_bumps', None)
+
+def cached(namespace, user_id, compute, key=None):
+    """Return compute() for (namespace, user_id), reusing the stored result while the
+    versions and the extra `key` (e.g. today's date) are unchanged"""
+    return result_cache.get_or_compute(namespace, user_id, compute, key)
+
+# Server-sent events (see backend/events.py)
+event_bus = create_bus(app.config['EVENTS_BACKEND'], app.config['EVENTS_URL'])
+
+def publish_event(user_id, event, data):
+    """Push an event to the user's open /api/events streams on every worker. Best effort:
+    clients that miss one still catch up through /api/sync."""
+    try:
+        event_bus.publish(user_id, event, data)
+    except Exception:
+        app.logger.exception('could not publish %s event for user %s', event, user_id)
+
+@event.listens_for(db.session, 'after_commit')
+def _publish_changes(session):
+    changed = session.info.pop('changed_resources', None)
+    for user_id, resources in (changed or {}).items():
+        publish_event(user_id, 'sync', {'resources': sorted(resources)})
+        # Bill and budget alerts need a query, which can't run in this hook: send them after the request
+        if resources & {'bills', 'budgets'} and has_request_context():
+            g.setdefault('notify_users', set()).add(user_id)
+
+@event.listens_for(db.session, 'after_rollback')
+def _forget_changes(session):
+    session.info.pop('changed_resources', None)
+
+@app.after_request
+def _push_notifications(response):
+    for user_id in g.pop('notify_users', ()):
+        publish_event(user_id, 'notifications', user_notifications(user_id))
+    return response
+
+# Rate limiting and admission control
+def _too_many(retry_after, scope):
+    seconds = max(1, math.ceil(retry_after))
+    response = jsonify({'error': 'rate limit exceeded', 'scope': scope, 'retry_after': seconds})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(seconds)
+    return response
+
+def rate_limited(key, limits, scope, cost=None):
+    """Take this request's cost from the `key` bucket; returns a 429 response or None"""
+    if not app.config['RATE_LIMIT_ENABLED']:
+        return None
+    capacity, rate = limits
+    cost = ROUTE_COSTS.get(request.endpoint, 1) if cost is None else cost
+    allowed, retry_after = result_cache.store.token_bucket(f'{result_cache.prefix}:rl:{key}', cost, rate, capacity)
+    return None if allowed else _too_many(retry_after, scope)
+
+@app.before_request
+def _rate_limit_ip():
+    if request.path.startswith('/api/'):
+        return rate_limited(f'ip:{request.remote_addr}', app.config['RATE_LIMIT_IP'], 'ip')
+
+def _admit_user():
+    """Per-user bucket, then a concurrency slot on heavy routes (released at teardown)"""
+    error = rate_limited(f'user:{g.current_user.id}', app.config['RATE_LIMIT_USER'], 'user')
+    if error or not app.config['RATE_LIMIT_ENABLED'] or request.endpoint not in HEAVY_ROUTES:
+        return error
+    key = f'{result_cache.prefix}:rl:running:{g.current_user.id}'
+    # The TTL, restarted on every change, frees slots held by a worker that died mid-request;
+    # the floor keeps a release that lands after it expired from going negative
+    if result_cache.store.incr(key, 1, ttl=300) > app.config['RATE_LIMIT_CONCURRENCY']:
+        result_cache.store.incr(key, -1, ttl=300, floor=0)
+        return _too_many(1, 'concurrency')
+    g.rate_limit_slot = key
+    return None
+
+@app.teardown_request
+def _release_concurrency_slot(exc):
+    # Streamed responses (the CSV export) keep the request context, and the slot, until the last chunk
+    key = g.pop('rate_limit_slot', None)
+    if key:
+        result_cache.store.incr(key, -1, ttl=300, floor=0)
+
+# Password hashing
+class HashingBusy(Exception):
+    """Every hashing slot is taken, or the hash didn't finish within PASSWORD_HASH_TIMEOUT"""
+
+class PasswordHasher:
+    """werkzeug's hash/verify on a bounded thread pool. hashlib's scrypt and pbkdf2 drop
+    the GIL while they run, so the pool size is how many cores hashing may take and the
+    request threads stay free for everything else."""
+
+    def __init__(self, method, workers, queue, timeout):
+        self.config = (method, workers, queue, timeout)
+        self.method, self.timeout = method, timeout
+        self.executor = ThreadPoolExecutor(workers, thread_name_prefix='password-hash')
+        self.slots = threading.BoundedSemaphore(workers + queue)
+        self._dummy = generate_password_hash(secrets.token_hex(8), method)
+        self.prefix = self._dummy.split('$', 1)[0]  # what a hash made now starts with, e.g. 'scrypt:32768:8:1'
+        self.latency = None  # moving average of verify time, queueing included
+        self._latency_lock = threading.Lock()
+
+    def _run(self, fn, *args):
+        if not self.slots.acquire(blocking=False):
+            raise HashingBusy()
+        try:
+            future = self.executor.submit(fn, *args)
+        except Exception:
+            self.slots.release()
+            raise
+        future.add_done_callback(lambda _: self.slots.release())
+        try:
+            return future.result(self.timeout)
+        except FutureTimeout:
+            future.cancel()  # still queued: never runs; already running: frees its slot when done
+            raise HashingBusy()
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method)
+
+    def verify(self, password_hash, password):
+        start = time.perf_counter()
+        ok = self._run(check_password_hash, password_hash, password)
+        elapsed = time.perf_counter() - start
+        with self._latency_lock:
+            self.latency = elapsed if self.latency is None else 0.8 * self.latency + 0.2 * elapsed
+        return ok
+
+    def needs_rehash(self, password_hash):
+        return password_hash.split('$', 1)[0] != self.prefix
+
+    def reject(self):
+        """Take about as long as a wrong password does, without spending CPU on a hash,
+        so response times don't tell which usernames exist. Holds a slot like verify()
+        does, so a full pool answers 503 whether or not the username exists."""
+        if self.latency is None:
+            self.verify(self._dummy, '')  # nothing measured yet: pay for one real check
+            return
+        if not self.slots.acquire(blocking=False):
+            raise HashingBusy()
+        try:
+            time.sleep(self.latency * random.uniform(0.9, 1.1))
+        finally:
+            self.slots.release()
+
+_hasher = None
+_hasher_lock = threading.Lock()
+
+def password_hasher():
+    """The process's PasswordHasher, rebuilt when the PASSWORD_HASH_* settings change"""
+    global _hasher
+    config = (app.config['PASSWORD_HASH_METHOD'], app.config['PASSWORD_HASH_WORKERS'],
+              app.config['PASSWORD_HASH_QUEUE'], app.config['PASSWORD_HASH_TIMEOUT'])
+    with _hasher_lock:
+        if _hasher is None or _hasher.config != config:
+            if _hasher is not None:
+                _hasher.executor.shutdown(wait=False)
+            _hasher = PasswordHasher(*config)
+        return _hasher
+
+@app.errorhandler(HashingBusy)
+def _hashing_busy(exc):
+    response = jsonify({'error': 'server busy, try again shortly'})
+    response.status_code = 503
+    response.headers['Retry-After'] = '2'
+    return response
+
 # Routes: auth
 @app.route('/api/register', methods=['POST'])
 def register():
@@ -225,7 +926,7 @@ def register():
         return jsonify({'error':'username & password required'}), 400
     if User.query.filter_by(username=username).first():
         return jsonify({'error':'username taken'}), 400
-    u = User(username=username, password_hash=generate_password_hash(password))
+    u = User(username=username, password_hash=password_hasher().hash(password))
     db.session.add(u); db.session.commit()
     token = create_token(u.id)
     return jsonify({'status':'ok','token': token, 'user': {'id': u.id, 'username': u.username, 'full_name': u.full_name, 'email': u.email, 'mobile': u.mobile, 'hobbies': u.hobbies, 'bio': u.bio, 'avatar_url': u.avatar_url}}), 201
@@ -235,9 +936,24 @@ def login():
     data = request.json or {}
     username = (data.get('username','') or '').strip()
     password = data.get('password','') or ''
+    # Per username and IP: a guesser is throttled on each account, but can't lock its owner out
+    limited = rate_limited(f'login:{username.lower()}:{request.remote_addr}', app.config['RATE_LIMIT_LOGIN'],
+                           'login', cost=1)
+    if limited:
+        return limited
+    hasher = password_hasher()
     u = User.query.filter_by(username=username).first()
-    if not u or not check_password_hash(u.password_hash, password):
+    if not u:
+        hasher.reject()
         return jsonify({'error':'invalid credentials'}), 401
+    if not hasher.verify(u.password_hash, password):
+        return jsonify({'error':'invalid credentials'}), 401
+    if hasher.needs_rehash(u.password_hash):
+        try:
+            u.password_hash = hasher.hash(password)
+            db.session.commit()
+        except HashingBusy:
+            pass  # upgraded on a later login
     token = create_token(u.id)
     return jsonify({'status':'ok','token': token, 'user': {'id': u.id, 'username': u.username, 'full_name': u.full_name, 'email': u.email, 'mobile': u.mobile, 'hobbies': u.hobbies, 'bio': u.bio, 'avatar_url': u.avatar_url}})
 
@@ -296,16 +1012,88 @@ def update_profile():
     }})
 
 # Transactions (protected)
+def parse_splits(raw, amount):
+    """[{category, amount, notes}] -> (TransactionSplit list, error). Splits must add up to
+    the transaction amount; an empty list means the transaction isn't split."""
+    if not isinstance(raw, list):
+        return None, 'splits must be a list'
+    splits = []
+    for s in raw:
+        try:
+            splits.append(TransactionSplit(category=str(s['category']), amount=float(s['amount']), notes=s.get('notes')))
+        except (TypeError, KeyError, ValueError):
+            return None, 'each split needs a category and a numeric amount'
+    total = sum(s.amount for s in splits)
+    if splits and abs(total - amount) > 0.005:
+        return None, f'splits add up to {total:.2f}, not the transaction amount {amount:.2f}'
+    return splits, None
+
+def signed_amount(type_, amount):
+    return (amount or 0) if type_ == 'income' else -(amount or 0)
+
+# SQL version of signed_amount()
+SIGNED_AMOUNT = case((Transaction.type == 'income', Transaction.amount), else_=-Transaction.amount)
+
+def post_to_account(account_id, delta):
+    """Apply a transaction's effect to its account's balance with a single UPDATE"""
+    if account_id and delta:
+        Account.query.filter_by(id=account_id).update(
+            {Account.balance: Account.balance + delta}, synchronize_session=False)
+        record_changes(Account, Account.id == account_id)
+
+def owned_account_id(user, data, default=None):
+    """account_id from the request body, or an error if it isn't one of the user's accounts"""
+    account_id = data.get('account_id', default)
+    if account_id is None:
+        return None, None
+    if not Account.query.filter_by(id=account_id, user_id=user.id).count():
+        return None, 'unknown account_id'
+    return account_id, None
+
+def transaction_row(t):
+    return {
+        'id': t.id, 'type': t.type, 'category': t.category, 'amount': t.amount,
+        'merchant': t.merchant, 'date': t.date, 'time': t.time, 'account_id': t.account_id,
+        'splits': [{'id': s.id, 'category': s.category, 'amount': s.amount, 'notes': s.notes} for s in t.splits]
+    }
+
+def transaction_filters(args):
+    """SQL filters for ?from=, ?to= and ?q= (empty when none are given)"""
+    where = []
+    if args.get('from'):
+        where.append(Transaction.date >= args['from'])
+    if args.get('to'):
+        where.append(Transaction.date <= args['to'])
+    if args.get('q'):
+        pattern = f"%{args['q']}%"
+        where.append(Transaction.merchant.ilike(pattern) | Transaction.category.ilike(pattern))
+    return where
+
+def split_lines(*where):
+    """Transactions as one row per split (or one row for an unsplit transaction), so
+    aggregates by category see each part of a split purchase"""
+    return select(
+        Transaction.id.label('transaction_id'), Transaction.date, Transaction.created_at, Transaction.type,
+        func.coalesce(TransactionSplit.category, Transaction.category).label('category'),
+        func.coalesce(TransactionSplit.amount, Transaction.amount).label('amount')
+    ).outerjoin(TransactionSplit, TransactionSplit.transaction_id == Transaction.id).where(*where).subquery()
+
 @app.route('/api/transactions', methods=['GET', 'POST'])
 @auth_required
 def transactions():
+    """GET lists the (hot) transactions, newest first. Searching with ?from=, ?to=
+    (YYYY-MM-DD) and/or ?q= (merchant or category) also returns archived
+    transactions in range, flagged 'archived'."""
     user = g.current_user
     if request.method == 'GET':
-        items = Transaction.query.filter_by(user_id=user.id).order_by(Transaction.created_at.desc()).all()
-        return jsonify([{
-            'id': t.id, 'type': t.type, 'category': t.category, 'amount': t.amount,
-            'merchant': t.merchant, 'date': t.date, 'time': t.time
-        } for t in items])
+        search = transaction_filters(request.args)
+        # Splits for the whole page come back in one extra SELECT .. IN, not one per row
+        items = Transaction.query.options(selectinload(Transaction.splits)).filter(
+            Transaction.user_id == user.id, *search).order_by(Transaction.created_at.desc()).all()
+        result = [transaction_row(t) for t in items]
+        if search:
+            result += archived_transactions(user.id, request.args.get('from'), request.args.get('to'), request.args.get('q'))
+        return jsonify(result)
     data = request.json or {}
     t = Transaction(
         user_id=user.id,
@@ -316,9 +1104,18 @@ def transactions():
         date=data.get('date', datetime.datetime.utcnow().strftime('%Y-%m-%d')),
         time=data.get('time','')
     )
+    splits, error = parse_splits(data.get('splits', []), t.amount)
+    t.account_id, account_error = owned_account_id(user, data)
+    if error or account_error:
+        return jsonify({'error': error or account_error}), 400
+    t.splits = splits
     db.session.add(t)
+    post_to_account(t.account_id, signed_amount(t.type, t.amount))
+    db.session.flush()
+    anomalies = score_transaction(t)  # in the same commit, so a scoring error can't leave the insert half done
     db.session.commit()
-    return jsonify({'status':'ok','id':t.id}), 201
+    columnar_append(t)
+    return jsonify({'status':'ok','id':t.id,'anomalies':anomalies}), 201
 
 @app.route('/api/transactions/<int:id>', methods=['PUT','DELETE'])
 @auth_required
@@ -327,35 +1124,338 @@ def transaction_modify(id):
     t = Transaction.query.get_or_404(id)
     if t.user_id != user.id:
         return jsonify({'error':'not authorized'}), 403
+    # Reverse the old posting; the updated transaction is posted again below
+    post_to_account(t.account_id, -signed_amount(t.type, t.amount))
     if request.method == 'DELETE':
+        Anomaly.query.filter_by(transaction_id=t.id).delete(synchronize_session=False)
         db.session.delete(t); db.session.commit()
+        columnar_invalidate(user.id)
         return jsonify({'status':'deleted'})
     data = request.json or {}
+    amount = float(data.get('amount', t.amount) or 0)
+    # Replace the splits when given; otherwise the existing ones must still add up
+    raw = data['splits'] if 'splits' in data else [{'category': s.category, 'amount': s.amount} for s in t.splits]
+    splits, error = parse_splits(raw, amount)
+    account_id, account_error = owned_account_id(user, data, t.account_id)
+    if error or account_error:
+        db.session.rollback()
+        return jsonify({'error': error or account_error}), 400
+    if 'splits' in data:
+        t.splits = splits
+    t.account_id = account_id
     t.type = data.get('type', t.type)
     t.category = data.get('category', t.category)
-    t.amount = float(data.get('amount', t.amount) or 0)
+    t.amount = amount
     t.merchant = data.get('merchant', t.merchant)
     t.date = data.get('date', t.date)
     t.time = data.get('time', t.time)
+    post_to_account(t.account_id, signed_amount(t.type, t.amount))
     db.session.commit()
+    columnar_invalidate(user.id)
     return jsonify({'status':'updated'})
 
+# Transaction archive
+def archive_transactions(cutoff, user_ids=None):
+    """Move transactions dated before `cutoff` (YYYY-MM-DD) into compressed archive
+    segments, one transaction per user. Their totals are added to MonthlyRollup and
+    their effect on account balances is folded into opening_balance, so balances,
+    analytics and the running ledger stay the same. Returns {user_id: rows archived}."""
+    old = and_(Transaction.date < cutoff, Transaction.date >= '1900-01-01')  # skip blank or malformed dates
+    if user_ids is None:
+        user_ids = db.session.execute(select(Transaction.user_id).where(old).distinct()).scalars().all()
+    archived = {}
+    segment_rows = app.config['ARCHIVE_SEGMENT_ROWS']
+    for user_id in user_ids:
+        where = (Transaction.user_id == user_id, old)
+        lines = split_lines(*where)
+        month = func.substr(lines.c.date, 1, 7)
+        rollups = db.session.execute(select(month, lines.c.type, lines.c.category, func.sum(lines.c.amount), func.count())
+                                     .group_by(month, lines.c.type, lines.c.category)).all()
+        if not rollups:
+            continue
+        upsert(MonthlyRollup, [{'user_id': user_id, 'month': m, 'type': t, 'category': c, 'amount': a, 'count': n}
+                               for m, t, c, a, n in rollups], ['user_id', 'month', 'type', 'category'], add=('amount', 'count'))
+        deltas = db.session.execute(select(Transaction.account_id, func.sum(SIGNED_AMOUNT)).where(
+            *where, Transaction.account_id.isnot(None)).group_by(Transaction.account_id)).all()
+        for account_id, delta in deltas:
+            Account.query.filter_by(id=account_id).update(
+                {Account.opening_balance: func.coalesce(Account.opening_balance, 0) + delta}, synchronize_session=False)
+        if deltas:
+            record_changes(Account, Account.id.in_([account_id for account_id, _ in deltas]))
+
+        rows = Transaction.query.options(selectinload(Transaction.splits)).filter(*where).order_by(
+            Transaction.date, Transaction.id)
+        batch = []
+        for t in itertools.chain(rows.yield_per(1000), [None]):
+            if t is not None:
+                row = transaction_row(t)
+                row['created_at'] = t.created_at.isoformat() if t.created_at else None
+                batch.append(row)
+            if batch and (t is None or len(batch) >= segment_rows):
+                db.session.add(TransactionArchive(
+                    user_id=user_id, first_date=batch[0]['date'][:10], last_date=batch[-1]['date'][:10], count=len(batch),
+                    data=zlib.compress(json.dumps(batch, separators=(',', ':')).encode(), 9)))
+                archived[user_id] = archived.get(user_id, 0) + len(batch)
+                batch = []
+        ids = select(Transaction.id).where(*where)
+        record_changes(Transaction, *where, deleted=True)
+        db.session.execute(TransactionSplit.__table__.delete().where(TransactionSplit.transaction_id.in_(ids)))
+        db.session.execute(Anomaly.__table__.delete().where(Anomaly.transaction_id.in_(ids)))
+        db.session.execute(Transaction.__table__.delete().where(*where))
+        db.session.commit()
+        columnar_invalidate(user_id)
+    return archived
+
+def archived_transactions(user_id, date_from=None, date_to=None, q=None, lazy=False):
+    """Archived transactions matching the same filters as transaction_filters(), newest
+    segment first. Only segments overlapping the date range are read and decompressed."""
+    segments = select(TransactionArchive.id).where(TransactionArchive.user_id == user_id)
+    if date_from:
+        segments = segments.where(TransactionArchive.last_date >= date_from)
+    if date_to:
+        segments = segments.where(TransactionArchive.first_date <= date_to)
+    segment_ids = db.session.execute(segments.order_by(TransactionArchive.last_date.desc())).scalars().all()
+    q = q.lower() if q else None
+
+    def rows():
+        for segment_id in segment_ids:
+            data = db.session.execute(select(TransactionArchive.data).where(TransactionArchive.id == segment_id)).scalar()
+            for row in reversed(json.loads(zlib.decompress(data))):
+                if ((not date_from or row['date'] >= date_from) and (not date_to or row['date'] <= date_to)
+                        and (not q or q in row['merchant'].lower() or q in row['category'].lower())):
+                    row['archived'] = True
+                    yield row
+    return rows() if lazy else list(rows())
+
+# Columnar analytics store
+# One directory per user under COLUMNAR_DIR holding a fixed-width binary file per
+# column (one row per split, like split_lines) and meta.json with the row count,
+# category names and file generation. New transactions are appended in place; edits
+# and deletes drop meta.json and the next read rebuilds a new generation, so files
+# that readers have mapped are only ever extended, never rewritten.
+COLUMNS = (('transaction_id', np.int64), ('day', np.int32), ('created', np.int32),
+           ('amount', np.float64), ('category', np.int32), ('income', np.bool_))
+NO_DAY = np.iinfo(np.int32).min  # unparseable date
+_columnar_thread_locks = defaultdict(threading.Lock)
+
+@contextlib.contextmanager
+def _columnar_lock(path):
+    """Per-user lock across threads and (where fcntl exists) worker processes"""
+    with _columnar_thread_locks[path]:
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, 'lock'), 'a') as lock_file:  # closing releases the flock
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield
+
+def _days(values):
+    """Dates/datetimes or 'YYYY-MM-DD..' strings -> int32 day numbers (NO_DAY if unparseable)"""
+    try:
+        days = np.array([v[:10] if isinstance(v, str) else v for v in values], dtype='datetime64[D]')
+    except ValueError:
+        days = np.array([_day_or_nat(v) for v in values], dtype='datetime64[D]')
+    out = np.full(len(days), NO_DAY, dtype=np.int32)
+    ok = ~np.isnat(days)
+    out[ok] = days[ok].astype(np.int64)
+    return out
+
+def _day_or_nat(value):
+    try:
+        return np.datetime64(value[:10] if isinstance(value, str) else value, 'D')
+    except ValueError:
+        return np.datetime64('NaT')
+
+def _columns_from_rows(rows, categories):
+    """(transaction_id, date, created_at, type, category, amount) rows -> column arrays;
+    new category names are appended to `categories`"""
+    codes = {c: k for k, c in enumerate(categories)}
+    ids, dates, created, types, names, amounts = zip(*rows) if rows else ((),) * 6
+    category = np.array([codes.setdefault(c, len(codes)) for c in names], dtype=np.int32)
+    categories[len(categories):] = list(codes)[len(categories):]
+    return {'transaction_id': np.array(ids, dtype=np.int64), 'day': _days(dates), 'created': _days(created),
+            'amount': np.array(amounts, dtype=np.float64), 'category': category,
+            'income': np.array([t == 'income' for t in types], dtype=np.bool_)}
+
+def _read_meta(path):
+    try:
+        with open(os.path.join(path, 'meta.json')) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _write_meta(path, meta):
+    tmp = os.path.join(path, 'meta.json.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(meta, f)
+    os.replace(tmp, os.path.join(path, 'meta.json'))
+
+def _write_columns(path, generation, columns, offset):
+    for name, dtype in COLUMNS:
+        with open(os.path.join(path, f'g{generation}.{name}'), 'r+b' if offset else 'wb') as f:
+            f.seek(offset * np.dtype(dtype).itemsize)
+            f.write(np.ascontiguousarray(columns[name], dtype=dtype).tobytes())
+            f.truncate()  # drop anything a crashed append left past the recorded rows
+
+def _columnar_rebuild(user_id, path):
+    # Never reuse a generation: meta.json may be gone but its files can still be mapped
+    generation = 1 + max([int(name[1:].split('.')[0]) for name in os.listdir(path) if re.match(r'g\d+\.', name)] or [0])
+    lines = split_lines(Transaction.user_id == user_id)
+    rows = db.session.execute(select(lines).order_by(lines.c.transaction_id)).all()
+    categories = []
+    _write_columns(path, generation, _columns_from_rows(rows, categories), 0)
+    # max_id: the high-water mark columnar_append() checks before appending
+    meta = {'generation': generation, 'rows': len(rows), 'categories': categories, 'max_id': rows[-1][0] if rows else 0}
+    _write_meta(path, meta)
+    for name in os.listdir(path):
+        if name.startswith('g') and not name.startswith(f'g{generation}.'):
+            try:
+                os.remove(os.path.join(path, name))  # readers keep their existing mappings
+            except OSError:
+                pass
+    return meta
+
+def user_columns(user_id):
+    """({column: array}, category names) for a user's transactions, one row per split.
+    Memory-mapped from the columnar store when enabled, otherwise read from SQL."""
+    if not app.config['COLUMNAR_STORE']:
+        lines = split_lines(Transaction.user_id == user_id)
+        categories = []
+        return _columns_from_rows(db.session.execute(select(lines)).all(), categories), categories
+    path = os.path.join(app.config['COLUMNAR_DIR'], str(user_id))
+    with _columnar_lock(path):
+        meta = _read_meta(path) or _columnar_rebuild(user_id, path)
+    rows = meta['rows']
+    return {name: np.memmap(os.path.join(path, f"g{meta['generation']}.{name}"), dtype=dtype, mode='r', shape=(rows,))
+            if rows else np.zeros(0, dtype=dtype) for name, dtype in COLUMNS}, meta['categories']
+
+def report_columns(user_id, start, end):
+    """user_columns() plus the archived transactions dated start..end (datetime64[D]), read
+    from the archive segments: archive.py moves old ones out of the table and the columnar store"""
+    columns, categories = user_columns(user_id)
+    rows = [(row['id'], row['date'], row.get('created_at'), row['type'], s['category'], s['amount'])
+            for row in archived_transactions(user_id, str(start), str(end), lazy=True) for s in row['splits'] or [row]]
+    if not rows:
+        return columns, categories
+    categories = list(categories)
+    archived = _columns_from_rows(rows, categories)
+    return {name: np.concatenate([columns[name], archived[name]]) for name, _ in COLUMNS}, categories
+
+def columnar_append(t):
+    """Append a new transaction (and its splits) to the user's store, if it has been built
+    and doesn't have it yet (a rebuild between the commit and this call read it from SQL)"""
+    if not app.config['COLUMNAR_STORE']:
+        return
+    path = os.path.join(app.config['COLUMNAR_DIR'], str(t.user_id))
+    rows = [(t.id, t.date, t.created_at, t.type, s.category, s.amount) for s in t.splits] or \
+        [(t.id, t.date, t.created_at, t.type, t.category, t.amount)]
+    with _columnar_lock(path):
+        meta = _read_meta(path)
+        if meta is None:
+            return  # built from SQL on the next read
+        # Ids above the high-water mark can't be stored yet. At or below it look the id up:
+        # PostgreSQL can commit ids out of order, so the rebuild may have missed this one
+        if t.id <= meta.get('max_id', t.id) and meta['rows'] and t.id in np.memmap(
+                os.path.join(path, f"g{meta['generation']}.transaction_id"), dtype=np.int64, mode='r', shape=(meta['rows'],)):
+            return
+        _write_columns(path, meta['generation'], _columns_from_rows(rows, meta['categories']), meta['rows'])
+        meta['rows'] += len(rows)
+        meta['max_id'] = max(meta.get('max_id', 0), t.id)
+        _write_meta(path, meta)
+
+def columnar_invalidate(user_id):
+    if not app.config['COLUMNAR_STORE']:
+        return
+    path = os.path.join(app.config['COLUMNAR_DIR'], str(user_id))
+    with _columnar_lock(path):
+        try:
+            os.remove(os.path.join(path, 'meta.json'))
+        except FileNotFoundError:
+            pass
+
+def category_totals(columns, categories):
+    """[(category, total expense)] over the columns"""
+    expense = ~columns['income']
+    totals = np.bincount(columns['category'][expense], weights=columns['amount'][expense], minlength=len(categories))
+    return [(name, float(total)) for name, total in zip(categories, totals) if total]
+
+def monthly_totals(columns, categories, since, category=None):
+    """[(YYYY-MM, type, total)] for rows created on/after `since`, like the spending-trend SQL"""
+    keep = (columns['created'] >= since.astype(np.int64)) & (columns['day'] != NO_DAY)
+    if category is not None:
+        keep &= columns['category'] == (categories.index(category) if category in categories else -1)
+    months = columns['day'][keep].astype('datetime64[D]').astype('datetime64[M]')
+    keys, inverse = np.unique(months.astype(np.int64) * 2 + columns['income'][keep], return_inverse=True)
+    sums = np.bincount(inverse, weights=columns['amount'][keep], minlength=len(keys))
+    return [(str(np.datetime64(int(k) // 2, 'M')), 'income' if k % 2 else 'expense', float(s)) for k, s in zip(keys, sums)]
+
+def spending_report(columns, categories, start, end, window):
+    """Per-category expense stats (count, total, mean, median, p90) and daily spending
+    with a trailing `window`-day average for start..end (datetime64[D], inclusive)"""
+    first, last = int(start.astype(np.int64)), int(end.astype(np.int64))
+    keep = ~columns['income'] & (columns['day'] >= first) & (columns['day'] <= last)
+    day, amount, category = columns['day'][keep], columns['amount'][keep], columns['category'][keep]
+
+    # Percentiles for every category at once: sort by (category, amount), then index into each run
+    order = np.lexsort((amount, category))
+    amount_sorted, category_sorted = amount[order], category[order]
+    codes, starts, counts = np.unique(category_sorted, return_index=True, return_counts=True)
+    totals = np.add.reduceat(amount_sorted, starts) if len(starts) else np.zeros(0)
+
+    def percentile(q):
+        pos = starts + q * (counts - 1)
+        lo, hi = np.floor(pos).astype(int), np.ceil(pos).astype(int)
+        return amount_sorted[lo] + (amount_sorted[hi] - amount_sorted[lo]) * (pos - lo)
+    p50, p90 = (percentile(0.5), percentile(0.9)) if len(starts) else (totals, totals)
+
+    daily = np.bincount(day - first, weights=amount, minlength=last - first + 1)
+    running = np.concatenate([[0.0], np.cumsum(daily)])
+    end_index = np.arange(1, len(daily) + 1)
+    span = np.minimum(end_index, window)  # shorter windows at the start of the range
+    rolling = (running[end_index] - running[end_index - span]) / span
+    return {
+        'categories': sorted([{
+            'name': categories[c], 'count': int(n), 'total': round(float(t), 2), 'average': round(float(t / n), 2),
+            'median': round(float(m), 2), 'p90': round(float(p), 2)
+        } for c, n, t, m, p in zip(codes, counts, totals, p50, p90)], key=lambda x: -x['total']),
+        'daily': [{'date': str(start + k), 'spent': round(float(daily[k]), 2), 'rolling_average': round(float(rolling[k]), 2)}
+                  for k in range(len(daily))]
+    }
+
+@app.route('/api/analytics/report')
+@auth_required
+def analytics_report():
+    """Ad-hoc spending report: ?from=&to= (YYYY-MM-DD, default the last 90 days) and
+    ?window= days for the rolling average (default 7)"""
+    user = g.current_user
+    today = np.datetime64(datetime.date.today(), 'D')
+    try:
+        end = np.datetime64(request.args.get('to') or today, 'D')
+        start = np.datetime64(request.args.get('from') or end - 89, 'D')
+        window = int(request.args.get('window', 7))
+    except ValueError:
+        return jsonify({'error': 'from/to must be YYYY-MM-DD and window an integer'}), 400
+    if not (0 <= (end - start).astype(int) <= 3660 and 1 <= window <= 365):
+        return jsonify({'error': 'range must be 1-3661 days and window 1-365'}), 400
+    report = spending_report(*report_columns(user.id, start, end), start, end, window)
+    return jsonify({'from': str(start), 'to': str(end), 'window': window, **report})
+
 # Budgets, Goals, Bills: similar protection added
+def budget_row(b):
+    return {
+        'id': b.id,
+        'category': b.category,
+        'limit': b.limit,
+        'spent': b.spent,
+        'color': b.color
+    }
+
 @app.route('/api/budgets', methods=['GET','POST'])
 @auth_required
 def budgets_route():
     user = g.current_user
     if request.method == 'GET':
         items = Budget.query.filter_by(user_id=user.id).all()
-        return jsonify([
-            {
-                'id': b.id,
-                'category': b.category,
-                'limit': b.limit,
-                'spent': b.spent,
-                'color': b.color
-            } for b in items
-        ])
+        return jsonify([budget_row(b) for b in items])
 
     data = request.json or {}
     category = data.get('category', '').strip()
@@ -396,13 +1496,16 @@ def budget_modify(id):
     db.session.commit()
     return jsonify({'status':'updated'})
 
+def goal_row(goal):
+    return {'id':goal.id,'name':goal.name,'target':goal.target,'current':goal.current,'deadline':goal.deadline,'priority':goal.priority}
+
 @app.route('/api/goals', methods=['GET','POST'])
 @auth_required
 def goals_route():
     user = g.current_user
     if request.method == 'GET':
         items = Goal.query.filter_by(user_id=user.id).all()
-        return jsonify([{'id':g.id,'name':g.name,'target':g.target,'current':g.current,'deadline':g.deadline,'priority':g.priority} for g in items])
+        return jsonify([goal_row(goal) for goal in items])
     data = request.json or {}
     g2 = Goal(user_id=user.id, name=data.get('name','Goal'), target=float(data.get('target',0) or 0), current=float(data.get('current',0) or 0), deadline=data.get('deadline',''), priority=data.get('priority','low'))
     db.session.add(g2); db.session.commit()
@@ -427,16 +1530,20 @@ def goal_modify(id):
     db.session.commit()
     return jsonify({'status':'updated'})
 
+def bill_row(b):
+    return {'id':b.id,'name':b.name,'amount':b.amount,'due_date':b.due_date,'status':b.status,'auto':b.auto}
+
 @app.route('/api/bills', methods=['GET','POST'])
 @auth_required
 def bills_route():
     user = g.current_user
     if request.method == 'GET':
         items = Bill.query.filter_by(user_id=user.id).all()
-        return jsonify([{'id':b.id,'name':b.name,'amount':b.amount,'due_date':b.due_date,'status':b.status,'auto':b.auto} for b in items])
+        return jsonify([bill_row(b) for b in items])
     data = request.json or {}
     b = Bill(user_id=user.id, name=data.get('name','Bill'), amount=float(data.get('amount',0) or 0), due_date=data.get('due_date',''), status=data.get('status','pending'), auto=bool(data.get('auto',False)))
     db.session.add(b); db.session.commit()
+    bump_cache_version('forecast', user.id)
     return jsonify({'status':'ok','id':b.id}), 201
 
 @app.route('/api/bills/<int:id>', methods=['PUT','DELETE'])
@@ -448,6 +1555,7 @@ def bill_modify(id):
         return jsonify({'error':'not authorized'}), 403
     if request.method == 'DELETE':
         db.session.delete(b); db.session.commit()
+        bump_cache_version('forecast', user.id)
         return jsonify({'status':'deleted'})
     data = request.json or {}
     if 'toggle_paid' in data:
@@ -458,17 +1566,24 @@ def bill_modify(id):
     b.amount = float(data.get('amount', b.amount) or 0)
     b.due_date = data.get('due_date', b.due_date)
     db.session.commit()
+    bump_cache_version('forecast', user.id)
     return jsonify({'status':'updated','auto':b.auto,'status_now':b.status})
 
 # Notifications endpoint (simple)
-@app.route('/api/notifications')
-@auth_required
-def notifications():
-    user = g.current_user
+def notification_queries(user_id):
+    week_ago = datetime.datetime.utcnow() - datetime.timedelta(days=7)
+    return (select(Bill.__table__).where(Bill.user_id == user_id),
+            select(Budget.__table__).where(Budget.user_id == user_id),
+            select(Anomaly.id, Anomaly.kind, Anomaly.transaction_id, Anomaly.detail, Transaction.merchant, Transaction.amount)
+            .join(Transaction, and_(Transaction.id == Anomaly.transaction_id, Transaction.user_id == Anomaly.user_id))
+            .where(Anomaly.user_id == user_id, Anomaly.status == 'open', Anomaly.created_at >= week_ago)
+            .order_by(Anomaly.id.desc()).limit(10))
+
+def build_notifications(bills, budgets, anomalies=()):
+    """Bill-due, budget and unusual-transaction alerts from the user's rows"""
     notes = []
-    import datetime
     today = datetime.date.today()
-    for b in Bill.query.filter_by(user_id=user.id).all():
+    for b in bills:
         try:
             due = datetime.datetime.strptime(b.due_date, '%Y-%m-%d').date()
             days = (due - today).days
@@ -476,35 +1591,102 @@ def notifications():
                 notes.append({'type':'bill','message':f'Bill {b.name} (₹{b.amount:.2f}) due in {days} day(s).','bill_id':b.id})
         except:
             pass
-    for bud in Budget.query.filter_by(user_id=user.id).all():
+    for bud in budgets:
         if bud.limit and bud.spent / bud.limit > 0.9:
             notes.append({'type':'budget','message':f'Budget {bud.category} is at {bud.spent/bud.limit:.0%} of limit.'})
-    return jsonify(notes)
+    for a in anomalies:
+        detail = json.loads(a.detail or '{}')
+        if a.kind == 'duplicate':
+            message = f'Possible duplicate charge: ₹{a.amount:.2f} at {a.merchant}.'
+        else:
+            message = f"Unusual charge: ₹{a.amount:.2f} at {a.merchant} is {detail.get('ratio', 0):.0f}x your usual {detail.get('category')} spend."
+        notes.append({'type':'anomaly','kind':a.kind,'message':message,'transaction_id':a.transaction_id,'anomaly_id':a.id})
+    return notes
+
+def user_notifications(user_id):
+    return build_notifications(*(db.session.execute(q).all() for q in notification_queries(user_id)))
+
+@app.route('/api/notifications')
+@auth_required
+async def notifications():
+    user = g.current_user
+    return jsonify(build_notifications(*await fetch_all(*notification_queries(user.id))))
+
+@app.route('/api/events')
+@auth_required
+def events():
+    """Server-sent events for the signed-in user: 'sync' (data changed; fetch
+    /api/sync) and 'notifications' (the current alerts, sent on connect and when bills
+    or budgets change). Reconnecting with Last-Event-ID replays what was missed. The
+    stream touches neither the database nor the token after this handler returns;
+    idle streams get a comment line every EVENTS_HEARTBEAT seconds."""
+    user = g.current_user
+    if request.environ.get('wsgi.multiprocess') and not request.environ.get('wsgi.multithread'):
+        # A sync (one request at a time) worker would be taken by this stream for good
+        return jsonify({'error': 'event streams need threaded or ASGI workers (see Procfile)'}), 503
+    last_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    subscription = event_bus.subscribe(user.id, last_id, app.config['EVENTS_MAX_CONNECTIONS'])
+    if subscription is None:
+        return jsonify({'error': 'too many open event streams, try again later'}), 503, {'Retry-After': '10'}
+    notes = user_notifications(user.id)
+    heartbeat = app.config['EVENTS_HEARTBEAT']
+
+    def stream():
+        yield 'retry: 3000\n\n'
+        yield f"event: notifications\ndata: {json.dumps(notes, separators=(',', ':'))}\n\n"
+        try:
+            while True:
+                batch = subscription.get(heartbeat)
+                if not batch:
+                    yield ': ping\n\n'
+                for event_id, name, data in batch:
+                    yield f'id: {event_id}\nevent: {name}\ndata: {data}\n\n'
+        except StreamLost:
+            return  # fell behind: the client reconnects and resumes from its Last-Event-ID
+        finally:
+            subscription.close()
+
+    response = app.response_class(stream(), mimetype='text/event-stream',
+                                  headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    response.call_on_close(subscription.close)
+    return response
 
 # Analytics endpoint for spending trends
 @app.route('/api/analytics/spending-trend')
 @auth_required
-def spending_trend():
+async def spending_trend():
     user = g.current_user
     import datetime
     from collections import defaultdict
     
     # Get last 6 months of transactions
     six_months_ago = datetime.datetime.utcnow() - datetime.timedelta(days=180)
-    transactions = Transaction.query.filter_by(user_id=user.id).filter(
-        Transaction.created_at >= six_months_ago
-    ).all()
+    where = [Transaction.user_id == user.id, Transaction.created_at >= six_months_ago]
+    category = request.args.get('category')
+    if category:
+        # Only the matching parts of split transactions count towards one category
+        lines = split_lines(*where)
+        where = [lines.c.category == category]
+    else:
+        lines = Transaction.__table__
+    month = func.substr(lines.c.date, 1, 7)  # YYYY-MM format
+    # Archived months come from the rollups (empty unless the archive horizon is under six months)
+    rollups = select(MonthlyRollup.month, MonthlyRollup.type, func.sum(MonthlyRollup.amount)).where(
+        MonthlyRollup.user_id == user.id, MonthlyRollup.month >= six_months_ago.strftime('%Y-%m'),
+        *([MonthlyRollup.category == category] if category else [])).group_by(MonthlyRollup.month, MonthlyRollup.type)
+    if app.config['COLUMNAR_STORE']:
+        archived, = await fetch_all(rollups)
+        totals = monthly_totals(*user_columns(user.id), np.datetime64(six_months_ago, 'D'), category)
+    else:
+        totals, archived = await fetch_all(
+            select(month, lines.c.type, func.sum(lines.c.amount)).where(*where).group_by(month, lines.c.type), rollups)
     
     # Group by month
     monthly = defaultdict(lambda: {'income': 0, 'expense': 0})
     months_list = []
     
-    for trans in transactions:
-        month_key = trans.date[:7]  # YYYY-MM format
-        if trans.type == 'income':
-            monthly[month_key]['income'] += trans.amount
-        else:
-            monthly[month_key]['expense'] += trans.amount
+    for month_key, kind, amount in itertools.chain(totals, archived):
+        monthly[month_key]['income' if kind == 'income' else 'expense'] += amount
     
     # Generate last 6 months labels
     today = datetime.datetime.utcnow()
@@ -532,17 +1714,23 @@ def spending_trend():
 # Analytics endpoint for spending by category
 @app.route('/api/analytics/category-breakdown')
 @auth_required
-def category_breakdown():
+async def category_breakdown():
     user = g.current_user
     from collections import defaultdict
     
-    # Get all transactions for this user
-    transactions = Transaction.query.filter_by(user_id=user.id).filter_by(type='expense').all()
-    
-    # Group by category
-    categories = defaultdict(float)
-    for trans in transactions:
-        categories[trans.category] += trans.amount
+    # Expense totals per category, with split purchases counted under each split's category
+    lines = split_lines(Transaction.user_id == user.id, Transaction.type == 'expense')
+    rollups = select(MonthlyRollup.category, func.sum(MonthlyRollup.amount)).where(
+        MonthlyRollup.user_id == user.id, MonthlyRollup.type == 'expense').group_by(MonthlyRollup.category)
+    if app.config['COLUMNAR_STORE']:
+        archived, = await fetch_all(rollups)
+        totals = category_totals(*user_columns(user.id))
+    else:
+        totals, archived = await fetch_all(
+            select(lines.c.category, func.sum(lines.c.amount)).group_by(lines.c.category), rollups)
+    categories = defaultdict(float, totals)
+    for category, amount in archived:
+        categories[category] += amount
     
     # Convert to list format for pie chart
     category_data = []
@@ -559,27 +1747,32 @@ def category_breakdown():
     return jsonify(category_data)
 
 # Accounts Management
+def account_row(a):
+    return {
+        'id': a.id,
+        'name': a.name,
+        'type': a.type,
+        'balance': a.balance,
+        'institution': a.institution,
+        'last_reconciled': a.last_reconciled.isoformat() if a.last_reconciled else None
+    }
+
 @app.route('/api/accounts', methods=['GET', 'POST'])
 @auth_required
 def accounts_route():
     user = g.current_user
     if request.method == 'GET':
         accounts = Account.query.filter_by(user_id=user.id).all()
-        return jsonify([{
-            'id': a.id,
-            'name': a.name,
-            'type': a.type,
-            'balance': a.balance,
-            'institution': a.institution,
-            'last_reconciled': a.last_reconciled.isoformat() if a.last_reconciled else None
-        } for a in accounts])
+        return jsonify([account_row(a) for a in accounts])
 
     data = request.json or {}
+    opening = float(data.get('balance', 0) or 0)
     account = Account(
         user_id=user.id,
         name=data.get('name', 'New Account'),
         type=data.get('type', 'checking'),
-        balance=float(data.get('balance', 0) or 0),
+        balance=opening,
+        opening_balance=opening,
         institution=data.get('institution')
     )
     db.session.add(account)
@@ -595,6 +1788,8 @@ def account_modify(id):
         return jsonify({'error': 'not authorized'}), 403
 
     if request.method == 'DELETE':
+        record_changes(Transaction, Transaction.account_id == account.id)
+        Transaction.query.filter_by(account_id=account.id).update({Transaction.account_id: None})
         db.session.delete(account)
         db.session.commit()
         return jsonify({'status': 'deleted'})
@@ -602,12 +1797,92 @@ def account_modify(id):
     data = request.json or {}
     account.name = data.get('name', account.name)
     account.type = data.get('type', account.type)
-    account.balance = float(data.get('balance', account.balance) or 0)
+    if 'balance' in data:
+        # A typed-in balance is an adjustment: shift the opening balance so the ledger agrees
+        adjustment = float(data['balance'] or 0) - account.balance
+        account.opening_balance = (account.opening_balance or 0) + adjustment
+        account.balance = Account.balance + adjustment
     account.institution = data.get('institution', account.institution)
     db.session.commit()
     return jsonify({'status': 'updated'})
 
+@app.route('/api/accounts/<int:id>/transactions')
+@auth_required
+def account_ledger(id):
+    """The account's transactions, newest first, each with the balance after it.
+    Paged with ?limit= (default 100, max 1000) and ?offset=."""
+    user = g.current_user
+    account = Account.query.get_or_404(id)
+    if account.user_id != user.id:
+        return jsonify({'error': 'not authorized'}), 403
+    try:
+        limit = min(int(request.args.get('limit', 100)), 1000)
+        offset = max(int(request.args.get('offset', 0)), 0)
+    except ValueError:
+        return jsonify({'error': 'limit and offset must be integers'}), 400
+    running = (account.opening_balance or 0) + func.sum(SIGNED_AMOUNT).over(order_by=(Transaction.date, Transaction.id))
+    ledger = select(Transaction.id, Transaction.type, Transaction.category, Transaction.amount, Transaction.merchant,
+                    Transaction.date, Transaction.time, running.label('running_balance')
+                    ).where(Transaction.account_id == account.id).subquery()
+    rows = db.session.execute(select(ledger).order_by(ledger.c.date.desc(), ledger.c.id.desc())
+                              .limit(limit).offset(offset)).all()
+    return jsonify({
+        'account_id': account.id,
+        'balance': account.balance,
+        'opening_balance': account.opening_balance,
+        'transactions': [dict(row._mapping) for row in rows]
+    })
+
+@app.route('/api/accounts/<int:id>/reconcile', methods=['POST'])
+@auth_required
+def account_reconcile(id):
+    """Compare the ledger balance as of a statement date with the statement balance and
+    mark the account reconciled when they agree"""
+    user = g.current_user
+    account = Account.query.get_or_404(id)
+    if account.user_id != user.id:
+        return jsonify({'error': 'not authorized'}), 403
+    data = request.json or {}
+    try:
+        statement_balance = float(data['statement_balance'])
+        as_of = datetime.datetime.strptime(data.get('as_of') or datetime.date.today().isoformat(), '%Y-%m-%d').date()
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'error': 'statement_balance (number) and optional as_of (YYYY-MM-DD) required'}), 400
+    # One range scan over ix_transaction_account_date
+    ledger_balance, count = db.session.execute(
+        select(func.coalesce(func.sum(SIGNED_AMOUNT), 0), func.count(Transaction.id)).where(
+            Transaction.account_id == account.id, Transaction.date <= as_of.isoformat())
+    ).one()
+    ledger_balance += account.opening_balance or 0
+    difference = round(statement_balance - ledger_balance, 2)
+    reconciled = abs(difference) < 0.005
+    if reconciled:
+        account.last_reconciled = datetime.datetime.utcnow()
+        db.session.commit()
+    return jsonify({
+        'reconciled': reconciled,
+        'as_of': as_of.isoformat(),
+        'ledger_balance': round(ledger_balance, 2),
+        'statement_balance': statement_balance,
+        'difference': difference,
+        'transactions': count,
+        'last_reconciled': account.last_reconciled.isoformat() if account.last_reconciled else None
+    })
+
 # Envelope Budgeting
+def envelope_row(e):
+    return {
+        'id': e.id,
+        'category': e.category,
+        'assigned': e.assigned,
+        'activity': e.activity,
+        'available': e.available,
+        'month': e.month,
+        'rollover': e.rollover,
+        'priority': e.priority,
+        'notes': e.notes
+    }
+
 @app.route('/api/envelope-budgets', methods=['GET', 'POST'])
 @auth_required
 def envelope_budgets_route():
@@ -615,17 +1890,7 @@ def envelope_budgets_route():
     if request.method == 'GET':
         month = request.args.get('month', datetime.datetime.utcnow().strftime('%Y-%m'))
         envelopes = EnvelopeBudget.query.filter_by(user_id=user.id, month=month).all()
-        return jsonify([{
-            'id': e.id,
-            'category': e.category,
-            'assigned': e.assigned,
-            'activity': e.activity,
-            'available': e.available,
-            'month': e.month,
-            'rollover': e.rollover,
-            'priority': e.priority,
-            'notes': e.notes
-        } for e in envelopes])
+        return jsonify([envelope_row(e) for e in envelopes])
 
     data = request.json or {}
     month = data.get('month', datetime.datetime.utcnow().strftime('%Y-%m'))
@@ -668,25 +1933,40 @@ def envelope_budget_modify(id):
     return jsonify({'status': 'updated'})
 
 # Recurring Transactions
+def recurring_row(r):
+    return {
+        'id': r.id,
+        'type': r.type,
+        'category': r.category,
+        'merchant': r.merchant,
+        'amount': r.amount,
+        'frequency': r.frequency,
+        'start_date': r.start_date,
+        'next_date': r.next_date,
+        'end_date': r.end_date,
+        'active': r.active,
+        'account_id': r.account_id
+    }
+
+def _recurring_date_error(rule):
+    """400 message when a rule's start/next/end date isn't YYYY-MM-DD (end_date is optional)"""
+    for field in ('start_date', 'next_date', 'end_date'):
+        value = getattr(rule, field)
+        if field == 'end_date' and value is None:
+            continue
+        try:
+            datetime.datetime.strptime(value, '%Y-%m-%d')
+        except (TypeError, ValueError):
+            return f'{field} must be a YYYY-MM-DD date'
+    return None
+
 @app.route('/api/recurring-transactions', methods=['GET', 'POST'])
 @auth_required
 def recurring_transactions_route():
     user = g.current_user
     if request.method == 'GET':
         recurring = RecurringTransaction.query.filter_by(user_id=user.id).all()
-        return jsonify([{
-            'id': r.id,
-            'type': r.type,
-            'category': r.category,
-            'merchant': r.merchant,
-            'amount': r.amount,
-            'frequency': r.frequency,
-            'start_date': r.start_date,
-            'next_date': r.next_date,
-            'end_date': r.end_date,
-            'active': r.active,
-            'account_id': r.account_id
-        } for r in recurring])
+        return jsonify([recurring_row(r) for r in recurring])
 
     data = request.json or {}
     recurring = RecurringTransaction(
@@ -699,11 +1979,15 @@ def recurring_transactions_route():
         frequency=data.get('frequency', 'monthly'),
         start_date=data.get('start_date', datetime.datetime.utcnow().strftime('%Y-%m-%d')),
         next_date=data.get('next_date', datetime.datetime.utcnow().strftime('%Y-%m-%d')),
-        end_date=data.get('end_date'),
+        end_date=data.get('end_date') or None,
         active=data.get('active', True)
     )
+    error = _recurring_date_error(recurring)
+    if error:
+        return jsonify({'error': error}), 400
     db.session.add(recurring)
     db.session.commit()
+    bump_cache_version('forecast', user.id)
     return jsonify({'status': 'ok', 'id': recurring.id}), 201
 
 @app.route('/api/recurring-transactions/<int:id>', methods=['PUT', 'DELETE'])
@@ -717,53 +2001,235 @@ def recurring_transaction_modify(id):
     if request.method == 'DELETE':
         db.session.delete(recurring)
         db.session.commit()
+        bump_cache_version('forecast', user.id)
         return jsonify({'status': 'deleted'})
 
     data = request.json or {}
     recurring.active = data.get('active', recurring.active)
     recurring.amount = float(data.get('amount', recurring.amount) or 0)
     recurring.next_date = data.get('next_date', recurring.next_date)
-    recurring.end_date = data.get('end_date', recurring.end_date)
+    recurring.end_date = data.get('end_date', recurring.end_date) or None
+    error = _recurring_date_error(recurring)
+    if error:
+        db.session.rollback()
+        return jsonify({'error': error}), 400
     db.session.commit()
+    bump_cache_version('forecast', user.id)
     return jsonify({'status': 'updated'})
 
+# Cash-flow forecast
+FORECAST_MAX_DAYS = 730
+FREQUENCY_DAYS = {'daily': 1, 'weekly': 7, 'biweekly': 14}
+FREQUENCY_MONTHS = {'monthly': 1, 'quarterly': 3, 'yearly': 12}
+
+def occurrences(start, frequency, until):
+    """Dates of a recurring rule from `start` through `until` (datetime64[D]); monthly and
+    yearly rules keep the start day-of-month, clipped to shorter months"""
+    if np.isnat(start) or start > until:
+        return np.array([], dtype='datetime64[D]')
+    if frequency in FREQUENCY_DAYS:
+        return np.arange(start, until + 1, FREQUENCY_DAYS[frequency])
+    step = FREQUENCY_MONTHS.get(frequency, 1)
+    first = start.astype('datetime64[M]')
+    months = first + np.arange(0, (until.astype('datetime64[M]') - first).astype(int) + 1, step)
+    month_len = ((months + 1).astype('datetime64[D]') - months.astype('datetime64[D]')).astype(int)
+    day = (start - first.astype('datetime64[D]')).astype(int)
+    dates = months.astype('datetime64[D]') + np.minimum(day, month_len - 1)
+    return dates[dates <= until]
+
+def expand_cash_events(user_id, today, horizon_end):
+    """Recurring rules and unpaid bills as a dated event stream: (dates, account_ids, amounts, labels).
+    Past rule occurrences are assumed posted; overdue bills land on day 0."""
+    dates, accounts, amounts, labels = [], [], [], []
+    for rule in RecurringTransaction.query.filter_by(user_id=user_id, active=True).all():
+        # Rules saved before dates were validated may hold '' (NaT) or junk: skip them
+        start, end = _day_or_nat(rule.next_date), _day_or_nat(rule.end_date)
+        if np.isnat(start) or (rule.end_date and np.isnat(end)):
+            continue
+        end = min(end, horizon_end) if rule.end_date else horizon_end
+        when = occurrences(start, rule.frequency, end)
+        when = when[when >= today]
+        sign = 1.0 if rule.type == 'income' else -1.0
+        dates.append(when)
+        accounts += [rule.account_id] * len(when)
+        amounts.append(np.full(len(when), sign * abs(rule.amount or 0)))
+        labels += [f'{rule.merchant} ({rule.category})'] * len(when)
+    for bill in Bill.query.filter(Bill.user_id == user_id, Bill.status != 'paid').all():
+        try:
+            due = np.datetime64(bill.due_date, 'D')
+        except ValueError:
+            continue
+        if due <= horizon_end:
+            dates.append(np.array([max(due, today)]))
+            accounts.append(None)
+            amounts.append(np.array([-abs(bill.amount or 0)]))
+            labels.append(f'Bill: {bill.name}')
+    if not dates:
+        return np.array([], dtype='datetime64[D]'), [], np.array([]), []
+    return np.concatenate(dates), accounts, np.concatenate(amounts), labels
+
+def _balance_summary(start_date, balances):
+    low = int(np.argmin(balances))
+    negative = np.flatnonzero(balances < 0)
+    return {
+        'starting_balance': float(balances[0]),
+        'ending_balance': float(balances[-1]),
+        'lowest_balance': float(balances[low]),
+        'lowest_date': str(start_date + low),
+        'first_negative_date': str(start_date + negative[0]) if len(negative) else None,
+        'balances': [round(float(b), 2) for b in balances]
+    }
+
+@app.route('/api/forecast')
+@auth_required
+def forecast():
+    """Projected daily balance per account for the next `days` days"""
+    user = g.current_user
+    try:
+        days = int(request.args.get('days', 30))
+    except ValueError:
+        return jsonify({'error': 'days must be an integer'}), 400
+    if not 1 <= days <= FORECAST_MAX_DAYS:
+        return jsonify({'error': f'days must be between 1 and {FORECAST_MAX_DAYS}'}), 400
+    today = np.datetime64(datetime.date.today(), 'D')
+    # Expand once for a year (or the longest horizon asked for) and slice shorter requests
+    span = max(days, 365)
+    dates, event_accounts, amounts, labels = cached(
+        'forecast', user.id, lambda: expand_cash_events(user.id, today, today + span), key=(str(today), span))
+    keep = np.flatnonzero(dates <= today + days)
+
+    accounts = Account.query.filter_by(user_id=user.id).all()
+    index = {a.id: k for k, a in enumerate(accounts)}
+    unassigned = len(accounts)  # events with no (or a deleted) account
+    rows = np.array([index.get(event_accounts[k], unassigned) for k in keep], dtype=int)
+    delta = np.zeros((len(accounts) + 1, days + 1))
+    np.add.at(delta, (rows, (dates[keep] - today).astype(int)), amounts[keep])
+    opening = np.array([a.balance or 0 for a in accounts] + [0.0])
+    balances = opening[:, None] + np.cumsum(delta, axis=1)
+
+    result = [dict(account_id=a.id, name=a.name, **_balance_summary(today, balances[k])) for k, a in enumerate(accounts)]
+    if delta[unassigned].any():
+        result.append(dict(account_id=None, name='Unassigned', **_balance_summary(today, balances[unassigned])))
+    order = keep[np.argsort(dates[keep], kind='stable')]
+    return jsonify({
+        'start': str(today),
+        'days': days,
+        'accounts': result,
+        'total': _balance_summary(today, balances.sum(axis=0)),
+        'events': [{'date': str(dates[k]), 'account_id': event_accounts[k], 'amount': float(amounts[k]),
+                    'description': labels[k]} for k in order]
+    })
+
 # Investments
+def upsert(model, rows, keys, update=(), add=()):
+    """INSERT .. ON CONFLICT(keys) in chunks of 500 rows. Conflicting rows get the
+    `update` columns overwritten and the `add` columns incremented, or are left
+    alone when both are empty."""
+    dialect = db.engine.dialect.name
+    if dialect not in ('sqlite', 'postgresql'):
+        for row in rows:
+            existing = model.query.filter_by(**{k: row[k] for k in keys}).first()
+            if existing is None:
+                db.session.add(model(**row))
+                continue
+            for col in update:
+                setattr(existing, col, row[col])
+            for col in add:
+                setattr(existing, col, (getattr(existing, col) or 0) + row[col])
+        return
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    for start in range(0, len(rows), 500):
+        stmt = insert(model).values(rows[start:start + 500])
+        if update or add:
+            set_ = {c: stmt.excluded[c] for c in update}
+            set_.update({c: getattr(model, c) + stmt.excluded[c] for c in add})
+            stmt = stmt.on_conflict_do_update(index_elements=keys, set_=set_)
+        else:
+            stmt = stmt.on_conflict_do_nothing(index_elements=keys)
+        db.session.execute(stmt)
+
+def upsert_prices(prices):
+    """Set the shared price of each symbol in {symbol: price} and record it as today's close"""
+    now = datetime.datetime.utcnow()
+    today = now.strftime('%Y-%m-%d')
+    upsert(SecurityPrice, [{'symbol': s, 'price': p, 'updated_at': now} for s, p in prices.items()],
+           ['symbol'], ('price', 'updated_at'))
+    upsert(PriceHistory, [{'symbol': s, 'date': today, 'price': p} for s, p in prices.items()],
+           ['symbol', 'date'], ('price',))
+    # Every holding of these symbols shows the new price. The feed ticks all day, so keep
+    # only the newest entry per holding rather than one per tick
+    record_changes(Investment, Investment.symbol.in_(list(prices)))
+    drop_superseded_changes(Investment, Investment.symbol.in_(list(prices)))
+    bump_cache_version_on_commit('performance')
+
+def holdings_query(user_id):
+    """Holdings with their price: the owner's manual price, else the shared market price,
+    else the row's own current_price"""
+    return db.session.query(
+        Investment, db.func.coalesce(Investment.manual_price, SecurityPrice.price, Investment.current_price).label('price')
+    ).outerjoin(SecurityPrice, SecurityPrice.symbol == Investment.symbol).filter(Investment.user_id == user_id)
+
+def value_portfolio(quantity, purchase_price, price, types):
+    """Vectorized valuation: per-holding value/gain plus totals and allocation by type"""
+    quantity = np.asarray(quantity, dtype=float)
+    value = quantity * np.asarray(price, dtype=float)
+    cost = quantity * np.asarray(purchase_price, dtype=float)
+    total_value, total_cost = float(value.sum()), float(cost.sum())
+    gain_loss = total_value - total_cost
+    labels, inverse = np.unique(np.asarray(types, dtype=str), return_inverse=True)
+    by_type = np.bincount(inverse, weights=value, minlength=len(labels)) if len(labels) else np.zeros(0)
+    return {
+        'value': value,
+        'gain_loss': value - cost,
+        'summary': {
+            'total_value': total_value,
+            'total_cost': total_cost,
+            'gain_loss': gain_loss,
+            'gain_loss_percentage': (gain_loss / total_cost * 100) if total_cost > 0 else 0,
+            'allocation': [{
+                'type': str(t),
+                'value': float(v),
+                'percentage': float(v / total_value * 100) if total_value > 0 else 0
+            } for t, v in sorted(zip(labels, by_type), key=lambda x: x[1], reverse=True)]
+        }
+    }
+
+def investment_rows(holdings):
+    """API rows for holdings_query() results, plus their portfolio valuation"""
+    valuation = value_portfolio([i.quantity or 0 for i, _ in holdings], [i.purchase_price or 0 for i, _ in holdings],
+                                [p or 0 for _, p in holdings], [i.type or 'other' for i, _ in holdings])
+    return [{
+        'id': i.id,
+        'symbol': i.symbol,
+        'name': i.name,
+        'type': i.type,
+        'quantity': i.quantity,
+        'purchase_price': i.purchase_price,
+        'current_price': price,
+        'purchase_date': i.purchase_date,
+        'total_value': float(value),
+        'gain_loss': float(gain)
+    } for (i, price), value, gain in zip(holdings, valuation['value'], valuation['gain_loss'])], valuation
+
 @app.route('/api/investments', methods=['GET', 'POST'])
 @auth_required
 def investments_route():
     user = g.current_user
     if request.method == 'GET':
-        investments = Investment.query.filter_by(user_id=user.id).all()
-        total_value = sum(i.quantity * i.current_price for i in investments)
-        total_cost = sum(i.quantity * i.purchase_price for i in investments)
-        gain_loss = total_value - total_cost
-
-        return jsonify({
-            'investments': [{
-                'id': i.id,
-                'symbol': i.symbol,
-                'name': i.name,
-                'type': i.type,
-                'quantity': i.quantity,
-                'purchase_price': i.purchase_price,
-                'current_price': i.current_price,
-                'purchase_date': i.purchase_date,
-                'total_value': i.quantity * i.current_price,
-                'gain_loss': (i.current_price - i.purchase_price) * i.quantity
-            } for i in investments],
-            'summary': {
-                'total_value': total_value,
-                'total_cost': total_cost,
-                'gain_loss': gain_loss,
-                'gain_loss_percentage': (gain_loss / total_cost * 100) if total_cost > 0 else 0
-            }
-        })
+        rows, valuation = investment_rows(holdings_query(user.id).all())
+        return jsonify({'investments': rows, 'summary': valuation['summary']})
 
     data = request.json or {}
+    symbol = str(data.get('symbol') or '').strip().upper()
+    if not symbol or len(symbol) > 16:
+        return jsonify({'error': 'symbol is required (at most 16 characters)'}), 400
     investment = Investment(
         user_id=user.id,
         account_id=data.get('account_id'),
-        symbol=data.get('symbol', '').upper(),
+        symbol=symbol,
         name=data.get('name', 'Investment'),
         type=data.get('type', 'stock'),
         quantity=float(data.get('quantity', 0) or 0),
@@ -771,10 +2237,58 @@ def investments_route():
         current_price=float(data.get('current_price', 0) or 0),
         purchase_date=data.get('purchase_date', datetime.datetime.utcnow().strftime('%Y-%m-%d'))
     )
+    # current_price only values this holding until the price feed has the symbol
     db.session.add(investment)
     db.session.commit()
+    bump_cache_version('performance', user.id)
     return jsonify({'status': 'ok', 'id': investment.id}), 201
 
+def _valid_price(symbol, price):
+    return (bool(symbol) and len(symbol) <= 16 and not isinstance(price, bool)
+            and isinstance(price, (int, float)) and price >= 0)
+
+@app.route('/api/investments/prices', methods=['POST'])
+def investment_prices():
+    """Bulk price refresh: {"prices": {"AAPL": 189.5, ...}} updates every holder of each symbol.
+    An optional {"history": {"AAPL": [["2024-01-02", 185.6], ...]}} backfills daily closes.
+    Only the price feed (X-Price-Feed-Token matching PRICE_FEED_TOKEN) may call it."""
+    token = app.config['PRICE_FEED_TOKEN']
+    if not token or not secrets.compare_digest(request.headers.get('X-Price-Feed-Token', ''), token):
+        return jsonify({'error': 'price feed token required'}), 403
+    data = request.json or {}
+    prices = data.get('prices') or {}
+    history = data.get('history') or {}
+    if not isinstance(prices, dict) or not isinstance(history, dict) or not (prices or history):
+        return jsonify({'error': 'prices/history must be non-empty {symbol: ...} objects'}), 400
+    cleaned = {}
+    for symbol, price in prices.items():
+        symbol = str(symbol).strip().upper()
+        if not _valid_price(symbol, price):
+            return jsonify({'error': f'invalid price for {symbol or "empty symbol"}'}), 400
+        cleaned[symbol] = float(price)
+    closes = {}
+    for symbol, points in history.items():
+        symbol = str(symbol).strip().upper()
+        if not symbol:
+            return jsonify({'error': 'history has an empty symbol'}), 400
+        for point in points if isinstance(points, list) else [None]:
+            try:
+                day, price = point
+                day = datetime.datetime.strptime(day, '%Y-%m-%d').strftime('%Y-%m-%d')
+            except (TypeError, ValueError):
+                return jsonify({'error': f'history for {symbol} must be [["YYYY-MM-DD", price], ...]'}), 400
+            if not _valid_price(symbol, price):
+                return jsonify({'error': f'invalid price for {symbol} on {day}'}), 400
+            closes[(symbol, day)] = float(price)
+    if cleaned:
+        upsert_prices(cleaned)
+    if closes:
+        upsert(PriceHistory, [{'symbol': s, 'date': d, 'price': p} for (s, d), p in closes.items()],
+               ['symbol', 'date'], ('price',))
+        bump_cache_version_on_commit('performance')
+    db.session.commit()
+    return jsonify({'status': 'ok', 'updated': len(cleaned), 'history_points': len(closes)})
+
 @app.route('/api/investments/<int:id>', methods=['PUT', 'DELETE'])
 @auth_required
 def investment_modify(id):
@@ -786,29 +2300,175 @@ def investment_modify(id):
     if request.method == 'DELETE':
         db.session.delete(investment)
         db.session.commit()
+        bump_cache_version('performance', user.id)
         return jsonify({'status': 'deleted'})
 
     data = request.json or {}
-    investment.current_price = float(data.get('current_price', investment.current_price) or 0)
+    if 'current_price' in data:
+        # The owner's price for this holding only; the shared price belongs to the price
+        # feed. null, or the market price an edit form sent back, follows the market again.
+        price = data.get('current_price')
+        if price is not None and not _valid_price(investment.symbol, price):
+            return jsonify({'error': 'current_price must be a number >= 0 or null'}), 400
+        market = db.session.get(SecurityPrice, investment.symbol)
+        investment.manual_price = None if price is None or (market and market.price == price) else float(price)
     investment.quantity = float(data.get('quantity', investment.quantity) or 0)
     investment.updated_at = datetime.datetime.utcnow()
     db.session.commit()
+    bump_cache_version('performance', user.id)
     return jsonify({'status': 'updated'})
 
+# Investment performance (XIRR and time-weighted return)
+def xirr(amounts, years, iterations=100, tol=1e-10):
+    """Vectorized XIRR by Newton's method.
+
+    amounts/years are (n, k) arrays of each row's cash flows (zero padded) and their
+    offsets in years from the row's first flow. Returns n annual rates, NaN where a
+    row has no sign change or doesn't converge.
+    """
+    amounts = np.asarray(amounts, dtype=float)
+    years = np.asarray(years, dtype=float)
+    rate = np.full(amounts.shape[0], 0.1)
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        for _ in range(iterations):
+            base = (1 + rate)[:, None]
+            disc = base ** -years
+            npv = (amounts * disc).sum(axis=1)
+            slope = (-years * amounts * disc / base).sum(axis=1)
+            step = np.where(slope != 0, npv / slope, 0.0)
+            step = np.where(np.isfinite(step), step, 0.0)
+            rate = np.maximum(rate - step, -0.9999)
+            if np.all(np.abs(step) < tol):
+                break
+        npv = (amounts * (1 + rate)[:, None] ** -years).sum(axis=1)
+    scale = np.abs(amounts).sum(axis=1)
+    ok = (amounts > 0).any(axis=1) & (amounts < 0).any(axis=1) & (np.abs(npv) <= 1e-6 * scale)
+    return np.where(ok, rate, np.nan)
+
+def _day(value, fallback):
+    try:
+        return np.datetime64(datetime.datetime.strptime(value, '%Y-%m-%d').date(), 'D')
+    except (TypeError, ValueError):
+        return np.datetime64((fallback or datetime.datetime.utcnow()).date(), 'D')
+
+def _num(x):
+    return None if x is None or not np.isfinite(x) else round(float(x), 6)
+
+def compute_performance(user_id):
+    """XIRR and time-weighted return per holding, per account and for the whole portfolio.
+
+    Prices come from PriceHistory (forward-filled, seeded with the purchase price on
+    the purchase day) plus today's shared price. Account TWR chains daily returns
+    net of purchases, so money added later doesn't count as performance.
+    """
+    today = datetime.date.today()
+    holdings = holdings_query(user_id).all()
+    if not holdings:
+        return {'as_of': today.isoformat(), 'holdings': [], 'accounts': [], 'portfolio': None}
+    inv = [i for i, _ in holdings]
+    qty = np.array([i.quantity or 0 for i in inv], dtype=float)
+    cost = np.array([i.purchase_price or 0 for i in inv], dtype=float)
+    now_price = np.array([p or 0 for _, p in holdings], dtype=float)
+    day0 = np.datetime64(today, 'D')
+    bought = np.minimum(np.array([_day(i.purchase_date, i.updated_at) for i in inv], dtype='datetime64[D]'), day0)
+    symbols, sym = np.unique([i.symbol for i in inv], return_inverse=True)
+
+    # Years of daily closes can be ~10^6 rows: read plain DBAPI tuples, skipping Row objects
+    history = db.session.connection().execute(select(PriceHistory.symbol, PriceHistory.date, PriceHistory.price).where(
+        PriceHistory.symbol.in_(symbols.tolist()),
+        PriceHistory.date >= str(bought.min()), PriceHistory.date < today.isoformat()
+    )).cursor.fetchall()
+    h_sym = np.searchsorted(symbols, [h[0] for h in history]).astype(int)
+    h_day = np.array([h[1] for h in history], dtype='datetime64[D]')
+    days = np.unique(np.concatenate([h_day, bought, [day0]]))
+    D, S = len(days), len(symbols)
+
+    # Price matrix (days x symbols): closes, today's price, purchase price where the
+    # purchase day has no close, then forward-filled
+    P = np.full((D, S), np.nan)
+    P[np.searchsorted(days, h_day), h_sym] = [h[2] for h in history]
+    P[-1, sym] = now_price
+    pos = np.searchsorted(days, bought)
+    seed = np.isnan(P[pos, sym])
+    P[pos[seed], sym[seed]] = cost[seed]
+    last = np.where(np.isnan(P), 0, np.arange(D)[:, None])
+    np.maximum.accumulate(last, axis=0, out=last)
+    P = np.nan_to_num(P[last, np.arange(S)])
+
+    # Per holding: two cash flows for XIRR, start/end price for TWR
+    held_years = (day0 - bought).astype(float) / 365.0
+    p_start, p_end = P[pos, sym], P[-1, sym]
+    value = qty * p_end
+    h_xirr = xirr(np.stack([-qty * cost, value], axis=1), np.stack([np.zeros_like(held_years), held_years], axis=1))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        h_twr = np.where(p_start > 0, p_end / p_start - 1, np.nan)
+
+    # Per account: holdings grouped by account_id; the last group is the whole portfolio
+    accounts = sorted({i.account_id for i in inv}, key=lambda a: (a is None, a or 0))
+    grp = np.array([accounts.index(i.account_id) for i in inv])
+    A = len(accounts)
+    members = [np.flatnonzero(grp == a) for a in range(A)] + [np.arange(len(inv))]
+    width = max(len(m) for m in members) + 1
+    amounts, years = np.zeros((A + 1, width)), np.zeros((A + 1, width))
+    for row, m in enumerate(members):
+        first = bought[m].min()
+        amounts[row, :len(m)] = -qty[m] * cost[m]
+        years[row, :len(m)] = (bought[m] - first).astype(float) / 365.0
+        amounts[row, len(m)] = value[m].sum()
+        years[row, len(m)] = (day0 - first).astype(float) / 365.0
+    g_xirr = xirr(amounts, years)
+
+    # Daily value and inflow per (account, symbol) position, summed per account
+    pairs, pair = np.unique(grp * S + sym, return_inverse=True)
+    bought_qty = np.zeros((D, len(pairs)))
+    np.add.at(bought_qty, (pos, pair), qty)
+    pair_price = P[:, pairs % S]
+    onehot = np.zeros((len(pairs), A + 1))
+    onehot[np.arange(len(pairs)), pairs // S] = 1
+    onehot[:, A] = 1
+    V = (np.cumsum(bought_qty, axis=0) * pair_price) @ onehot
+    F = (bought_qty * pair_price) @ onehot
+    with np.errstate(divide='ignore', invalid='ignore'):
+        growth = np.where(V[:-1] > 0, (V[1:] - F[1:]) / V[:-1], 1.0)
+    g_twr = growth.prod(axis=0) - 1 if D > 1 else np.zeros(A + 1)
+    g_value = V[-1]
+
+    return {
+        'as_of': today.isoformat(),
+        'holdings': [{
+            'id': i.id, 'symbol': i.symbol, 'account_id': i.account_id, 'value': _num(value[k]),
+            'xirr': _num(h_xirr[k]), 'twr': _num(h_twr[k])
+        } for k, i in enumerate(inv)],
+        'accounts': [{
+            'account_id': a, 'value': _num(g_value[k]), 'xirr': _num(g_xirr[k]), 'twr': _num(g_twr[k])
+        } for k, a in enumerate(accounts)],
+        'portfolio': {'value': _num(g_value[A]), 'xirr': _num(g_xirr[A]), 'twr': _num(g_twr[A])}
+    }
+
+@app.route('/api/investments/performance')
+@auth_required
+def investments_performance():
+    user = g.current_user
+    today = datetime.date.today().isoformat()
+    return jsonify(cached('performance', user.id, lambda: compute_performance(user.id), key=today))
+
 # Net Worth Tracking
+def net_worth_row(s):
+    return {
+        'id': s.id,
+        'date': s.date,
+        'assets': s.assets,
+        'liabilities': s.liabilities,
+        'net_worth': s.net_worth
+    }
+
 @app.route('/api/net-worth', methods=['GET', 'POST'])
 @auth_required
 def net_worth_route():
     user = g.current_user
     if request.method == 'GET':
         snapshots = NetWorthSnapshot.query.filter_by(user_id=user.id).order_by(NetWorthSnapshot.date.desc()).all()
-        return jsonify([{
-            'id': s.id,
-            'date': s.date,
-            'assets': s.assets,
-            'liabilities': s.liabilities,
-            'net_worth': s.net_worth
-        } for s in snapshots])
+        return jsonify([net_worth_row(s) for s in snapshots])
 
     # Calculate current net worth
     accounts = Account.query.filter_by(user_id=user.id).all()
@@ -816,8 +2476,8 @@ def net_worth_route():
     total_liabilities = sum(abs(a.balance) for a in accounts if a.type in ['credit', 'loan'])
 
     # Add investments
-    investments = Investment.query.filter_by(user_id=user.id).all()
-    total_assets += sum(i.quantity * i.current_price for i in investments)
+    holdings = holdings_query(user.id).all()
+    total_assets += float(np.dot([i.quantity or 0 for i, _ in holdings], [p or 0 for _, p in holdings]))
 
     net_worth = total_assets - total_liabilities
 
@@ -879,30 +2539,592 @@ def age_of_money():
     })
 
 # Budget Templates
+# Templates are seeded by init_db.py and rarely change, so they're parsed once per
+# process; any ORM write to BudgetTemplate bumps the cache version once it commits.
+@event.listens_for(BudgetTemplate, 'after_insert')
+@event.listens_for(BudgetTemplate, 'after_update')
+@event.listens_for(BudgetTemplate, 'after_delete')
+def _budget_templates_changed(mapper, connection, target):
+    bump_cache_version_on_commit('budget_templates', session=sa_inspect(target).session)
+
+def load_budget_templates():
+    """{id: template} for the public templates, with `categories` parsed"""
+    templates = {}
+    for t in BudgetTemplate.query.filter_by(is_public=True).order_by(BudgetTemplate.id):
+        try:
+            categories = json.loads(t.categories)
+        except ValueError:
+            categories = []
+        templates[t.id] = {'id': t.id, 'name': t.name, 'description': t.description, 'categories': categories}
+    return templates
+
 @app.route('/api/budget-templates', methods=['GET'])
 @auth_required
 def budget_templates():
-    templates = BudgetTemplate.query.filter_by(is_public=True).all()
-    return jsonify([{
-        'id': t.id,
-        'name': t.name,
-        'description': t.description,
-        'categories': t.categories
-    } for t in templates])
+    return jsonify(list(cached('budget_templates', None, load_budget_templates).values()))
+
+@app.route('/api/budget-templates/<int:id>/apply', methods=['POST'])
+@auth_required
+def apply_budget_template(id):
+    """Create (or re-assign) the month's envelopes from a template in one transaction.
+
+    Body: {"month": "YYYY-MM", "income": 5000}. Percentage categories get that share
+    of income; income defaults to the month's recorded income transactions.
+    """
+    user = g.current_user
+    template = cached('budget_templates', None, load_budget_templates).get(id)
+    if template is None:
+        return jsonify({'error': 'template not found'}), 404
+    data = request.json or {}
+    month = data.get('month', datetime.datetime.utcnow().strftime('%Y-%m'))
+    if not isinstance(month, str) or not re.fullmatch(r'\d{4}-(0[1-9]|1[0-2])', month):
+        return jsonify({'error': 'month must be YYYY-MM'}), 400
+    if data.get('income') is not None:
+        try:
+            income = float(data['income'])
+        except (TypeError, ValueError):
+            return jsonify({'error': 'income must be a number'}), 400
+    else:
+        income = db.session.execute(select(func.coalesce(func.sum(Transaction.amount), 0)).where(
+            Transaction.user_id == user.id, Transaction.type == 'income', Transaction.date.like(f'{month}%'))).scalar()
+
+    existing = {e.category: e for e in EnvelopeBudget.query.filter_by(user_id=user.id, month=month)}
+    inserts, updates = [], []
+    for item in template['categories']:
+        assigned = round(income * float(item.get('percentage', 0)) / 100, 2)
+        priority = int(item.get('priority', 5))
+        envelope = existing.get(item['category'])
+        if envelope is None:
+            inserts.append({'user_id': user.id, 'category': item['category'], 'month': month, 'assigned': assigned,
+                            'activity': 0.0, 'available': assigned, 'rollover': True, 'priority': priority})
+        else:
+            updates.append({'id': envelope.id, 'assigned': assigned, 'priority': priority,
+                            'available': (envelope.available or 0) + assigned - (envelope.assigned or 0)})
+    if inserts:
+        db.session.execute(insert(EnvelopeBudget), inserts)
+    if updates:
+        db.session.execute(update(EnvelopeBudget), updates)
+    record_changes(EnvelopeBudget, EnvelopeBudget.user_id == user.id, EnvelopeBudget.month == month,
+                   EnvelopeBudget.category.in_([item['category'] for item in template['categories']]))
+    db.session.commit()
+    return jsonify({'status': 'ok', 'month': month, 'income': income, 'created': len(inserts), 'updated': len(updates)}), 201
 
 # Export transactions (CSV)
+CSV_COLUMNS = ['id','type','category','amount','merchant','date','time']
+
+def export_csv_chunks(user_id, args, on_rows=None):
+    """The user's transactions (hot, then archived) as CSV text in ~64KB chunks.
+    `args` may hold from/to/q filters; on_rows(n) is called with the running row count."""
+    items = Transaction.query.filter(Transaction.user_id == user_id, *transaction_filters(args)).order_by(
+        Transaction.created_at.desc())
+    si = io.StringIO()
+    writer = csv.writer(si)
+    writer.writerow(CSV_COLUMNS)
+    rows = ((t.id,t.type,t.category,t.amount,t.merchant,t.date,t.time) for t in items.yield_per(1000))
+    archived = ((t['id'],t['type'],t['category'],t['amount'],t['merchant'],t['date'],t['time'])
+                for t in archived_transactions(user_id, args.get('from'), args.get('to'), args.get('q'), lazy=True))
+    for count, row in enumerate(itertools.chain(rows, archived), 1):
+        writer.writerow(row)
+        if si.tell() > 65536:
+            yield si.getvalue()
+            si.seek(0); si.truncate(0)
+            if on_rows:
+                on_rows(count)
+    yield si.getvalue()
+
 @app.route('/api/transactions/export')
 @auth_required
 def export_transactions():
-    import csv, io
+    """CSV of the user's transactions, optionally limited with ?from=/?to=/?q=;
+    archived segments are only read when the range reaches back past the archive horizon.
+    For very large histories queue an 'export' job instead (POST /api/jobs)."""
     user = g.current_user
-    items = Transaction.query.filter_by(user_id=user.id).order_by(Transaction.created_at.desc()).all()
-    si = io.StringIO()
-    writer = csv.writer(si)
-    writer.writerow(['id','type','category','amount','merchant','date','time'])
-    for t in items:
-        writer.writerow([t.id,t.type,t.category,t.amount,t.merchant,t.date,t.time])
-    return app.response_class(si.getvalue(), mimetype='text/csv', headers={'Content-Disposition':'attachment;filename=transactions.csv'})
+    args = {k: request.args.get(k) for k in ('from', 'to', 'q')}
+    # Stream the file in ~64KB chunks instead of building the whole history in memory
+    return app.response_class(stream_with_context(export_csv_chunks(user.id, args)), mimetype='text/csv',
+                              headers={'Content-Disposition':'attachment;filename=transactions.csv'})
+
+# Background jobs
+# Jobs are rows in the job table. worker.py processes claim them with a conditional
+# UPDATE (plus SELECT .. FOR UPDATE SKIP LOCKED on PostgreSQL), so any number of
+# workers can drain the queue. A claim holds the job until locked_until; handlers
+# extend it whenever they report progress. Failures are retried with exponential
+# backoff until max_attempts.
+JOB_HANDLERS = {}
+
+class JobLeaseLost(Exception):
+    """The job's visibility timeout expired and another worker may own it now"""
+
+def job_handler(kind):
+    def register(f):
+        JOB_HANDLERS[kind] = f
+        return f
+    return register
+
+def _job_json(job):
+    return {
+        'id': job.id, 'kind': job.kind, 'status': job.status, 'progress': round(job.progress or 0, 4),
+        'attempts': job.attempts, 'error': job.error, 'result': json.loads(job.result) if job.result else None,
+        'download': f'/api/jobs/{job.id}/download' if job.result_name else None,
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None
+    }
+
+def claim_job(worker_id):
+    """Take the next runnable job (queued and due, or running past its visibility
+    timeout) for `worker_id`; returns the Job or None"""
+    now = datetime.datetime.utcnow()
+    claimable = or_(and_(Job.status == 'queued', Job.run_after <= now),
+                    and_(Job.status == 'running', Job.locked_until < now))
+    candidates = select(Job.id).where(claimable).order_by(Job.run_after, Job.id).limit(10)
+    if db.engine.dialect.name == 'postgresql':
+        candidates = candidates.with_for_update(skip_locked=True)
+    for job_id in db.session.execute(candidates).scalars().all():
+        claimed = db.session.execute(
+            update(Job).where(Job.id == job_id, claimable).values(
+                status='running', locked_by=worker_id, attempts=Job.attempts + 1,
+                locked_until=now + datetime.timedelta(seconds=app.config['JOB_VISIBILITY_TIMEOUT'])
+            ).execution_options(synchronize_session=False)).rowcount
+        db.session.commit()
+        if claimed:
+            return db.session.get(Job, job_id)
+    db.session.commit()
+    return None
+
+def _finish_job(job, worker_id, **values):
+    """Write the outcome, unless the lease was lost to another worker meanwhile"""
+    done = Job.query.filter_by(id=job.id, locked_by=worker_id, status='running').update(
+        dict(values, locked_by=None, locked_until=None), synchronize_session=False)
+    db.session.commit()
+    return bool(done)
+
+def run_job(job, worker_id):
+    """Run a claimed job's handler and record its result, retry or failure"""
+    def progress(fraction, checkpoint=None):
+        """Report progress, renew the lease and commit the handler's pending writes
+        (together with `checkpoint`, so a retry can resume from there)"""
+        values = {'progress': min(max(fraction, 0.0), 1.0), 'locked_until': datetime.datetime.utcnow() +
+                  datetime.timedelta(seconds=app.config['JOB_VISIBILITY_TIMEOUT'])}
+        if checkpoint is not None:
+            values['checkpoint'] = checkpoint
+        if not Job.query.filter_by(id=job.id, locked_by=worker_id, status='running').update(values, synchronize_session=False):
+            db.session.rollback()
+            raise JobLeaseLost(job.id)
+        db.session.commit()
+
+    handler = JOB_HANDLERS.get(job.kind)
+    if handler is None or job.attempts > job.max_attempts:
+        error = f'unknown job kind {job.kind!r}' if handler is None else 'timed out on every attempt'
+        return _finish_job(job, worker_id, status='failed', error=error, finished_at=datetime.datetime.utcnow())
+    try:
+        result, file = handler(job, json.loads(job.params or '{}'), progress)
+    except JobLeaseLost:
+        db.session.rollback()
+        return False
+    except Exception as e:
+        db.session.rollback()
+        app.logger.exception('job %s (%s) failed on attempt %s', job.id, job.kind, job.attempts)
+        if job.attempts < job.max_attempts:
+            return _finish_job(job, worker_id, status='queued', error=repr(e),
+                               run_after=datetime.datetime.utcnow() + datetime.timedelta(seconds=5 * 2 ** job.attempts))
+        return _finish_job(job, worker_id, status='failed', error=repr(e), finished_at=datetime.datetime.utcnow())
+    values = {'status': 'done', 'progress': 1.0, 'error': None, 'result': json.dumps(result),
+              'finished_at': datetime.datetime.utcnow()}
+    if file:
+        name, mimetype, data = file
+        values.update(result_name=name, result_mimetype=mimetype, result_data=gzip.compress(data, 6))
+    return _finish_job(job, worker_id, **values)
+
+def purge_jobs():
+    """Delete finished jobs (and their files) older than JOB_RETENTION_DAYS"""
+    cutoff = datetime.datetime.utcnow() - datetime.timedelta(days=app.config['JOB_RETENTION_DAYS'])
+    count = Job.query.filter(Job.status.in_(['done', 'failed']), Job.finished_at < cutoff).delete(synchronize_session=False)
+    db.session.commit()
+    return count
+
+@job_handler('export')
+def _export_job(job, params, progress):
+    """Full CSV export; params: optional from/to/q filters"""
+    total = max(1, Transaction.query.filter_by(user_id=job.user_id).count() + (db.session.execute(
+        select(func.coalesce(func.sum(TransactionArchive.count), 0)).where(TransactionArchive.user_id == job.user_id)).scalar()))
+    out = io.BytesIO()
+    rows = [0]
+
+    def on_rows(count):
+        rows[0] = count
+        progress(0.99 * min(count / total, 1))
+    for chunk in export_csv_chunks(job.user_id, params, on_rows):
+        out.write(chunk.encode('utf-8'))
+    return {'bytes': out.tell()}, ('transactions.csv', 'text/csv', out.getvalue())
+
+@job_handler('import')
+def _import_job(job, params, progress):
+    """Import transactions from CSV text (params['csv'], same columns as the export).
+    Rows are committed in batches with the checkpoint, so a retry continues where it stopped."""
+    rows = list(csv.DictReader(io.StringIO(params.get('csv') or '')))
+    resumed_from = job.checkpoint or 0
+    imported, skipped, batch = 0, 0, []
+    for index in range(resumed_from, len(rows)):
+        row = rows[index]
+        try:
+            batch.append({'user_id': job.user_id, 'type': 'income' if row.get('type') == 'income' else 'expense',
+                          'category': (row.get('category') or 'General')[:64], 'amount': float(row['amount']),
+                          'merchant': (row.get('merchant') or 'Unknown')[:128],
+                          'date': (row.get('date') or datetime.datetime.utcnow().strftime('%Y-%m-%d'))[:32],
+                          'time': (row.get('time') or '')[:32], 'created_at': datetime.datetime.utcnow()})
+        except (KeyError, TypeError, ValueError):
+            skipped += 1
+        if len(batch) >= 1000 or index == len(rows) - 1:
+            if batch:
+                ids = db.session.scalars(insert(Transaction).returning(Transaction.id), batch).all()
+                record_changes(Transaction, Transaction.id.in_(ids))
+                imported += len(batch)
+                batch = []
+            progress((index + 1) / len(rows), checkpoint=index + 1)
+    columnar_invalidate(job.user_id)
+    return {'rows': len(rows), 'imported': imported, 'skipped': skipped, 'resumed_from': resumed_from}, None
+
+@job_handler('report')
+def _report_job(job, params, progress):
+    """Spending report (see /api/analytics/report); params: from, to, window"""
+    end = np.datetime64(params.get('to') or datetime.date.today(), 'D')
+    start = np.datetime64(params.get('from') or end - 364, 'D')
+    progress(0.1)
+    return dict(spending_report(*report_columns(job.user_id, start, end), start, end, int(params.get('window', 7))),
+                **{'from': str(start), 'to': str(end)}), None
+
+@app.route('/api/jobs', methods=['GET', 'POST'])
+@auth_required
+def jobs_route():
+    """GET lists the user's recent jobs; POST {"kind": "export"|"import"|"report", "params": {...}} queues one"""
+    user = g.current_user
+    if request.method == 'GET':
+        jobs = Job.query.options(defer(Job.result_data)).filter_by(user_id=user.id).order_by(Job.id.desc()).limit(50).all()
+        return jsonify([_job_json(j) for j in jobs])
+    data = request.json or {}
+    if data.get('kind') not in JOB_HANDLERS:
+        return jsonify({'error': f"kind must be one of {sorted(JOB_HANDLERS)}"}), 400
+    if not isinstance(data.get('params', {}), dict):
+        return jsonify({'error': 'params must be an object'}), 400
+    job = Job(user_id=user.id, kind=data['kind'], params=json.dumps(data.get('params', {})))
+    db.session.add(job)
+    db.session.commit()
+    return jsonify(_job_json(job)), 202
+
+@app.route('/api/jobs/<int:id>', methods=['GET', 'DELETE'])
+@auth_required
+def job_detail(id):
+    user = g.current_user
+    job = db.session.get(Job, id, options=[defer(Job.result_data)])
+    if job is None or job.user_id != user.id:
+        return jsonify({'error': 'job not found'}), 404
+    if request.method == 'DELETE':
+        # Removing a running job makes its worker's next progress report fail, which stops it
+        db.session.delete(job)
+        db.session.commit()
+        return jsonify({'status': 'deleted'})
+    return jsonify(_job_json(job))
+
+@app.route('/api/jobs/<int:id>/download')
+@auth_required
+def job_download(id):
+    user = g.current_user
+    job = db.session.get(Job, id)
+    if job is None or job.user_id != user.id or not job.result_data:
+        return jsonify({'error': 'no file for this job'}), 404
+    headers = {'Content-Disposition': f'attachment;filename={job.result_name}'}
+    if request.accept_encodings['gzip']:  # stored gzipped; send as is
+        headers['Content-Encoding'] = 'gzip'
+        headers['Vary'] = 'Accept-Encoding'
+        return app.response_class(job.result_data, mimetype=job.result_mimetype, headers=headers)
+    return app.response_class(gzip.decompress(job.result_data), mimetype=job.result_mimetype, headers=headers)
+
+# Anomaly detection
+def trailing_median_mad(values, starts, ends, window):
+    """Median and MAD of values[max(start, end - window):end] for each (start, end) pair
+    (NaN for empty ranges), in chunks so the (rows x window) matrix stays small"""
+    median, mad = np.full(len(ends), np.nan), np.full(len(ends), np.nan)
+    back = np.arange(1, window + 1)
+    for lo in range(0, len(ends), 100000):
+        end, start = ends[lo:lo + 100000], starts[lo:lo + 100000]
+        idx = end[:, None] - back[None, :]
+        valid = idx >= start[:, None]
+        some = valid.any(axis=1)
+        history = np.where(valid, values[np.maximum(idx, 0)], np.nan)[some]
+        m = np.nanmedian(history, axis=1)
+        median[lo:lo + 100000][some] = m
+        mad[lo:lo + 100000][some] = np.nanmedian(np.abs(history - m[:, None]), axis=1)
+    return median, mad
+
+def robust_z(amount, median, mad):
+    """Modified z-score (0.6745 (x - median) / MAD); MAD is floored so a category of
+    identical amounts doesn't turn every small difference into an outlier"""
+    return 0.6745 * (amount - median) / np.maximum(mad, np.maximum(0.05 * np.abs(median), 0.01))
+
+def _load_expense_lines(user_ids):
+    """All expense lines (split parts, or whole transactions), as column arrays"""
+    where = [Transaction.type == 'expense'] + ([Transaction.user_id.in_(user_ids)] if user_ids else [])
+    stmt = select(Transaction.user_id, Transaction.id, Transaction.date, Transaction.merchant, Transaction.amount,
+                  func.coalesce(TransactionSplit.category, Transaction.category),
+                  func.coalesce(TransactionSplit.amount, Transaction.amount)
+                  ).outerjoin(TransactionSplit, TransactionSplit.transaction_id == Transaction.id).where(*where)
+    categories, merchants, parts = {}, {}, []
+    for rows in db.session.execute(stmt.execution_options(yield_per=50000)).partitions():
+        users, ids, dates, names, totals, cats, amounts = zip(*rows)
+        parts.append((np.array(users, dtype=np.int64), np.array(ids, dtype=np.int64), _days(dates),
+                      np.array([merchants.setdefault((m or '').strip().lower(), len(merchants)) for m in names], dtype=np.int64),
+                      np.array(totals, dtype=np.float64),
+                      np.array([categories.setdefault(c, len(categories)) for c in cats], dtype=np.int64),
+                      np.array(amounts, dtype=np.float64)))
+    keys = ('user', 'transaction_id', 'day', 'merchant', 'total', 'category', 'amount')
+    if not parts:
+        return {k: np.zeros(0, dtype=np.float64 if k in ('total', 'amount') else np.int64) for k in keys}, []
+    return {k: np.concatenate(col) for k, col in zip(keys, zip(*parts))}, list(categories)
+
+def find_duplicates(user, transaction_id, day, merchant, total, window_days):
+    """(transaction_id, duplicate_of) for charges of the same amount at the same merchant
+    within window_days of the previous one, per user"""
+    cents = np.round(total * 100).astype(np.int64)
+    day = day.astype(np.int64)  # NO_DAY differences would overflow int32
+    order = np.lexsort((transaction_id, day, merchant, cents, user))
+    user, cents, merchant, day, transaction_id = user[order], cents[order], merchant[order], day[order], transaction_id[order]
+    same = (user[1:] == user[:-1]) & (cents[1:] == cents[:-1]) & (merchant[1:] == merchant[:-1])
+    close = same & (day[1:] - day[:-1] <= window_days) & (day[:-1] != NO_DAY)
+    return list(zip(transaction_id[1:][close].tolist(), transaction_id[:-1][close].tolist()))
+
+def detect_anomalies(user_ids=None, since=None, progress=None):
+    """Score the expense history of all users (or `user_ids`) in one vectorized pass.
+    Each line is compared with the median/MAD of the previous ANOMALY_WINDOW lines in its
+    category; lines dated on/after `since` (YYYY-MM-DD, default 90 days ago) that stand out
+    become 'outlier' anomalies, repeated charges 'duplicate' ones. CategoryStats is
+    rebuilt from the same pass. Returns {'lines', 'outlier', 'duplicate'}."""
+    cfg = app.config
+    since = since or (datetime.date.today() - datetime.timedelta(days=90)).isoformat()
+    first_day = int(np.datetime64(since, 'D').astype(np.int64))
+    # Drop flags whose transaction is gone (or whose id now belongs to someone else)
+    stale = ~exists().where(Transaction.id == Anomaly.transaction_id, Transaction.user_id == Anomaly.user_id)
+    db.session.execute(Anomaly.__table__.delete().where(
+        stale, *([Anomaly.user_id.in_(user_ids)] if user_ids is not None else [])))
+    cols, categories = _load_expense_lines(user_ids)
+    if progress:
+        progress(0.3)
+    # Lines grouped by (user, category), oldest first
+    order = np.lexsort((cols['transaction_id'], cols['day'], cols['category'], cols['user']))
+    user, category, amount, day, tid = (cols[k][order] for k in ('user', 'category', 'amount', 'day', 'transaction_id'))
+    n = len(amount)
+    boundary = np.ones(n, dtype=bool)
+    boundary[1:] = (user[1:] != user[:-1]) | (category[1:] != category[:-1])
+    group_starts = np.flatnonzero(boundary)
+    group = np.cumsum(boundary) - 1
+    row_start = group_starts[group]
+
+    median, mad = trailing_median_mad(amount, row_start, np.arange(n), cfg['ANOMALY_WINDOW'])
+    enough = np.arange(n) - row_start >= cfg['ANOMALY_MIN_HISTORY']
+    with np.errstate(invalid='ignore', divide='ignore'):
+        z = robust_z(amount, median, mad)
+        flagged = enough & (day >= first_day) & (z > cfg['ANOMALY_Z']) & (amount >= cfg['ANOMALY_MIN_RATIO'] * median)
+    if progress:
+        progress(0.6)
+
+    # Per-category stats as of the last line: window median/MAD and the EWMA state,
+    # computed in closed form (weight a(1-a)^age, and (1-a)^age for a group's first line)
+    group_ends = np.append(group_starts[1:], n)
+    last_median, last_mad = trailing_median_mad(amount, group_starts, group_ends, cfg['ANOMALY_WINDOW'])
+    alpha = cfg['ANOMALY_EWMA_ALPHA']
+    age = group_ends[group] - 1 - np.arange(n)
+    weight = np.where(boundary, 1.0, alpha) * (1 - alpha) ** age
+    ewma = np.bincount(group, weights=weight * amount, minlength=len(group_starts))
+    ewma_sq = np.bincount(group, weights=weight * amount ** 2, minlength=len(group_starts))
+    stats = [{'user_id': int(user[s]), 'category': categories[category[s]], 'count': int(e - s),
+              'median': float(m), 'mad': float(d), 'ewma': float(w), 'ewma_sq': float(w2)}
+             for s, e, m, d, w, w2 in zip(group_starts, group_ends, last_median, last_mad, ewma, ewma_sq)]
+    upsert(CategoryStats, stats, ['user_id', 'category'], ('count', 'median', 'mad', 'ewma', 'ewma_sq'))
+
+    outliers = {}
+    for k in np.flatnonzero(flagged):  # one anomaly per transaction: its most unusual line
+        if z[k] > outliers.get(int(tid[k]), (0,))[0]:
+            outliers[int(tid[k])] = (float(z[k]), int(user[k]), categories[category[k]], float(amount[k]), float(median[k]), float(mad[k]))
+    firsts = np.unique(cols['transaction_id'], return_index=True)[1]  # one row per transaction
+    recent = firsts[cols['day'][firsts] >= first_day - cfg['DUPLICATE_WINDOW_DAYS']]
+    owner = dict(zip(cols['transaction_id'][recent].tolist(), cols['user'][recent].tolist()))
+    dated = dict(zip(cols['transaction_id'][recent].tolist(), cols['day'][recent].tolist()))
+    duplicates = [(t, d) for t, d in find_duplicates(*(cols[k][recent] for k in ('user', 'transaction_id', 'day', 'merchant', 'total')),
+                                                    cfg['DUPLICATE_WINDOW_DAYS']) if dated[t] >= first_day]
+    rows = [{'user_id': u, 'transaction_id': t, 'kind': 'outlier', 'score': s, 'status': 'open',
+             'created_at': datetime.datetime.utcnow(), 'detail': json.dumps(
+                 {'category': c, 'amount': a, 'median': m, 'mad': d, 'ratio': round(a / m, 1) if m else None})}
+            for t, (s, u, c, a, m, d) in outliers.items()]
+    rows += [{'user_id': owner[t], 'transaction_id': t, 'kind': 'duplicate', 'score': 1.0, 'status': 'open',
+              'created_at': datetime.datetime.utcnow(), 'detail': json.dumps({'duplicate_of': d})} for t, d in duplicates]
+    newest = db.session.execute(select(func.coalesce(func.max(Anomaly.id), 0))).scalar()
+    upsert(Anomaly, rows, ['transaction_id', 'kind'])  # flags seen before (or dismissed) are left alone
+    db.session.commit()
+    for user_id in db.session.execute(select(Anomaly.user_id).where(Anomaly.id > newest).distinct()).scalars():
+        publish_event(user_id, 'notifications', user_notifications(user_id))
+    return {'lines': n, 'outlier': len(outliers), 'duplicate': len(duplicates)}
+
+def score_transaction(t):
+    """Check a new (flushed) expense against its categories' stats and recent charges,
+    record what stands out and fold its amounts into the EWMA state; the caller commits.
+    Returns the anomaly kinds found."""
+    if t.type != 'expense':
+        return []
+    # A brand-new id can only carry flags left over from a deleted row that had it
+    Anomaly.query.filter_by(transaction_id=t.id).delete(synchronize_session=False)
+    cfg = app.config
+    lines = [(s.category, s.amount) for s in t.splits] or [(t.category, t.amount)]
+    stats = {s.category: s for s in CategoryStats.query.filter(
+        CategoryStats.user_id == t.user_id, CategoryStats.category.in_([c for c, _ in lines]))}
+    found = []
+    outlier = None
+    for category, amount in lines:
+        s = stats.get(category)
+        if s is None or s.median is None or (s.count or 0) < cfg['ANOMALY_MIN_HISTORY']:
+            continue
+        z = float(robust_z(amount, s.median, s.mad or 0))
+        if z > cfg['ANOMALY_Z'] and amount >= cfg['ANOMALY_MIN_RATIO'] * s.median and z > (outlier or (0,))[0]:
+            ew_std = math.sqrt(max((s.ewma_sq or 0) - (s.ewma or 0) ** 2, 0))
+            outlier = (z, {'category': category, 'amount': amount, 'median': s.median, 'mad': s.mad,
+                           'ratio': round(amount / s.median, 1), 'ewma': s.ewma,
+                           'ewma_z': round((amount - s.ewma) / ew_std, 1) if ew_std else None})
+    if outlier:
+        db.session.add(Anomaly(user_id=t.user_id, transaction_id=t.id, kind='outlier', score=outlier[0],
+                               detail=json.dumps(outlier[1])))
+        found.append('outlier')
+    try:
+        day = datetime.datetime.strptime(t.date[:10], '%Y-%m-%d').date()
+    except (TypeError, ValueError):
+        day = None
+    if day:
+        window = datetime.timedelta(days=cfg['DUPLICATE_WINDOW_DAYS'])
+        original = db.session.execute(select(Transaction.id).where(
+            Transaction.user_id == t.user_id, Transaction.id != t.id, Transaction.type == 'expense',
+            # '~' sorts after any time suffix stored with the date
+            Transaction.date >= (day - window).isoformat(), Transaction.date <= (day + window).isoformat() + '~',
+            func.round(Transaction.amount, 2) == round(t.amount, 2),
+            func.lower(func.trim(Transaction.merchant)) == (t.merchant or '').strip().lower()
+        ).order_by(Transaction.id).limit(1)).scalar()
+        if original:
+            db.session.add(Anomaly(user_id=t.user_id, transaction_id=t.id, kind='duplicate', score=1.0,
+                                   detail=json.dumps({'duplicate_of': original})))
+            found.append('duplicate')
+
+    alpha = cfg['ANOMALY_EWMA_ALPHA']
+    upsert(CategoryStats, [{'user_id': t.user_id, 'category': c, 'count': 0, 'ewma': a, 'ewma_sq': a * a}
+                           for c, a in dict(lines).items()], ['user_id', 'category'])
+    for category, amount in lines:
+        # One atomic UPDATE per line, so concurrent inserts can't lose each other's step
+        CategoryStats.query.filter_by(user_id=t.user_id, category=category).update({
+            CategoryStats.count: CategoryStats.count + 1,
+            CategoryStats.ewma: alpha * amount + (1 - alpha) * CategoryStats.ewma,
+            CategoryStats.ewma_sq: alpha * amount * amount + (1 - alpha) * CategoryStats.ewma_sq,
+        }, synchronize_session=False)
+    if found and has_request_context():
+        g.setdefault('notify_users', set()).add(t.user_id)
+    return found
+
+@job_handler('anomalies')
+def _anomalies_job(job, params, progress):
+    """Re-score the user's history; params: optional since (YYYY-MM-DD)"""
+    return detect_anomalies([job.user_id], params.get('since'), progress), None
+
+@app.route('/api/anomalies')
+@auth_required
+def anomalies_route():
+    """Flagged transactions, newest first (?status=open|dismissed|all, default open).
+    The history is re-scored nightly by anomalies.py, or on demand with an 'anomalies' job."""
+    user = g.current_user
+    status = request.args.get('status', 'open')
+    query = db.session.query(Anomaly, Transaction).join(Transaction, and_(
+        Transaction.id == Anomaly.transaction_id, Transaction.user_id == Anomaly.user_id)).filter(Anomaly.user_id == user.id)
+    if status != 'all':
+        query = query.filter(Anomaly.status == status)
+    return jsonify([{
+        'id': a.id, 'kind': a.kind, 'score': round(a.score or 0, 2), 'status': a.status,
+        'detail': json.loads(a.detail or '{}'), 'created_at': a.created_at.isoformat() if a.created_at else None,
+        'transaction': {'id': t.id, 'date': t.date, 'merchant': t.merchant, 'category': t.category, 'amount': t.amount}
+    } for a, t in query.order_by(Anomaly.id.desc()).limit(200)])
+
+@app.route('/api/anomalies/<int:id>', methods=['PUT'])
+@auth_required
+def anomaly_modify(id):
+    """{"status": "dismissed"} marks a flag as reviewed ("open" restores it)"""
+    user = g.current_user
+    anomaly = db.session.get(Anomaly, id)
+    if anomaly is None or anomaly.user_id != user.id:
+        return jsonify({'error': 'anomaly not found'}), 404
+    status = (request.json or {}).get('status')
+    if status not in ('open', 'dismissed'):
+        return jsonify({'error': 'status must be open or dismissed'}), 400
+    anomaly.status = status
+    db.session.commit()
+    return jsonify({'status': 'updated'})
+
+# Delta sync
+def _sync_loader(model, row, *options):
+    """Rows of one synced collection for a user, all of them or just `ids`"""
+    def load(user_id, ids=None):
+        query = model.query.options(*options).filter(model.user_id == user_id)
+        if ids is not None:
+            query = query.filter(model.id.in_(ids))
+        return [row(o) for o in query]
+    return load
+
+def _load_investments(user_id, ids=None):
+    query = holdings_query(user_id)
+    if ids is not None:
+        query = query.filter(Investment.id.in_(ids))
+    return investment_rows(query.all())[0]
+
+SYNC_RESOURCES = {
+    'transactions': _sync_loader(Transaction, transaction_row, selectinload(Transaction.splits)),
+    'budgets': _sync_loader(Budget, budget_row),
+    'goals': _sync_loader(Goal, goal_row),
+    'bills': _sync_loader(Bill, bill_row),
+    'accounts': _sync_loader(Account, account_row),
+    'envelope_budgets': _sync_loader(EnvelopeBudget, envelope_row),
+    'recurring_transactions': _sync_loader(RecurringTransaction, recurring_row),
+    'investments': _load_investments,
+    'net_worth': _sync_loader(NetWorthSnapshot, net_worth_row),
+}
+
+@app.route('/api/sync')
+@auth_required
+def sync():
+    """Without ?since= every synced collection in full; with ?since=<cursor> only the
+    rows inserted or updated since then ('changes') and the ids deleted since then
+    ('deleted'), per resource. Clients keep the returned cursor for the next call and
+    call again straight away while has_more is true."""
+    user = g.current_user
+    if request.args.get('since') is None:
+        # Take the cursor first: anything written while the collections load is sent again next time
+        cursor = db.session.execute(select(func.coalesce(func.max(ChangeLog.id), 0)).where(
+            ChangeLog.user_id == user.id)).scalar()
+        return jsonify({'cursor': cursor, 'full': True, 'has_more': False, 'deleted': {},
+                        'changes': {name: load(user.id) for name, load in SYNC_RESOURCES.items()}})
+    try:
+        since = int(request.args['since'])
+    except ValueError:
+        return jsonify({'error': 'since must be a cursor returned by /api/sync'}), 400
+    page_size = app.config['SYNC_PAGE_SIZE']
+    # One range scan of ix_change_log_user_seq
+    entries = db.session.execute(
+        select(ChangeLog.id, ChangeLog.resource, ChangeLog.object_id, ChangeLog.deleted).where(
+            ChangeLog.user_id == user.id, ChangeLog.id > since).order_by(ChangeLog.id).limit(page_size + 1)).all()
+    has_more = len(entries) > page_size
+    entries = entries[:page_size]
+    latest = {(e.resource, e.object_id): e.deleted for e in entries}  # the last entry per row wins
+    changed, deleted = defaultdict(list), defaultdict(list)
+    for (resource, object_id), gone in latest.items():
+        (deleted if gone else changed)[resource].append(object_id)
+    changes = {}
+    for resource, ids in changed.items():
+        changes[resource] = SYNC_RESOURCES[resource](user.id, ids)
+        # Rows deleted after this page's last entry: their tombstone would follow anyway
+        found = {row['id'] for row in changes[resource]}
+        deleted[resource] += [i for i in ids if i not in found]
+    return jsonify({'cursor': entries[-1].id if entries else since, 'full': False, 'has_more': has_more,
+                    'changes': changes, 'deleted': {k: v for k, v in deleted.items() if v}})
 
 # Serve frontend build (if exists)
 @app.route('/', defaults={'path': ''})
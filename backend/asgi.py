@@ -0,0 +1,37 @@
+"""
+ASGI entry point for MyMoney Pro
+
+Threaded mode (Procfile): gunicorn backend.app:app -k gthread --workers 3 --threads 32
+ASGI mode:                uvicorn backend.asgi:asgi_app --workers 3 --host 0.0.0.0 --port $PORT
+
+In ASGI mode the event loop owns the sockets, so slow clients and idle
+keep-alive connections cost nothing. Flask handlers run on a pool of
+ASGI_THREADS threads per worker (default 64). The async views in app.py send their queries to
+a pooled async engine (aiosqlite/asyncpg) on the server's event loop, set up at lifespan startup.
+"""
+
+import asyncio
+import os
+
+from a2wsgi import WSGIMiddleware
+
+from backend.app import app, use_async_engine, close_async_engine
+
+ASGI_THREADS = int(os.environ.get('ASGI_THREADS', 64))
+if 'EVENTS_MAX_CONNECTIONS' not in os.environ:
+    app.config['EVENTS_MAX_CONNECTIONS'] = max(1, ASGI_THREADS // 2)  # the rest serve ordinary requests
+
+wsgi_app = WSGIMiddleware(app, workers=ASGI_THREADS)
+
+async def asgi_app(scope, receive, send):
+    if scope['type'] != 'lifespan':
+        return await wsgi_app(scope, receive, send)
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            use_async_engine(asyncio.get_running_loop())
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await close_async_engine()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
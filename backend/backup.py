@@ -0,0 +1,416 @@
+"""
+Backups for the SQLite database of MyMoney Pro
+
+A backup chain is a directory holding one full copy and the change sets taken
+after it:
+
+    backups/20261019-120000/
+        base.db.gz          full copy, made with SQLite's online backup API
+        0001.changes.db.gz  rows changed since the previous file, per table
+        state.json          checksums, row counts, table contents' CRCs and the cursors of the next export
+
+- full_backup() copies the live database a few thousand pages at a time with a
+  pause in between. In WAL mode the copy reads from one snapshot that it holds
+  open throughout, so writers carry on untouched. In rollback-journal mode each
+  step only locks the file briefly, but every write restarts the copy; after
+  max_restarts the rest is copied in one step, which holds writers off until
+  it's done.
+- export_changes() writes the rows changed since the last file of the chain.
+  Tables whose writes are recorded in change_log (the synced resources) are
+  exported from the log; any other table is compared in rowid chunks against
+  the checksums of the previous export and only changed chunks are written.
+  A change set is itself a small SQLite database: types and blobs round-trip
+  exactly and restore applies it with plain INSERT ... SELECT.
+- restore() rebuilds the database from the chain next to the target, checks the
+  file checksums, runs PRAGMA quick_check (or integrity_check) and compares the
+  row counts and the CRC of every table's contents recorded at export time, and
+  only then swaps it into place. A write that bypassed change_log shows up there
+  instead of being restored silently with its old value.
+"""
+
+import datetime
+import gzip
+import hashlib
+import json
+import marshal
+import os
+import shutil
+import sqlite3
+import time
+import zlib
+
+CHUNK_ROWS = 8192      # rowids per checksummed chunk of tables without a change log
+COPY_BUFFER = 1 << 20
+
+
+class BackupError(Exception):
+    """The chain can't be extended or restored as asked, or a file failed verification"""
+
+
+class _Restarted(Exception):
+    pass
+
+
+def _quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _tables(conn, schema='main'):
+    return [name for (name,) in conn.execute(
+        f"SELECT name FROM {schema}.sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' "
+        "AND name NOT LIKE '\\_%' ESCAPE '\\' ORDER BY name")]
+
+
+def _columns(conn, schema, table):
+    return conn.execute(f'PRAGMA {schema}.table_info({_quote(table)})').fetchall()
+
+
+def _rowid_alias(columns):
+    """The INTEGER PRIMARY KEY column standing in for the rowid, if the table has one"""
+    pk = [c for c in columns if c[5]]
+    return pk[0][1] if len(pk) == 1 and pk[0][2].upper() == 'INTEGER' else None
+
+
+def table_counts(conn, schema='main'):
+    return {t: conn.execute(f'SELECT count(*) FROM {schema}.{_quote(t)}').fetchone()[0] for t in _tables(conn, schema)}
+
+
+def table_digests(conn, tables, schema='main'):
+    """CRC32 of every CHUNK_ROWS-wide rowid range of each table, keyed by chunk number"""
+    digests = {}
+    for table in tables:
+        name = f'{schema}.{_quote(table)}'
+        chunks = digests[table] = {}
+        for (chunk,) in conn.execute(f'SELECT DISTINCT rowid / {CHUNK_ROWS} FROM {name}').fetchall():
+            cursor = conn.execute(f'SELECT rowid, * FROM {name} WHERE rowid >= ? AND rowid < ? ORDER BY rowid',
+                                  (chunk * CHUNK_ROWS, (chunk + 1) * CHUNK_ROWS))
+            crc = 0
+            while rows := cursor.fetchmany(256):
+                crc = zlib.crc32(marshal.dumps(rows, 2), crc)  # version 2: no back-references, so stable
+            chunks[str(chunk)] = crc
+    return digests
+
+
+def table_checksums(digests):
+    """One CRC per table from its table_digests() chunks: the table's whole contents"""
+    return {table: zlib.crc32(json.dumps(sorted(chunks.items(), key=lambda c: int(c[0]))).encode())
+            for table, chunks in digests.items()}
+
+
+def check_database(path, full=False):
+    """PRAGMA quick_check, or the slower integrity_check that also verifies index contents"""
+    conn = sqlite3.connect(path)
+    try:
+        result = [row[0] for row in conn.execute(f"PRAGMA {'integrity_check' if full else 'quick_check'}")]
+    finally:
+        conn.close()
+    if result != ['ok']:
+        raise BackupError(f'{path} failed its integrity check: {"; ".join(result[:5])}')
+
+
+def copy_database(source, dest, pages=2048, pause=0.02, max_restarts=3, progress=None):
+    """Online copy of `source` into `dest`, `pages` pages per step with `pause` seconds
+    between steps. Returns {'pages', 'steps', 'restarts', 'final_step', 'snapshot', 'seconds'}."""
+    start = time.perf_counter()
+    stats = {'pages': 0, 'steps': 0, 'restarts': 0, 'final_step': False}
+    remaining_before = [None]
+
+    def step(status, remaining, total):
+        stats['steps'] += 1
+        stats['pages'] = total
+        if remaining_before[0] is not None and remaining > remaining_before[0]:
+            stats['restarts'] += 1  # the source was written to: SQLite started over
+        remaining_before[0] = remaining
+        if progress:
+            progress(total - remaining, total)
+        if stats['restarts'] >= max_restarts:
+            raise _Restarted()
+        time.sleep(pause)
+
+    src = sqlite3.connect(source, timeout=30)
+    dst = sqlite3.connect(dest)
+    try:
+        # An open read transaction pins a WAL snapshot: the steps copy that version of
+        # the database and writes made meanwhile no longer restart the copy
+        stats['snapshot'] = src.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+        if stats['snapshot']:
+            src.execute('BEGIN')
+            src.execute('SELECT count(*) FROM sqlite_master').fetchone()
+        try:
+            src.backup(dst, pages=pages, progress=step, sleep=pause)
+        except _Restarted:
+            stats['final_step'] = True
+            src.backup(dst, pages=-1, sleep=pause)
+    finally:
+        dst.close()
+        src.close()
+    stats['seconds'] = time.perf_counter() - start
+    return stats
+
+
+class _HashingWriter:
+    def __init__(self, f):
+        self.f, self.sha256, self.size = f, hashlib.sha256(), 0
+
+    def write(self, data):
+        self.sha256.update(data)
+        self.size += len(data)
+        return self.f.write(data)
+
+    def flush(self):
+        self.f.flush()
+
+
+def _compress(path, dest, level):
+    """gzip `path` into `dest`; returns (sha256 hex, compressed size)"""
+    with open(path, 'rb') as src, open(dest + '.partial', 'wb') as out:
+        writer = _HashingWriter(out)
+        with gzip.GzipFile(fileobj=writer, mode='wb', compresslevel=level, mtime=0) as gz:
+            shutil.copyfileobj(src, gz, COPY_BUFFER)
+        out.flush()
+        os.fsync(out.fileno())
+    os.replace(dest + '.partial', dest)
+    return writer.sha256.hexdigest(), writer.size
+
+
+def _decompress(path, dest, sha256):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while block := f.read(COPY_BUFFER):
+            digest.update(block)
+    if digest.hexdigest() != sha256:
+        raise BackupError(f'{path} does not match its checksum; the file is damaged')
+    with gzip.open(path, 'rb') as src, open(dest, 'wb') as out:
+        shutil.copyfileobj(src, out, COPY_BUFFER)
+
+
+def _load_state(chain):
+    try:
+        with open(os.path.join(chain, 'state.json')) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        raise BackupError(f'{chain} is not a backup chain (no state.json)') from None
+
+
+def _save_state(chain, state):
+    path = os.path.join(chain, 'state.json')
+    with open(path + '.partial', 'w') as f:
+        json.dump(state, f, indent=1)
+    os.replace(path + '.partial', path)
+
+
+def _change_log_id(conn, schema='main'):
+    if 'change_log' not in _tables(conn, schema):
+        return None
+    return conn.execute(f'SELECT coalesce(max(id), 0) FROM {schema}.change_log').fetchone()[0]
+
+
+def chain_files(chain):
+    """The chain's files, base first, with their creation time, size and row counts"""
+    return _load_state(chain)['files']
+
+
+def list_chains(root):
+    """Chain directories under `root`, oldest first"""
+    if not os.path.isdir(root):
+        return []
+    return sorted(os.path.join(root, name) for name in os.listdir(root)
+                  if os.path.isfile(os.path.join(root, name, 'state.json')))
+
+
+def full_backup(source, root, logged=None, pages=2048, pause=0.02, max_restarts=3, level=1, progress=None):
+    """Start a new chain under `root` with a compressed, verified copy of `source`.
+    `logged` maps the tables whose writes go to change_log to their resource name."""
+    chain = os.path.join(root, datetime.datetime.utcnow().strftime('%Y%m%d-%H%M%S'))
+    os.makedirs(chain)
+    copy = os.path.join(chain, 'base.db.partial')
+    try:
+        stats = copy_database(source, copy, pages, pause, max_restarts, progress)
+        check_database(copy)
+        conn = sqlite3.connect(copy)
+        try:
+            counts = table_counts(conn)
+            cursor = _change_log_id(conn)
+            logged = {t: r for t, r in (logged or {}).items() if cursor is not None}
+            all_digests = table_digests(conn, list(counts))
+            digests = {t: chunks for t, chunks in all_digests.items() if t not in logged}
+        finally:
+            conn.close()
+        start = time.perf_counter()
+        sha256, size = _compress(copy, os.path.join(chain, 'base.db.gz'), level)
+        stats['compress_seconds'] = time.perf_counter() - start
+    except BaseException:
+        shutil.rmtree(chain, ignore_errors=True)
+        raise
+    finally:
+        if os.path.exists(copy):
+            os.remove(copy)
+    _save_state(chain, {
+        'source': os.path.abspath(source), 'logged': logged, 'change_log_id': cursor, 'digests': digests,
+        'files': [{'name': 'base.db.gz', 'created': datetime.datetime.utcnow().isoformat(), 'sha256': sha256,
+                   'size': size, 'database_size': os.path.getsize(source), 'counts': counts,
+                   'checksums': table_checksums(all_digests)}],
+    })
+    stats.update(chain=chain, size=size, counts=counts)
+    return stats
+
+
+def export_changes(source, chain, level=6):
+    """Append a change set with everything written to `source` since the chain's last
+    file. Returns {'file', 'rows', 'tables', 'seconds', 'size'}."""
+    start = time.perf_counter()
+    state = _load_state(chain)
+    name = f"{len(state['files']):04d}.changes.db.gz"
+    work = os.path.join(chain, name[:-3] + '.partial')
+    if os.path.exists(work):
+        os.remove(work)
+    conn = sqlite3.connect(work, isolation_level=None)
+    try:
+        conn.execute('ATTACH DATABASE ? AS src', (source,))
+        conn.execute('CREATE TABLE _schema (type TEXT, name TEXT, tbl_name TEXT, sql TEXT)')
+        conn.execute('CREATE TABLE _ids (tbl TEXT, id INTEGER)')
+        conn.execute('CREATE TABLE _ranges (tbl TEXT, lo INTEGER, hi INTEGER)')
+        conn.execute('BEGIN')  # one read transaction: the change set is a consistent snapshot
+        conn.execute("INSERT INTO _schema SELECT type, name, tbl_name, sql FROM src.sqlite_master "
+                     "WHERE sql IS NOT NULL AND name NOT LIKE 'sqlite_%'")
+        tables = _tables(conn, 'src')
+        counts = table_counts(conn, 'src')
+        logged = state['logged']
+        cursor = _change_log_id(conn, 'src')
+        if logged and (cursor is None or cursor < state['change_log_id']):
+            raise BackupError(f'{source} is not the database this chain was taken from; start a new chain')
+        rows = {}
+
+        def copy_rows(table, where, params):
+            if rows.get(table) is None:
+                conn.execute(f'CREATE TABLE main.{_quote(table)} AS SELECT rowid AS _rowid, * FROM src.{_quote(table)} WHERE 0')
+                rows[table] = 0
+            rows[table] += conn.execute(f'INSERT INTO main.{_quote(table)} SELECT rowid, * FROM src.{_quote(table)} '
+                                        f'WHERE {where}', params).rowcount
+
+        for table, resource in logged.items():
+            if table not in tables:
+                continue
+            changed = ('SELECT DISTINCT object_id FROM src.change_log WHERE resource = ? AND id > ? AND id <= ?',
+                       (resource, state['change_log_id'], cursor))
+            # Deleted rows are the logged ids that no longer exist; restore deletes them all
+            # first, then inserts the current version of the rest
+            found = conn.execute(f'INSERT INTO _ids SELECT ?, object_id FROM ({changed[0]})', (table, *changed[1])).rowcount
+            if found:
+                copy_rows(table, f'rowid IN ({changed[0]})', changed[1])
+
+        # Logged tables are digested too, only for the restore check
+        all_digests = table_digests(conn, tables, 'src')
+        digests = {t: chunks for t, chunks in all_digests.items() if t not in logged}
+        for table, chunks in digests.items():
+            previous = state['digests'].get(table, {})
+            for chunk in sorted(set(chunks) | set(previous), key=int):
+                if chunks.get(chunk) != previous.get(chunk):
+                    lo, hi = int(chunk) * CHUNK_ROWS, (int(chunk) + 1) * CHUNK_ROWS - 1
+                    conn.execute('INSERT INTO _ranges VALUES (?, ?, ?)', (table, lo, hi))
+                    copy_rows(table, 'rowid BETWEEN ? AND ?', (lo, hi))
+        conn.execute('COMMIT')
+        conn.execute('DETACH DATABASE src')
+    except BaseException:
+        conn.close()
+        os.remove(work)
+        raise
+    conn.close()
+    try:
+        sha256, size = _compress(work, os.path.join(chain, name), level)
+    finally:
+        os.remove(work)
+    state['files'].append({'name': name, 'created': datetime.datetime.utcnow().isoformat(), 'sha256': sha256,
+                           'size': size, 'counts': counts, 'rows': rows, 'checksums': table_checksums(all_digests)})
+    state['change_log_id'] = cursor
+    state['digests'] = digests
+    _save_state(chain, state)
+    return {'file': os.path.join(chain, name), 'rows': sum(rows.values()), 'tables': rows,
+            'seconds': time.perf_counter() - start, 'size': size}
+
+
+def _apply_changes(conn):
+    """Apply the change set attached as `d` to the main database"""
+    for type_, name, tbl_name, sql in conn.execute('SELECT type, name, tbl_name, sql FROM d._schema ORDER BY type DESC').fetchall():
+        if not conn.execute('SELECT 1 FROM main.sqlite_master WHERE name = ?', (name,)).fetchone():
+            conn.execute(sql)  # tables first ('table' > 'index'), then their indexes
+        elif type_ == 'table':
+            present = {c[1] for c in _columns(conn, 'main', name)}
+            for column in _columns(conn, 'd', name) if name in _tables(conn, 'd') else ():
+                if column[1] != '_rowid' and column[1] not in present:
+                    conn.execute(f'ALTER TABLE main.{_quote(name)} ADD COLUMN {_quote(column[1])} {column[2]}')
+    for (table,) in conn.execute('SELECT DISTINCT tbl FROM d._ids').fetchall():
+        conn.execute(f'DELETE FROM main.{_quote(table)} WHERE rowid IN (SELECT id FROM d._ids WHERE tbl = ?)', (table,))
+    for table, lo, hi in conn.execute('SELECT tbl, lo, hi FROM d._ranges').fetchall():
+        conn.execute(f'DELETE FROM main.{_quote(table)} WHERE rowid BETWEEN ? AND ?', (lo, hi))
+    for table in _tables(conn, 'd'):
+        columns = [c[1] for c in _columns(conn, 'd', table) if c[1] != '_rowid']
+        names = ', '.join(map(_quote, columns))
+        if _rowid_alias(_columns(conn, 'main', table)):
+            conn.execute(f'INSERT OR REPLACE INTO main.{_quote(table)} ({names}) SELECT {names} FROM d.{_quote(table)}')
+        else:
+            conn.execute(f'INSERT OR REPLACE INTO main.{_quote(table)} (rowid, {names}) '
+                         f'SELECT _rowid, {names} FROM d.{_quote(table)}')
+
+
+def restore(chain, target, upto=None, full_check=False, progress=None):
+    """Rebuild the database as of the chain's file number `upto` (default: the last one)
+    into `target`. The target is only replaced once the result has been verified."""
+    start = time.perf_counter()
+    state = _load_state(chain)
+    files = state['files'][:None if upto is None else upto + 1]
+    work = target + '.restoring'
+    for path in (work, work + '-journal'):
+        if os.path.exists(path):
+            os.remove(path)
+    try:
+        _decompress(os.path.join(chain, files[0]['name']), work, files[0]['sha256'])
+        if progress:
+            progress(files[0]['name'])
+        conn = sqlite3.connect(work, isolation_level=None)
+        try:
+            # The work file is thrown away on any failure, so skip the journal and fsyncs
+            journal_mode = conn.execute('PRAGMA journal_mode').fetchone()[0]
+            conn.execute('PRAGMA journal_mode = OFF')
+            conn.execute('PRAGMA synchronous = OFF')
+            for entry in files[1:]:
+                changes = work + '.changes'
+                _decompress(os.path.join(chain, entry['name']), changes, entry['sha256'])
+                try:
+                    conn.execute('ATTACH DATABASE ? AS d', (changes,))
+                    conn.execute('BEGIN')
+                    _apply_changes(conn)
+                    conn.execute('COMMIT')
+                    conn.execute('DETACH DATABASE d')
+                finally:
+                    os.remove(changes)
+                if progress:
+                    progress(entry['name'])
+            conn.execute(f'PRAGMA journal_mode = {journal_mode}')
+            counts = table_counts(conn)
+            checksums = table_checksums(table_digests(conn, list(counts))) if 'checksums' in files[-1] else {}
+        finally:
+            conn.close()
+        expected = files[-1]['counts']
+        wrong = {t: (counts.get(t), n) for t, n in expected.items() if counts.get(t) != n}
+        if wrong:
+            raise BackupError('restored row counts differ from the backup: ' +
+                              ', '.join(f'{t} {got} (expected {n})' for t, (got, n) in sorted(wrong.items())))
+        # Chains taken before content checksums were recorded are checked by counts only
+        wrong = sorted(t for t, crc in files[-1].get('checksums', {}).items() if checksums.get(t) != crc)
+        if wrong:
+            raise BackupError(f'restored contents differ from the backup in {", ".join(wrong)}: a write '
+                              'bypassed change_log since the last full backup; start a new chain')
+        check_database(work, full_check)
+        with open(work, 'rb+') as f:
+            os.fsync(f.fileno())
+        # A stale WAL of the old database would be replayed into the new one
+        for suffix in ('-wal', '-shm', '-journal'):
+            if os.path.exists(target + suffix):
+                os.remove(target + suffix)
+        os.replace(work, target)
+    except BaseException:
+        if os.path.exists(work):
+            os.remove(work)
+        raise
+    return {'files': len(files), 'counts': counts, 'seconds': time.perf_counter() - start}
@@ -0,0 +1,444 @@
+"""
+Cache layer for MyMoney Pro
+
+Three interchangeable stores behind one small interface
+(get_many/set/add/delete/incr/token_bucket):
+
+- MemoryCache: per-process LRU, the default; fine for a single worker.
+- SQLiteCache: a shared SQLite file (WAL) so every gunicorn/uvicorn worker on
+  one host sees the same entries and versions.
+- RedisCache: any client speaking the redis-py API; LocalRedis is an
+  in-process stand-in for tests and local development.
+
+VersionedCache adds namespaced per-user keys, version-based invalidation (a
+write bumps a counter instead of deleting keys) and stampede protection (one
+caller computes a missing value while the others wait for it).
+"""
+
+import math
+import os
+import pickle
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+try:
+    import redis
+except ImportError:  # only needed for CACHE_BACKEND=redis with a real server
+    redis = None
+
+
+def _take_tokens(state, cost, rate, capacity, now):
+    """Token bucket step. `state` is b'tokens:timestamp' (or None for a full bucket).
+    Returns (new state, allowed, seconds until `cost` tokens are available)."""
+    tokens, stamp = (float(x) for x in state.split(b':')) if state else (capacity, now)
+    tokens = min(capacity, tokens + max(0.0, now - stamp) * rate)
+    cost = min(cost, capacity)  # a request costing more than the burst must still get through eventually
+    allowed = tokens >= cost
+    if allowed:
+        tokens -= cost
+    return f'{tokens:.6f}:{now:.6f}'.encode(), allowed, 0.0 if allowed else (cost - tokens) / rate
+
+
+class MemoryCache:
+    """In-process LRU with optional per-entry TTL"""
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._data = OrderedDict()  # key -> (expires or None, value)
+        self._lock = threading.Lock()
+
+    def _live(self, key, now):
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        if entry[0] is not None and entry[0] <= now:
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return entry
+
+    def get_many(self, keys):
+        now = time.time()
+        with self._lock:
+            return [entry[1] if (entry := self._live(key, now)) else None for key in keys]
+
+    def _store(self, key, value, ttl):
+        self._data[key] = (time.time() + ttl if ttl else None, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._store(key, value, ttl)
+
+    def add(self, key, value, ttl=None):
+        """Set only if the key is missing; returns whether it was set"""
+        with self._lock:
+            if self._live(key, time.time()):
+                return False
+            self._store(key, value, ttl)
+            return True
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def incr(self, key, delta=1, ttl=None, floor=None):
+        """Add to an integer counter (created at 0) and return the new value. A `ttl`
+        restarts the expiry on every call; the value never goes below `floor`."""
+        with self._lock:
+            entry = self._live(key, time.time())
+            value = (entry[1] if entry else 0) + delta
+            value = value if floor is None else max(floor, value)
+            if entry is None or ttl:
+                self._store(key, value, ttl)
+            else:
+                self._data[key] = (entry[0], value)
+            return value
+
+    def token_bucket(self, key, cost, rate, capacity):
+        """Take `cost` tokens from a bucket refilling at `rate`/s; returns (allowed, retry_after)"""
+        with self._lock:
+            entry = self._live(key, time.time())
+            state, allowed, retry_after = _take_tokens(entry and entry[1], cost, rate, capacity, time.time())
+            self._store(key, state, capacity / rate + 1)
+        return allowed, retry_after
+
+
+class SQLiteCache:
+    """Cache table in a SQLite file shared by the workers on one host"""
+
+    def __init__(self, path, max_entries=100000):
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._writes = 0
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        conn = self._conn()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value BLOB, expires REAL)')
+        conn.execute('CREATE INDEX IF NOT EXISTS ix_cache_expires ON cache (expires)')
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def get_many(self, keys):
+        rows = dict(self._conn().execute(
+            f"SELECT key, value FROM cache WHERE key IN ({','.join('?' * len(keys))}) "
+            "AND (expires IS NULL OR expires > ?)", [*keys, time.time()]).fetchall())
+        return [rows.get(key) for key in keys]
+
+    def set(self, key, value, ttl=None):
+        self._conn().execute('INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?)',
+                             (key, value, time.time() + ttl if ttl else None))
+        self._prune()
+
+    def add(self, key, value, ttl=None):
+        conn = self._conn()
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute('DELETE FROM cache WHERE key = ? AND expires IS NOT NULL AND expires <= ?', (key, now))
+            added = conn.execute('INSERT OR IGNORE INTO cache (key, value, expires) VALUES (?, ?, ?)',
+                                 (key, value, now + ttl if ttl else None)).rowcount == 1
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return added
+
+    def delete(self, key):
+        self._conn().execute('DELETE FROM cache WHERE key = ?', (key,))
+
+    def incr(self, key, delta=1, ttl=None, floor=None):
+        conn = self._conn()
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT value FROM cache WHERE key = ? AND (expires IS NULL OR expires > ?)',
+                               (key, now)).fetchone()
+            value = (int(row[0]) if row else 0) + delta
+            value = value if floor is None else max(floor, value)
+            if row is None:
+                conn.execute('INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?)',
+                             (key, value, now + ttl if ttl else None))
+            elif ttl:
+                conn.execute('UPDATE cache SET value = ?, expires = ? WHERE key = ?', (value, now + ttl, key))
+            else:
+                conn.execute('UPDATE cache SET value = ? WHERE key = ?', (value, key))
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return value
+
+    def token_bucket(self, key, cost, rate, capacity):
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            now = time.time()
+            row = conn.execute('SELECT value FROM cache WHERE key = ? AND (expires IS NULL OR expires > ?)',
+                               (key, now)).fetchone()
+            state, allowed, retry_after = _take_tokens(row and row[0], cost, rate, capacity, now)
+            conn.execute('INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?)',
+                         (key, state, now + capacity / rate + 1))
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        return allowed, retry_after
+
+    def _prune(self):
+        # Every few hundred writes drop expired rows, then the rows closest to expiring past
+        # max_entries. Keys without a TTL (the version counters) are never evicted: losing
+        # one would reset it and serve entries cached under an old version again.
+        self._writes += 1
+        if self._writes % 256:
+            return
+        conn = self._conn()
+        conn.execute('DELETE FROM cache WHERE expires IS NOT NULL AND expires <= ?', (time.time(),))
+        conn.execute('DELETE FROM cache WHERE rowid IN (SELECT rowid FROM cache WHERE expires IS NOT NULL '
+                     'ORDER BY expires DESC LIMIT -1 OFFSET ?)', (self.max_entries,))
+
+
+class RedisCache:
+    """Store on a Redis server; `client` is a redis-py client or a LocalRedis"""
+
+    def __init__(self, client):
+        self.client = client
+
+    def get_many(self, keys):
+        return self.client.mget(keys)
+
+    def set(self, key, value, ttl=None):
+        self.client.set(key, value, ex=ttl)
+
+    def add(self, key, value, ttl=None):
+        return bool(self.client.set(key, value, ex=ttl, nx=True))
+
+    def delete(self, key):
+        self.client.delete(key)
+
+    def incr(self, key, delta=1, ttl=None, floor=None):
+        if floor is None:
+            value = self.client.incrby(key, delta)
+            if ttl:
+                self.client.expire(key, ttl)
+            return value
+
+        def add(pipe):
+            value = max(floor, int(pipe.get(key) or 0) + delta)
+            pipe.multi()
+            pipe.set(key, value, ex=math.ceil(ttl) if ttl else None)
+            return value
+        return self.client.transaction(add, key, value_from_callable=True)
+
+    def token_bucket(self, key, cost, rate, capacity):
+        # WATCH/MULTI: redis-py retries the function if another worker touched the key
+        def take(pipe):
+            state, allowed, retry_after = _take_tokens(pipe.get(key), cost, rate, capacity, time.time())
+            pipe.multi()
+            pipe.set(key, state, ex=int(capacity / rate) + 1)
+            return allowed, retry_after
+        return self.client.transaction(take, key, value_from_callable=True)
+
+
+class LocalRedis:
+    """In-process stand-in for the subset of the redis-py client RedisCache and
+    events.EventBus use. Values come back as bytes, like a real server's."""
+
+    def __init__(self):
+        self._data = {}  # key -> (expires or None, bytes)
+        self._streams = {}  # key -> [(id, {field: bytes})]
+        self._last_id = (0, 0)
+        self._channels = {}  # channel -> set of _LocalPubSub
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def _encode(value):
+        return value if isinstance(value, bytes) else str(value).encode()
+
+    def _get(self, key):
+        entry = self._data.get(key)
+        if entry and entry[0] is not None and entry[0] <= time.time():
+            del self._data[key]
+            return None
+        return entry
+
+    def mget(self, keys):
+        with self._lock:
+            return [entry[1] if (entry := self._get(key)) else None for key in keys]
+
+    def get(self, key):
+        return self.mget([key])[0]
+
+    def set(self, key, value, ex=None, nx=False):
+        with self._lock:
+            if nx and self._get(key):
+                return None
+            self._data[key] = (time.time() + ex if ex else None, self._encode(value))
+            return True
+
+    def delete(self, *keys):
+        with self._lock:
+            return sum(self._data.pop(key, None) is not None for key in keys)
+
+    def incrby(self, key, amount=1):
+        with self._lock:
+            entry = self._get(key)
+            value = int(entry[1]) + amount if entry else amount
+            self._data[key] = (entry[0] if entry else None, self._encode(value))
+            return value
+
+    def expire(self, key, seconds):
+        with self._lock:
+            entry = self._get(key)
+            if entry:
+                self._data[key] = (time.time() + seconds, entry[1])
+            return bool(entry)
+
+    def transaction(self, func, *watches, value_from_callable=False):
+        # Holding the lock for the whole call is what WATCH/MULTI/EXEC guarantees
+        with self._lock:
+            result = func(self)
+        return result if value_from_callable else []
+
+    def multi(self):
+        pass
+
+    def xadd(self, name, fields, maxlen=None, approximate=True):
+        with self._lock:
+            ms = int(time.time() * 1000)
+            self._last_id = (ms, 0) if ms > self._last_id[0] else (self._last_id[0], self._last_id[1] + 1)
+            event_id = '%d-%d' % self._last_id
+            entries = self._streams.setdefault(name, [])
+            entries.append((event_id.encode(), {k.encode(): self._encode(v) for k, v in fields.items()}))
+            if maxlen is not None:
+                del entries[:-maxlen]
+            return event_id.encode()
+
+    def xrange(self, name, min='-', max='+'):
+        def bound(value, default):
+            if value in ('-', '+'):
+                return default, False
+            exclusive = value.startswith('(')
+            ms, _, seq = value.lstrip('(').partition('-')
+            return (int(ms), int(seq or 0)), exclusive
+        (low, low_open), (high, high_open) = bound(min, (0, 0)), bound(max, (float('inf'), 0))
+        with self._lock:
+            entries = list(self._streams.get(name, ()))
+        result = []
+        for event_id, fields in entries:
+            ms, seq = event_id.decode().split('-')
+            key = (int(ms), int(seq))
+            if (low < key or (key == low and not low_open)) and (key < high or (key == high and not high_open)):
+                result.append((event_id, dict(fields)))
+        return result
+
+    def publish(self, channel, message):
+        with self._lock:
+            subscribers = list(self._channels.get(channel, ()))
+        for pubsub in subscribers:
+            pubsub._queue.put({'type': 'message', 'channel': channel.encode(), 'data': self._encode(message)})
+        return len(subscribers)
+
+    def pubsub(self, ignore_subscribe_messages=False):
+        return _LocalPubSub(self)
+
+
+class _LocalPubSub:
+    """The PubSub object of LocalRedis.pubsub(): subscribe() and get_message() only"""
+
+    def __init__(self, server):
+        self._server = server
+        self._queue = queue.Queue()
+
+    def subscribe(self, *channels):
+        with self._server._lock:
+            for channel in channels:
+                self._server._channels.setdefault(channel, set()).add(self)
+
+    def get_message(self, ignore_subscribe_messages=False, timeout=0.0):
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        with self._server._lock:
+            for subscribers in self._server._channels.values():
+                subscribers.discard(self)
+
+
+def create_store(backend, url=None, max_entries=1024):
+    """Build the store named by CACHE_BACKEND ('memory', 'sqlite' or 'redis')"""
+    if backend == 'memory':
+        return MemoryCache(max_entries)
+    if backend == 'sqlite':
+        return SQLiteCache(url or os.path.join('instance', 'cache.db'))
+    if backend == 'redis':
+        if url == 'local':
+            return RedisCache(LocalRedis())
+        if redis is None:
+            raise RuntimeError('CACHE_BACKEND=redis needs the redis package (pip install redis)')
+        return RedisCache(redis.Redis.from_url(url or 'redis://localhost:6379/0'))
+    raise ValueError(f'unknown cache backend {backend!r}')
+
+
+class VersionedCache:
+    """Namespaced, per-user results over any store.
+
+    Keys look like <prefix>:<namespace>:u<user_id>:<global version>.<user version>:<key>.
+    bump() increments a version counter, so later lookups use new keys and stale
+    entries simply age out. On a miss one caller takes a short lock and computes the
+    value; concurrent callers poll for it (up to lock_timeout) instead of recomputing.
+    """
+
+    def __init__(self, store, prefix='mymoney', ttl=3600, lock_timeout=10):
+        self.store = store
+        self.prefix = prefix
+        self.ttl = ttl
+        self.lock_timeout = lock_timeout
+
+    def _version_keys(self, namespace, user_id):
+        return [f'{self.prefix}:v:{namespace}:*', f'{self.prefix}:v:{namespace}:u{user_id}']
+
+    def bump(self, namespace, user_id=None):
+        """Invalidate a namespace for one user, or for everyone with user_id=None"""
+        self.store.incr(self._version_keys(namespace, user_id)[0 if user_id is None else 1])
+
+    def get_or_compute(self, namespace, user_id, compute, key=None):
+        versions = self.store.get_many(self._version_keys(namespace, user_id))
+        version = '.'.join(str(int(v or 0)) for v in versions)
+        cache_key = f'{self.prefix}:{namespace}:u{user_id}:{version}:{key!r}'
+        value = self.store.get_many([cache_key])[0]
+        if value is not None:
+            return pickle.loads(value)
+
+        lock_key = cache_key + ':lock'
+        token = uuid.uuid4().hex.encode()
+        deadline = time.monotonic() + self.lock_timeout
+        while not self.store.add(lock_key, token, ttl=self.lock_timeout):
+            time.sleep(0.02)
+            value = self.store.get_many([cache_key])[0]
+            if value is not None:
+                return pickle.loads(value)
+            if time.monotonic() > deadline:
+                return compute()  # the lock holder is stuck; don't wait forever
+        try:
+            result = compute()
+            self.store.set(cache_key, pickle.dumps(result, pickle.HIGHEST_PROTOCOL), ttl=self.ttl)
+            return result
+        finally:
+            self.store.delete(lock_key)
@@ -0,0 +1,206 @@
+"""
+Server-sent events for MyMoney Pro
+
+EventBus carries per-user events between workers over Redis:
+
+- publish() appends the event to the user's capped stream (XADD), which is what
+  reconnecting clients replay from their Last-Event-ID, and PUBLISHes it on one
+  channel shared by every worker.
+- Each worker runs a single listener thread on that channel and hands events to
+  the Subscriptions of its own open connections, so an idle connection is just
+  a thread parked on a condition variable: no polling, no database.
+
+LocalRedis (from cache.py) stands in for the server in tests and single-process
+setups; it implements the stream and pub/sub commands used here.
+"""
+
+import json
+import logging
+import threading
+import time
+from collections import deque
+
+try:
+    from backend.cache import LocalRedis, redis
+except ImportError:
+    from cache import LocalRedis, redis
+
+log = logging.getLogger(__name__)
+
+
+class StreamLost(Exception):
+    """The subscriber fell behind or the bus lost its connection; the client should
+    reconnect and resume from its Last-Event-ID"""
+
+
+def _stream_id(event_id):
+    """Redis stream ids ('<ms>-<seq>') as comparable tuples"""
+    ms, _, seq = event_id.partition('-')
+    return int(ms), int(seq or 0)
+
+
+class Subscription:
+    """Events for one open connection. Closing it frees the worker's connection slot."""
+
+    def __init__(self, bus, user_id, max_pending):
+        self.bus = bus
+        self.user_id = user_id
+        self.max_pending = max_pending
+        self._events = deque()
+        self._cond = threading.Condition()
+        self._lost = False
+        self._after = None  # id of the last replayed event; anything up to it was already queued
+        self.closed = False
+
+    def _replay(self, backlog, last_id):
+        with self._cond:
+            self._after = _stream_id(backlog[-1][0] if backlog else last_id)
+            live = [e for e in self._events if _stream_id(e[0]) > self._after]
+            self._events = deque(backlog + live)
+            self._cond.notify()
+
+    def _push(self, event):
+        with self._cond:
+            if self._after is not None and _stream_id(event[0]) <= self._after:
+                return
+            if len(self._events) >= self.max_pending:
+                self._lost = True
+            else:
+                self._events.append(event)
+            self._cond.notify()
+
+    def _lose(self):
+        with self._cond:
+            self._lost = True
+            self._cond.notify()
+
+    def get(self, timeout):
+        """Wait up to `timeout` seconds and return the pending (id, event, data) tuples,
+        an empty list when nothing arrived"""
+        with self._cond:
+            self._cond.wait_for(lambda: self._events or self._lost, timeout)
+            if self._lost:
+                raise StreamLost(self.user_id)
+            events = list(self._events)
+            self._events.clear()
+            return events
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.bus._unsubscribe(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class EventBus:
+    """Per-user event streams with cross-worker fan-out; `client` is a redis-py client or a LocalRedis"""
+
+    def __init__(self, client, prefix='mymoney', history=500, max_connections=100, max_pending=1000):
+        self.client = client
+        self.prefix = prefix
+        self.channel = f'{prefix}:events'
+        self.history = history
+        self.max_connections = max_connections
+        self.max_pending = max_pending
+        self._subscribers = {}  # user_id -> set of Subscriptions in this process
+        self._count = 0
+        self._lock = threading.Lock()
+        self._listener = None
+        self._listening = threading.Event()
+
+    def _stream(self, user_id):
+        return f'{self.prefix}:events:u{user_id}'
+
+    def publish(self, user_id, event, data):
+        """Send `event` with JSON-serializable `data` to the user's connections on every
+        worker; returns the event id"""
+        payload = json.dumps(data, separators=(',', ':'))
+        event_id = self.client.xadd(self._stream(user_id), {'event': event, 'data': payload},
+                                    maxlen=self.history, approximate=True)
+        event_id = event_id.decode() if isinstance(event_id, bytes) else event_id
+        self.client.publish(self.channel, json.dumps([user_id, event_id, event, payload]))
+        return event_id
+
+    def since(self, user_id, last_id):
+        """Events of the user after `last_id`, oldest first, from the capped stream"""
+        _stream_id(last_id)  # ValueError for ids that aren't ours
+        entries = self.client.xrange(self._stream(user_id), min=f'({last_id}', max='+')
+        return [(event_id.decode() if isinstance(event_id, bytes) else event_id,
+                 fields[b'event'].decode(), fields[b'data'].decode()) for event_id, fields in entries]
+
+    def subscribe(self, user_id, last_id=None, max_connections=None):
+        """A Subscription for a new connection, starting with the events after `last_id`
+        when given, or None when this worker already has max_connections open"""
+        with self._lock:
+            if self._count >= (max_connections or self.max_connections):
+                return None
+            self._count += 1
+            subscription = Subscription(self, user_id, self.max_pending)
+            self._subscribers.setdefault(user_id, set()).add(subscription)
+            if self._listener is None or not self._listener.is_alive():
+                self._listener = threading.Thread(target=self._listen, name='event-bus', daemon=True)
+                self._listener.start()
+        self._listening.wait(5)
+        # Subscribe first, then read the backlog, so nothing published in between is lost
+        if last_id:
+            try:
+                subscription._replay(self.since(user_id, last_id), last_id)
+            except ValueError:
+                pass  # not one of our ids: start from live events
+        return subscription
+
+    def _unsubscribe(self, subscription):
+        with self._lock:
+            self._count -= 1
+            subscribers = self._subscribers.get(subscription.user_id, set())
+            subscribers.discard(subscription)
+            if not subscribers:
+                self._subscribers.pop(subscription.user_id, None)
+
+    @property
+    def connections(self):
+        return self._count
+
+    def _dispatch(self, message):
+        user_id, event_id, event, data = json.loads(message)
+        with self._lock:
+            subscribers = list(self._subscribers.get(user_id, ()))
+        for subscription in subscribers:
+            subscription._push((event_id, event, data))
+
+    def _listen(self):
+        while True:
+            try:
+                pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                self._listening.set()
+                while True:
+                    message = pubsub.get_message(timeout=1.0)
+                    if message and message['type'] == 'message':
+                        self._dispatch(message['data'])
+            except Exception:
+                log.exception('event bus listener lost its connection')
+                self._listening.clear()
+                # Events published while we reconnect would be missed: make the clients resume
+                with self._lock:
+                    subscribers = [s for group in self._subscribers.values() for s in group]
+                for subscription in subscribers:
+                    subscription._lose()
+                time.sleep(1)
+
+
+def create_bus(backend, url=None, **options):
+    """Build the bus named by EVENTS_BACKEND: 'redis' (shared by every worker) or
+    'local' (this process only)"""
+    if backend == 'local' or url == 'local':
+        return EventBus(LocalRedis(), **options)
+    if backend == 'redis':
+        if redis is None:
+            raise RuntimeError('EVENTS_BACKEND=redis needs the redis package (pip install redis)')
+        return EventBus(redis.Redis.from_url(url or 'redis://localhost:6379/0'), **options)
+    raise ValueError(f'unknown events backend {backend!r}')
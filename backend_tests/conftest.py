@@ -0,0 +1,40 @@
+import os
+import tempfile
+
+# The engine is created when backend.app is imported, so point it at a throwaway
+# SQLite file before the import instead of sharing instance/mymoney.db.
+os.environ.setdefault('DATABASE_URL', 'sqlite:///' + os.path.join(tempfile.mkdtemp(prefix='mymoney-tests-'), 'test.db'))
+
+import pytest
+from backend.app import app, query_guard_log
+
+@pytest.fixture
+def query_budget():
+    """Turn the query guard on for one test and fail it if a budgeted endpoint overspends.
+
+    Yields a dict of endpoint -> max statements per request, pre-filled with
+    app.config['QUERY_BUDGETS']; tests add entries for the routes they exercise.
+    """
+    budgets = dict(app.config['QUERY_BUDGETS'])
+    previous = app.config['QUERY_GUARD']
+    app.config['QUERY_GUARD'] = True
+    query_guard_log.clear()
+    yield budgets
+    app.config['QUERY_GUARD'] = previous
+    _check_budgets(budgets)
+
+@pytest.fixture(autouse=True)
+def _enforce_configured_budgets():
+    """With QUERY_GUARD=1 in the environment every test is held to QUERY_BUDGETS"""
+    query_guard_log.clear()
+    yield
+    if app.config['QUERY_GUARD']:
+        _check_budgets(app.config['QUERY_BUDGETS'])
+
+def _check_budgets(budgets):
+    over = [f"{r['path']} ran {r['count']} queries (budget {budgets[r['endpoint']]})"
+            for r in query_guard_log
+            if r['endpoint'] in budgets and r['count'] > budgets[r['endpoint']]]
+    query_guard_log.clear()
+    if over:
+        pytest.fail('query budget exceeded: ' + '; '.join(over))
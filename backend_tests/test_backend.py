@@ -1,13 +1,16 @@
 import pytest
-from backend.app import app, db, User
+from backend.app import app, db, User, query_guard_log
 import json
+import datetime
 
 @pytest.fixture
 def client():
     app.config['TESTING'] = True
     app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+    app.config['RATE_LIMIT_ENABLED'] = False
     with app.test_client() as client:
         with app.app_context():
+            db.drop_all()
             db.create_all()
         yield client
 
@@ -32,3 +35,620 @@ def test_protected_transactions(client):
     assert r2.status_code == 200
     data = r2.get_json()
     assert isinstance(data, list) and len(data) == 1
+
+def test_query_budget_and_n_plus_one_detection(client, query_budget):
+    token = register_and_login(client)
+    headers = {'Authorization': f'Bearer {token}'}
+    query_budget['transactions'] = 3
+    for day in range(1, 8):
+        client.post('/api/transactions', json={'type':'income','category':'Salary','amount':100,'merchant':'Work','date':f'2024-01-0{day}'}, headers=headers)
+    client.post('/api/transactions', json={'type':'expense','category':'Food','amount':5,'merchant':'Cafe','date':'2024-01-09'}, headers=headers)
+    query_guard_log.clear()  # the budget is for listing; writes also log their changes for /api/sync
+    r = client.get('/api/transactions', headers=headers)
+    assert int(r.headers['X-Query-Count']) <= 3
+    client.get('/api/analytics/age-of-money', headers=headers)
+    report = [e for e in query_guard_log if e['endpoint'] == 'age_of_money'][0]
+    assert report['repeated'] and max(report['repeated'].values()) == 7
+
+def test_api_responses_are_compressed(client):
+    import gzip
+    token = register_and_login(client)
+    headers = {'Authorization': f'Bearer {token}', 'Accept-Encoding': 'gzip'}
+    r = client.get('/api/transactions', headers=headers)
+    assert 'Content-Encoding' not in r.headers  # below COMPRESS_MIN_SIZE
+    for i in range(50):
+        client.post('/api/transactions', json={'type':'expense','category':'Food','amount':i,'merchant':'Cafe'}, headers=headers)
+    r = client.get('/api/transactions', headers=headers)
+    assert r.headers['Content-Encoding'] == 'gzip' and 'Accept-Encoding' in r.headers['Vary']
+    assert len(json.loads(gzip.decompress(r.data))) == 50
+    r = client.get('/api/transactions/export', headers=headers)
+    assert r.headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(r.data).decode().count('\n') == 51
+
+def test_async_analytics_views(client):
+    token = register_and_login(client)
+    headers = {'Authorization': f'Bearer {token}'}
+    client.post('/api/transactions', json={'type':'expense','category':'Food','amount':30,'merchant':'Cafe'}, headers=headers)
+    client.post('/api/transactions', json={'type':'expense','category':'Rent','amount':70,'merchant':'Landlord'}, headers=headers)
+    client.post('/api/bills', json={'name':'Power','amount':40,'due_date':datetime.date.today().isoformat()}, headers=headers)
+    r = client.get('/api/analytics/category-breakdown', headers=headers)
+    assert [c['name'] for c in r.get_json()] == ['Rent', 'Food']
+    r = client.get('/api/notifications', headers=headers)
+    assert r.get_json()[0]['bill_id']
+    assert client.get('/api/notifications').status_code == 401
+
+    # Under ASGI the queries go to a pooled engine on the server's loop, reused across requests
+    import asyncio, threading
+    import backend.app as app_module
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    try:
+        assert app_module.use_async_engine(loop)
+        for _ in range(3):
+            assert client.get('/api/notifications', headers=headers).get_json()[0]['bill_id']
+        assert app_module._async_engine.pool.checkedin() >= 1
+    finally:
+        asyncio.run_coroutine_threadsafe(app_module.close_async_engine(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+
+FEED = {'X-Price-Feed-Token': 'feed-secret'}
+
+def test_bulk_price_refresh_updates_every_holder(client, monkeypatch):
+    monkeypatch.setitem(app.config, 'PRICE_FEED_TOKEN', 'feed-secret')
+    tokens = [register_and_login(client, username=name) for name in ('alice', 'bob')]
+    alice, bob = ({'Authorization': f'Bearer {token}'} for token in tokens)
+    for headers in (alice, bob):
+        client.post('/api/investments', json={'symbol':'aapl','name':'Apple','type':'stock','quantity':10,'purchase_price':100,'current_price':100}, headers=headers)
+        client.post('/api/investments', json={'symbol':'BND','name':'Bonds','type':'bond','quantity':5,'purchase_price':50,'current_price':50}, headers=headers)
+    assert client.post('/api/investments', json={'symbol':' ','name':'Blank'}, headers=alice).status_code == 400
+    # Users can't move the shared price, only the feed can
+    assert client.post('/api/investments/prices', json={'prices': {'AAPL': 1}}, headers=alice).status_code == 403
+    assert client.post('/api/investments/prices', json={'prices': {'AAPL': 1}}, headers={'X-Price-Feed-Token': 'guess'}).status_code == 403
+    r = client.post('/api/investments/prices', json={'prices': {'AAPL': 150, 'BND': 40}}, headers=FEED)
+    assert r.get_json()['updated'] == 2
+    assert client.post('/api/investments/prices', json={'prices': {'AAPL': -1}}, headers=FEED).status_code == 400
+    assert client.post('/api/investments/prices', json={'history': {' ': []}}, headers=FEED).status_code == 400
+    data = client.get('/api/investments', headers=bob).get_json()
+    assert [i['current_price'] for i in data['investments']] == [150, 40]
+    assert data['summary']['total_value'] == 1700 and data['summary']['gain_loss'] == 450
+    assert [(a['type'], a['value']) for a in data['summary']['allocation']] == [('stock', 1500), ('bond', 200)]
+
+    # A manual price overrides the market for the owner's holding only
+    bob_aapl = data['investments'][0]['id']
+    client.put(f'/api/investments/{bob_aapl}', json={'current_price': 175}, headers=bob)
+    prices = lambda headers: [i['current_price'] for i in client.get('/api/investments', headers=headers).get_json()['investments']]
+    assert prices(bob) == [175, 40] and prices(alice) == [150, 40]
+    client.post('/api/investments/prices', json={'prices': {'AAPL': 160}}, headers=FEED)
+    assert prices(bob) == [175, 40] and prices(alice) == [160, 40]
+    client.put(f'/api/investments/{bob_aapl}', json={'current_price': None}, headers=bob)
+    assert prices(bob) == [160, 40]
+    client.put(f'/api/investments/{bob_aapl}', json={'current_price': 160, 'quantity': 11}, headers=bob)  # edit form echoes the price
+    client.post('/api/investments/prices', json={'prices': {'AAPL': 170}}, headers=FEED)
+    assert prices(bob) == [170, 40]
+
+def test_investment_performance_xirr_and_twr(client, monkeypatch):
+    monkeypatch.setitem(app.config, 'PRICE_FEED_TOKEN', 'feed-secret')
+    token = register_and_login(client)
+    headers = {'Authorization': f'Bearer {token}'}
+    today = datetime.date.today()
+    two_years_ago = (today - datetime.timedelta(days=730)).isoformat()
+    one_year_ago = (today - datetime.timedelta(days=365)).isoformat()
+    client.post('/api/investments', json={'symbol':'IDX','name':'Index','quantity':10,'purchase_price':100,'current_price':100,'purchase_date':two_years_ago}, headers=headers)
+    client.post('/api/investments', json={'symbol':'IDX','name':'Index','quantity':10,'purchase_price':110,'current_price':110,'purchase_date':one_year_ago}, headers=headers)
+    client.post('/api/investments/prices', json={'prices': {'IDX': 121}, 'history': {'IDX': [[one_year_ago, 110]]}}, headers=FEED)
+    perf = client.get('/api/investments/performance', headers=headers).get_json()
+    assert perf['portfolio']['value'] == 2420
+    assert abs(perf['portfolio']['xirr'] - 0.10) < 1e-6
+    assert abs(perf['portfolio']['twr'] - 0.21) < 1e-6  # the second purchase isn't counted as return
+    assert abs(perf['holdings'][0]['xirr'] - 0.10) < 1e-6 and abs(perf['holdings'][1]['twr'] - 0.10) < 1e-6
+    client.post('/api/investments/prices', json={'prices': {'IDX': 132}}, headers=FEED)
+    perf = client.get('/api/investments/performance', headers=headers).get_json()
+    assert perf['portfolio']['value'] == 2640
+
+    # The version moves only once the new prices are committed
+    from backend.app import result_cache, upsert_prices
+    version = lambda: result_cache.store.get_many([result_cache._version_keys('performance', None)[0]])[0]
+    with app.app_context():
+        before = version()
+        upsert_prices({'IDX': 1})
+        assert version() == before
+        db.session.rollback()
+        assert version() == before
+        upsert_prices({'IDX': 143})
+        db.session.commit()
+        assert version() != before
+    assert client.get('/api/investments/performance', headers=headers).get_json()['portfolio']['value'] == 2860
+
+    # Feed ticks don't pile up in the sync log: each holding keeps its newest entry only
+    from backend.app import ChangeLog
+    cursor = client.get('/api/sync', headers=headers).get_json()['cursor']
+    for price in (150, 151, 152):
+        client.post('/api/investments/prices', json={'prices': {'IDX': price}}, headers=FEED)
+    with app.app_context():
+        entries = ChangeLog.query.filter_by(resource='investments').all()
+        assert len(entries) == len({e.object_id for e in entries}) == 2
+    changed = client.get(f'/api/sync?since={cursor}', headers=headers).get_json()
+    assert len(changed['changes']['investments']) == 2
+
+def test_cash_flow_forecast(client):
+    token = register_and_login(client)
+    headers = {'Authorization': f'Bearer {token}'}
+    today = datetime.date.today()
+    day = lambda n: (today + datetime.timedelta(days=n)).isoformat()
+    account_id = client.post('/api/accounts', json={'name':'Checking','balance':1000}, headers=headers).get_json()['id']
+    rule_id = client.post('/api/recurring-transactions', json={'account_id':account_id,'type':'expense','category':'Rent','merchant':'Landlord','amount':300,'frequency':'weekly','next_date':day(0)}, headers=headers).get_json()['id']
+    client.post('/api/bills', json={'name':'Power','amount':50,'due_date':day(1)}, headers=headers)
+    data = client.get('/api/forecast?days=30', headers=headers).get_json()
+    checking, unassigned = data['accounts']
+    assert len(checking['balances']) == 31
+    assert checking['balances'][:8] == [700] * 7 + [400]
+    assert checking['first_negative_date'] == day(21) and checking['lowest_balance'] == -500
+    assert unassigned['account_id'] is None and unassigned['ending_balance'] == -50
+    assert data['total']['ending_balance'] == -550 and len(data['events']) == 6
+    client.put(f'/api/recurring-transactions/{rule_id}', json={'amount':100}, headers=headers)
+    checking = client.get('/api/forecast?days=30', headers=headers).get_json()['accounts'][0]
+    assert checking['first_negative_date'] is None and checking['ending_balance'] == 500
+    assert client.get('/api/forecast?days=0', headers=headers).status_code == 400
+
+    # Bad dates are refused, and rules stored with one before validation are skipped
+    rule = {'account_id':account_id,'amount':10,'frequency':'daily','next_date':''}
+    assert client.post('/api/recurring-transactions', json=rule, headers=headers).status_code == 400
+    assert client.put(f'/api/recurring-transactions/{rule_id}', json={'end_date':'soon'}, headers=headers).status_code == 400
+    from backend.app import RecurringTransaction, bump_cache_version
+    with app.app_context():
+        db.session.add(RecurringTransaction(user_id=1, account_id=account_id, type='expense', category='X', merchant='Y',
+                                            amount=10, frequency='daily', start_date='', next_date=''))
+        db.session.commit()
+        bump_cache_version('forecast', 1)
+    checking = client.get('/api/forecast?days=30', headers=headers).get_json()['accounts'][0]
+    assert checking['ending_balance'] == 500
+
+def test_split_transactions_crud_and_analytics(client, query_budget):
+    token = register_and_login(client)
+    headers = {'Authorization': f'Bearer {token}'}
+    query_budget['transactions'] = 3
+    splits = [{'category':'Groceries','amount':60},{'category':'Household','amount':40,'notes':'detergent'}]
+    r = client.post('/api/transactions', json={'type':'expense','category':'Supermarket','amount':100,'merchant':'Mart','splits':splits}, headers=headers)
+    tid = r.get_json()['id']
+    client.post('/api/transactions', json={'type':'expense','category':'Groceries','amount':15,'merchant':'Deli'}, headers=headers)
+    bad = client.post('/api/transactions', json={'type':'expense','category':'X','amount':100,'merchant':'Mart','splits':splits[:1]}, headers=headers)
+    assert bad.status_code == 400
+    query_guard_log.clear()  # budget the listing only
+    items = client.get('/api/transactions', headers=headers).get_json()
+    assert [s['category'] for s in items[-1]['splits']] == ['Groceries', 'Household'] and items[0]['splits'] == []
+    breakdown = {c['name']: c['value'] for c in client.get('/api/analytics/category-breakdown', headers=headers).get_json()}
+    assert breakdown == {'Groceries': 75, 'Household': 40}
+    assert client.put(f'/api/transactions/{tid}', json={'amount':90}, headers=headers).status_code == 400
+    client.put(f'/api/transactions/{tid}', json={'amount':90,'splits':[{'category':'Household','amount':90}]}, headers=headers)
+    breakdown = {c['name']: c['value'] for c in client.get('/api/analytics/category-breakdown', headers=headers).get_json()}
+    assert breakdown == {'Groceries': 15, 'Household': 90}
+    trend = client.get('/api/analytics/spending-trend?category=Household', headers=headers).get_json()
+    assert sum(m['expense'] for m in trend) == 90
+    client.delete(f'/api/transactions/{tid}', headers=headers)
+    with app.app_context():
+        from backend.app import TransactionSplit
+        assert TransactionSplit.query.count() == 0
+
+def test_account_ledger_balances_and_reconciliation(client):
+    token = register_and_login(client)
+    headers = {'Authorization': f'Bearer {token}'}
+    acct = client.post('/api/accounts', json={'name':'Checking','balance':500}, headers=headers).get_json()['id']
+    balance = lambda: client.get('/api/accounts', headers=headers).get_json()[0]['balance']
+    client.post('/api/transactions', json={'type':'income','category':'Salary','amount':1000,'merchant':'Work','date':'2024-01-01','account_id':acct}, headers=headers)
+    rent = client.post('/api/transactions', json={'type':'expense','category':'Rent','amount':700,'merchant':'Landlord','date':'2024-01-03','account_id':acct}, headers=headers).get_json()['id']
+    client.post('/api/transactions', json={'type':'expense','category':'Food','amount':50,'merchant':'Cafe','date':'2024-02-01','account_id':acct}, headers=headers)
+    assert balance() == 750
+    assert client.post('/api/transactions', json={'amount':1,'account_id':9999}, headers=headers).status_code == 400
+    client.put(f'/api/transactions/{rent}', json={'amount':800}, headers=headers)
+    assert balance() == 650
+    ledger = client.get(f'/api/accounts/{acct}/transactions', headers=headers).get_json()
+    assert [t['running_balance'] for t in ledger['transactions']] == [650, 700, 1500]
+    r = client.post(f'/api/accounts/{acct}/reconcile', json={'statement_balance':690,'as_of':'2024-01-31'}, headers=headers).get_json()
+    assert not r['reconciled'] and r['difference'] == -10 and r['last_reconciled'] is None
+    r = client.post(f'/api/accounts/{acct}/reconcile', json={'statement_balance':700,'as_of':'2024-01-31'}, headers=headers).get_json()
+    assert r['reconciled'] and r['transactions'] == 2 and r['last_reconciled']
+    client.delete(f'/api/transactions/{rent}', headers=headers)
+    client.put(f'/api/accounts/{acct}', json={'balance':1000}, headers=headers)
+    assert balance() == 1000
+    assert client.get(f'/api/accounts/{acct}/transactions', headers=headers).get_json()['opening_balance'] == 50
+
+def test_add_missing_columns_backfills_opening_balance(client):
+    from backend.app import Account, add_missing_columns
+    from sqlalchemy import text
+    with app.app_context():
+        db.session.add(User(username='legacy', password_hash='x'))
+        db.session.flush()
+        db.session.add(Account(user_id=1, name='Old', balance=42, opening_balance=0))
+        db.session.commit()
+        db.session.execute(text('ALTER TABLE account DROP COLUMN opening_balance'))
+        db.session.commit()
+        assert add_missing_columns() == ['account.opening_balance']
+        assert db.session.get(Account, 1).opening_balance == 42
+        from backend.app import ChangeLog  # synced and backed up like any other account write
+        assert ChangeLog.query.filter_by(resource='accounts', object_id=1).count() == 2
+
+def test_budget_templates_cached_and_applied(client):
+    from backend.app import BudgetTemplate
+    token = register_and_login(client)
+    headers = {'Authorization': f'Bearer {token}'}
+    with app.app_context():
+        db.session.add(BudgetTemplate(name='Simple', categories=json.dumps([{'category':'Housing','percentage':30},{'category':'Food','percentage':15},{'category':'Fun','priority':9}])))
+        db.session.commit()
+    templates = client.get('/api/budget-templates', headers=headers).get_json()
+    assert templates[0]['categories'][0] == {'category':'Housing','percentage':30}
+    tid = templates[0]['id']
+    r = client.post(f'/api/budget-templates/{tid}/apply', json={'month':'2024-03','income':4000}, headers=headers).get_json()
+    assert (r['created'], r['updated']) == (3, 0)
+    envelopes = {e['category']: e for e in client.get('/api/envelope-budgets?month=2024-03', headers=headers).get_json()}
+    assert envelopes['Housing']['assigned'] == 1200 and envelopes['Fun']['priority'] == 9
+    client.post('/api/transactions', json={'type':'income','category':'Salary','amount':5000,'merchant':'Work','date':'2024-03-01'}, headers=headers)
+    r = client.post(f'/api/budget-templates/{tid}/apply', json={'month':'2024-03'}, headers=headers).get_json()
+    assert (r['income'], r['created'], r['updated']) == (5000, 0, 3)
+    envelopes = {e['category']: e for e in client.get('/api/envelope-budgets?month=2024-03', headers=headers).get_json()}
+    assert envelopes['Food']['assigned'] == 750 and envelopes['Food']['available'] == 750
+    assert client.post(f'/api/budget-templates/{tid}/apply', json={'month':'2024-13'}, headers=headers).status_code == 400
+    from backend.app import result_cache
+    version = lambda: result_cache.store.get_many([result_cache._version_keys('budget_templates', None)[0]])[0]
+    with app.app_context():
+        before = version()
+        db.session.get(BudgetTemplate, tid).name = 'Draft'
+        db.session.flush()
+        assert version() == before  # flushed, not committed
+        db.session.rollback()
+        assert version() == before
+        db.session.get(BudgetTemplate, tid).name = 'Renamed'
+        db.session.commit()
+    assert client.get('/api/budget-templates', headers=headers).get_json()[0]['name'] == 'Renamed'
+
+def test_archived_transactions_stay_searchable(client):
+    from backend.app import archive_transactions, Transaction
+    token = register_and_login(client)
+    headers = {'Authorization': f'Bearer {token}'}
+    today = datetime.date.today().isoformat()
+    acct = client.post('/api/accounts', json={'name':'Checking','balance':100}, headers=headers).get_json()['id']
+    client.post('/api/transactions', json={'type':'expense','category':'Supermarket','amount':40,'merchant':'Mart','date':'2019-05-02','account_id':acct,
+                                           'splits':[{'category':'Groceries','amount':30},{'category':'Household','amount':10}]}, headers=headers)
+    client.post('/api/transactions', json={'type':'income','category':'Salary','amount':200,'merchant':'Work','date':'2019-05-01','account_id':acct}, headers=headers)
+    client.post('/api/transactions', json={'type':'expense','category':'Groceries','amount':20,'merchant':'Deli','date':today,'account_id':acct}, headers=headers)
+    breakdown = client.get('/api/analytics/category-breakdown', headers=headers).get_json()
+    report_2019 = client.get('/api/analytics/report?from=2019-01-01&to=2019-12-31', headers=headers).get_json()
+    assert [(c['name'], c['total']) for c in report_2019['categories']] == [('Groceries', 30), ('Household', 10)]
+    from backend.app import ChangeLog
+    account_changes = lambda: ChangeLog.query.filter_by(resource='accounts', object_id=acct).count()
+    with app.app_context():
+        before = account_changes()
+        assert archive_transactions('2020-01-01') == {1: 2}
+        assert Transaction.query.count() == 1
+        assert account_changes() == before + 1  # the opening_balance fold-in reaches sync and backups
+    assert client.get('/api/analytics/category-breakdown', headers=headers).get_json() == breakdown
+    assert client.get('/api/analytics/report?from=2019-01-01&to=2019-12-31', headers=headers).get_json() == report_2019
+    assert len(client.get('/api/transactions', headers=headers).get_json()) == 1
+    found = client.get('/api/transactions?from=2019-01-01&to=2019-12-31', headers=headers).get_json()
+    assert [(t['merchant'], t.get('archived')) for t in found] == [('Mart', True), ('Work', True)]
+    assert found[0]['splits'][0]['category'] == 'Groceries'
+    assert [t['merchant'] for t in client.get('/api/transactions?q=mart', headers=headers).get_json()] == ['Mart']
+    assert client.get('/api/transactions?from=2021-01-01', headers=headers).get_json()[0]['merchant'] == 'Deli'
+    assert client.get('/api/accounts', headers=headers).get_json()[0]['balance'] == 240
+    ledger = client.get(f'/api/accounts/{acct}/transactions', headers=headers).get_json()
+    assert ledger['opening_balance'] == 260 and ledger['transactions'][0]['running_balance'] == 240
+    csv_rows = client.get('/api/transactions/export', headers=headers).get_data(as_text=True).strip().splitlines()
+    assert len(csv_rows) == 4 and 'Mart' in csv_rows[2]
+
+def test_columnar_store_matches_sql_analytics(client, tmp_path, monkeypatch):
+    token = register_and_login(client)
+    headers = {'Authorization': f'Bearer {token}'}
+    today = datetime.date.today()
+    for i, (category, amount) in enumerate([('Food', 10), ('Food', 30), ('Rent', 900), ('Food', 20), ('Fun', 5)]):
+        client.post('/api/transactions', json={'type':'expense','category':category,'amount':amount,'merchant':'M',
+                                               'date':(today - datetime.timedelta(days=i)).isoformat()}, headers=headers)
+    client.post('/api/transactions', json={'type':'income','category':'Salary','amount':3000,'merchant':'Work','date':today.isoformat()}, headers=headers)
+    views = ['/api/analytics/category-breakdown', '/api/analytics/spending-trend', '/api/analytics/spending-trend?category=Food', '/api/analytics/report?window=2']
+    via_sql = [client.get(v, headers=headers).get_json() for v in views]
+    monkeypatch.setitem(app.config, 'COLUMNAR_STORE', True)
+    monkeypatch.setitem(app.config, 'COLUMNAR_DIR', str(tmp_path))
+    assert [client.get(v, headers=headers).get_json() for v in views] == via_sql
+    food = [c for c in via_sql[3]['categories'] if c['name'] == 'Food'][0]
+    assert (food['count'], food['total'], food['median'], food['p90']) == (3, 60, 20, 28)
+    assert via_sql[3]['daily'][-1] == {'date': today.isoformat(), 'spent': 10, 'rolling_average': 20}
+
+    # appended in place on insert, rebuilt after an edit
+    client.post('/api/transactions', json={'type':'expense','category':'Fun','amount':15,'merchant':'M','splits':[{'category':'Food','amount':5},{'category':'Fun','amount':10}]}, headers=headers)
+    meta = json.loads((tmp_path / '1' / 'meta.json').read_text())
+    assert (meta['generation'], meta['rows']) == (1, 8)
+    breakdown = {c['name']: c['value'] for c in client.get(views[0], headers=headers).get_json()}
+    assert breakdown == {'Rent': 900, 'Food': 65, 'Fun': 15}
+    # A rebuild that ran after the commit already has it: the late append is skipped
+    from backend.app import Transaction, columnar_append, columnar_invalidate
+    with app.app_context():
+        columnar_invalidate(1)
+    assert {c['name']: c['value'] for c in client.get(views[0], headers=headers).get_json()} == breakdown
+    with app.app_context():
+        columnar_append(db.session.get(Transaction, 7))
+    meta = json.loads((tmp_path / '1' / 'meta.json').read_text())
+    assert (meta['generation'], meta['rows'], meta['max_id']) == (2, 8, 7)
+    client.put('/api/transactions/3', json={'amount':800}, headers=headers)
+    breakdown = {c['name']: c['value'] for c in client.get(views[0], headers=headers).get_json()}
+    assert breakdown['Rent'] == 800 and json.loads((tmp_path / '1' / 'meta.json').read_text())['generation'] == 3
+
+def test_rate_limits_and_concurrency_cap(client, monkeypatch):
+    from backend.app import result_cache
+    token = register_and_login(client)
+    headers = {'Authorization': f'Bearer {token}'}
+    monkeypatch.setitem(app.config, 'RATE_LIMIT_ENABLED', True)
+    monkeypatch.setitem(app.config, 'RATE_LIMIT_USER', (40, 0.01))
+    monkeypatch.setitem(app.config, 'RATE_LIMIT_LOGIN', (3, 0.01))
+    monkeypatch.setitem(app.config, 'RATE_LIMIT_IP', (1000, 100.0))
+    assert client.get('/api/transactions/export', headers=headers).status_code == 200
+    assert client.get('/api/transactions/export', headers=headers).status_code == 200
+    r = client.get('/api/transactions/export', headers=headers)  # 3 x 20 tokens > 40
+    assert r.status_code == 429 and r.get_json()['scope'] == 'user' and int(r.headers['Retry-After']) >= 1000
+
+    statuses = [client.post('/api/login', json={'username':'victim','password':'guess'}).status_code for _ in range(4)]
+    assert statuses == [401, 401, 401, 429]
+    # The guesser's bucket, not the account's: its owner can still sign in from elsewhere
+    assert client.post('/api/login', json={'username':'victim','password':'guess'},
+                       environ_base={'REMOTE_ADDR': '10.0.0.9'}).status_code == 401
+
+    result_cache.store.delete(f'{result_cache.prefix}:rl:user:1')
+    slots = f'{result_cache.prefix}:rl:running:1'
+    result_cache.store.incr(slots, app.config['RATE_LIMIT_CONCURRENCY'], ttl=60)  # two heavy requests in flight
+    r = client.get('/api/forecast', headers=headers)
+    assert r.status_code == 429 and r.get_json()['scope'] == 'concurrency'
+    assert client.get('/api/transactions', headers=headers).status_code == 200  # light routes aren't capped
+    result_cache.store.incr(slots, -app.config['RATE_LIMIT_CONCURRENCY'])
+    assert client.get('/api/forecast', headers=headers).status_code == 200
+    assert int(result_cache.store.get_many([slots])[0]) == 0  # released after the request
+    result_cache.store.delete(slots)  # expired while a request was running: its release doesn't go negative
+    assert result_cache.store.incr(slots, -1, ttl=300, floor=0) == 0
+
+    monkeypatch.setitem(app.config, 'RATE_LIMIT_IP', (2, 0.01))
+    assert [client.get('/api/health').status_code for _ in range(3)] == [200, 200, 429]
+
+def test_password_hashing_pool_rehash_and_unknown_users(client, monkeypatch):
+    import time
+    from backend.app import password_hasher
+    monkeypatch.setitem(app.config, 'PASSWORD_HASH_METHOD', 'pbkdf2:sha256:1000')
+    register_and_login(client, 'old', 'secret')
+    with app.app_context():
+        assert User.query.filter_by(username='old').one().password_hash.startswith('pbkdf2:sha256:1000$')
+
+    monkeypatch.setitem(app.config, 'PASSWORD_HASH_METHOD', 'pbkdf2:sha256:2000')
+    assert client.post('/api/login', json={'username':'old','password':'wrong'}).status_code == 401
+    with app.app_context():  # not upgraded on a failed login
+        assert User.query.filter_by(username='old').one().password_hash.startswith('pbkdf2:sha256:1000$')
+    assert client.post('/api/login', json={'username':'old','password':'secret'}).status_code == 200
+    with app.app_context():
+        assert User.query.filter_by(username='old').one().password_hash.startswith('pbkdf2:sha256:2000$')
+    assert client.post('/api/login', json={'username':'old','password':'secret'}).status_code == 200
+
+    hasher = password_hasher()
+    hasher.latency = 0.2
+    start = time.perf_counter()
+    assert client.post('/api/login', json={'username':'nobody','password':'x'}).status_code == 401
+    assert 0.17 < time.perf_counter() - start < 0.5  # as slow as a real check, without hashing
+
+    monkeypatch.setitem(app.config, 'PASSWORD_HASH_WORKERS', 1)
+    monkeypatch.setitem(app.config, 'PASSWORD_HASH_QUEUE', 0)
+    hasher = password_hasher()
+    hasher.latency = 0.01
+    hasher.slots.acquire()  # a login already hashing
+    r = client.post('/api/login', json={'username':'old','password':'secret'})
+    assert r.status_code == 503 and r.headers['Retry-After'] == '2'
+    # Unknown usernames are turned away the same way, so a full pool doesn't tell them apart
+    assert client.post('/api/login', json={'username':'nobody','password':'x'}).status_code == 503
+    assert client.post('/api/register', json={'username':'new','password':'pw'}).status_code == 503
+    hasher.slots.release()
+    assert client.post('/api/login', json={'username':'old','password':'secret'}).status_code == 200
+
+def test_job_queue_export_import_retry_and_visibility_timeout(client, monkeypatch):
+    import gzip
+    from backend.app import Job, JOB_HANDLERS, claim_job, run_job
+    token = register_and_login(client)
+    headers = {'Authorization': f'Bearer {token}'}
+    client.post('/api/transactions', json={'type':'expense','category':'Food','amount':12.5,'merchant':'Cafe','date':'2024-03-01'}, headers=headers)
+    csv_text = 'id,type,category,amount,merchant,date,time\n' + ''.join(
+        f',expense,Fun,{n},Shop,2024-03-02,\n' for n in range(1, 2501)) + ',expense,Fun,oops,Shop,2024-03-02,\n'
+    assert client.post('/api/jobs', json={'kind':'mine-bitcoin'}, headers=headers).status_code == 400
+    r = client.post('/api/jobs', json={'kind':'import','params':{'csv':csv_text}}, headers=headers)
+    assert r.status_code == 202 and r.get_json()['status'] == 'queued'
+    import_id = r.get_json()['id']
+    export_id = client.post('/api/jobs', json={'kind':'export'}, headers=headers).get_json()['id']
+
+    with app.app_context():
+        job = claim_job('w1')
+        assert job.id == import_id and claim_job('w2').id == export_id and claim_job('w3') is None
+        assert run_job(job, 'w1')
+    job = client.get(f'/api/jobs/{import_id}', headers=headers).get_json()
+    assert job['status'] == 'done' and job['result'] == {'rows': 2501, 'imported': 2500, 'skipped': 1, 'resumed_from': 0}
+
+    # w2 stalled: once its lease runs out another worker takes the job over and w2's reports are refused
+    with app.app_context():
+        Job.query.filter_by(id=export_id).update({'locked_until': datetime.datetime.utcnow() - datetime.timedelta(seconds=1)})
+        db.session.commit()
+        job = claim_job('w4')
+        assert job.id == export_id and job.attempts == 2 and job.locked_by == 'w4'
+        assert not run_job(db.session.get(Job, export_id), 'w2') and run_job(job, 'w4')
+    jobs = client.get('/api/jobs', headers=headers).get_json()
+    assert [j['status'] for j in jobs] == ['done', 'done'] and jobs[0]['download'] == f'/api/jobs/{export_id}/download'
+    r = client.get(jobs[0]['download'], headers=headers)
+    assert 'Content-Encoding' not in r.headers and r.data.decode().count('\n') == 2502
+    r = client.get(jobs[0]['download'], headers=dict(headers, **{'Accept-Encoding': 'gzip'}))
+    assert r.headers['Content-Encoding'] == 'gzip' and b'Cafe' in gzip.decompress(r.data)
+
+    # failures are retried with backoff, then marked failed
+    calls = []
+    monkeypatch.setitem(JOB_HANDLERS, 'report', lambda job, params, progress: calls.append(job.attempts) or 1 / 0)
+    failing_id = client.post('/api/jobs', json={'kind':'report'}, headers=headers).get_json()['id']
+    with app.app_context():
+        for attempt in range(3):
+            job = claim_job('w1')
+            assert job is not None and run_job(job, 'w1')
+            assert claim_job('w1') is None  # backing off
+            Job.query.filter_by(id=failing_id).update({'run_after': datetime.datetime.utcnow()})
+            db.session.commit()
+        assert claim_job('w1') is None
+    job = client.get(f'/api/jobs/{failing_id}', headers=headers).get_json()
+    assert calls == [1, 2, 3] and job['status'] == 'failed' and 'ZeroDivisionError' in job['error']
+    assert client.delete(f'/api/jobs/{failing_id}', headers=headers).get_json() == {'status': 'deleted'}
+    other = register_and_login(client, 'other')
+    assert client.get(f'/api/jobs/{export_id}/download', headers={'Authorization': f'Bearer {other}'}).status_code == 404
+
+def test_delta_sync_returns_only_changes_and_tombstones(client, monkeypatch):
+    from backend.app import archive_transactions, compact_change_log
+    token = register_and_login(client)
+    headers = {'Authorization': f'Bearer {token}'}
+    client.post('/api/budgets', json={'category':'Food','limit':100}, headers=headers)
+    full = client.get('/api/sync', headers=headers).get_json()
+    assert full['full'] and [b['category'] for b in full['changes']['budgets']] == ['Food'] and full['changes']['bills'] == []
+
+    account = client.post('/api/accounts', json={'name':'Checking','balance':100}, headers=headers).get_json()['id']
+    bill = client.post('/api/bills', json={'name':'Power','amount':40}, headers=headers).get_json()['id']
+    client.post('/api/transactions', json={'type':'expense','category':'Food','amount':10,'merchant':'Cafe','account_id':account}, headers=headers)
+    client.put('/api/budgets/1', json={'limit':100}, headers=headers)  # no net change: not logged
+    delta = client.get(f"/api/sync?since={full['cursor']}", headers=headers).get_json()
+    assert sorted(delta['changes']) == ['accounts', 'bills', 'transactions'] and delta['deleted'] == {}
+    assert delta['changes']['accounts'][0]['balance'] == 90 and delta['changes']['transactions'][0]['amount'] == 10
+
+    client.delete(f'/api/bills/{bill}', headers=headers)
+    client.put('/api/budgets/1', json={'limit':150}, headers=headers)
+    other = register_and_login(client, 'other')
+    client.post('/api/goals', json={'name':'Not mine'}, headers={'Authorization': f'Bearer {other}'})
+    step = client.get(f"/api/sync?since={delta['cursor']}", headers=headers).get_json()
+    assert step['changes'] == {'budgets': [{'id': 1, 'category': 'Food', 'limit': 150, 'spent': 0, 'color': '#3b82f6'}]}
+    assert step['deleted'] == {'bills': [bill]}
+    assert client.get(f"/api/sync?since={step['cursor']}", headers=headers).get_json()['changes'] == {}
+
+    # bulk paths (archival) log too; pages follow the cursor; compaction keeps old cursors valid
+    client.post('/api/transactions', json={'type':'expense','category':'Fun','amount':5,'merchant':'Old','date':'2001-01-01'}, headers=headers)
+    with app.app_context():
+        archive_transactions('2002-01-01')
+        assert compact_change_log() > 0
+    monkeypatch.setitem(app.config, 'SYNC_PAGE_SIZE', 1)
+    cursor, pages, deleted = full['cursor'], 0, {}
+    while True:
+        page = client.get(f'/api/sync?since={cursor}', headers=headers).get_json()
+        cursor, pages = page['cursor'], pages + 1
+        for resource, ids in page['deleted'].items():
+            deleted.setdefault(resource, []).extend(ids)
+        if not page['has_more']:
+            break
+    assert pages == 5 and deleted == {'bills': [bill], 'transactions': [2]}
+    assert client.get('/api/sync?since=abc', headers=headers).status_code == 400
+
+def test_event_stream_pushes_changes_and_resumes(client, monkeypatch):
+    from backend.app import event_bus
+    monkeypatch.setitem(app.config, 'EVENTS_HEARTBEAT', 0.05)
+    token = register_and_login(client)
+    headers = {'Authorization': f'Bearer {token}'}
+    due = (datetime.date.today() + datetime.timedelta(days=2)).isoformat()
+    bill = client.post('/api/bills', json={'name':'Power','amount':40,'due_date':due}, headers=headers).get_json()['id']
+
+    def reader(response):
+        chunks = iter(response.response)
+
+        def next_event():
+            while True:
+                chunk = next(chunks).decode()
+                if chunk.startswith(': ping'):
+                    continue
+                fields = dict(line.split(': ', 1) for line in chunk.strip().split('\n') if ': ' in line)
+                if 'event' in fields:
+                    return fields.get('id'), fields['event'], json.loads(fields['data'])
+        return chunks, next_event
+
+    r = client.get('/api/events', headers=headers, buffered=False)
+    assert r.mimetype == 'text/event-stream' and event_bus.connections == 1
+    chunks, next_event = reader(r)
+    assert next(chunks) == b'retry: 3000\n\n'
+    _, name, notes = next_event()
+    assert name == 'notifications' and notes[0]['bill_id'] == bill
+    assert next(chunks) == b': ping\n\n'  # idle
+
+    client.put(f'/api/bills/{bill}', json={'toggle_paid': True}, headers=headers)
+    sync_id, name, data = next_event()
+    assert (name, data) == ('sync', {'resources': ['bills']})
+    assert next_event()[1:] == ('notifications', [])
+    other = register_and_login(client, 'other')
+    client.post('/api/goals', json={'name':'Not mine'}, headers={'Authorization': f'Bearer {other}'})
+    client.post('/api/goals', json={'name':'Car'}, headers=headers)  # while disconnected
+    r.close()
+    assert event_bus.connections == 0
+
+    monkeypatch.setitem(app.config, 'EVENTS_MAX_CONNECTIONS', 1)
+    r = client.get('/api/events', headers=dict(headers, **{'Last-Event-ID': sync_id}), buffered=False)
+    assert client.get('/api/events', headers=headers).status_code == 503
+    _, next_event = reader(r)
+    assert next_event()[1] == 'notifications'  # current alerts first
+    assert [e[1:] for e in (next_event(), next_event())] == [('notifications', []), ('sync', {'resources': ['goals']})]
+    r.close()
+
+    # a sync gunicorn worker (one request per process) would be held by the stream for good
+    sync_worker = {'wsgi.multiprocess': True, 'wsgi.multithread': False}
+    assert client.get('/api/events', headers=headers, environ_overrides=sync_worker).status_code == 503
+    assert event_bus.connections == 0
+
+def test_anomaly_detection_batch_and_insert_time(client):
+    from backend.app import detect_anomalies, CategoryStats
+    token = register_and_login(client)
+    headers = {'Authorization': f'Bearer {token}'}
+    today = datetime.date.today()
+    amounts = [48, 52, 50, 47, 55, 51, 49, 53, 600, 50, 46]  # one 12x grocery bill in the history
+    for k, amount in enumerate(amounts):
+        day = (today - datetime.timedelta(days=60 - 5 * k)).isoformat()
+        r = client.post('/api/transactions', json={'type':'expense','category':'Groceries','amount':amount,'merchant':f'Shop {k}','date':day}, headers=headers)
+        assert r.get_json()['anomalies'] == []  # no stats until the first batch run
+    client.post('/api/transactions', json={'type':'expense','category':'Rent','amount':900,'merchant':'Landlord','date':today.isoformat()}, headers=headers)
+    with app.app_context():
+        assert detect_anomalies() == {'lines': 12, 'outlier': 1, 'duplicate': 0}
+        assert detect_anomalies()['outlier'] == 1  # re-running doesn't duplicate flags
+        stats = CategoryStats.query.filter_by(category='Groceries').one()
+        assert (stats.count, stats.median) == (11, 50)
+    flagged = client.get('/api/anomalies', headers=headers).get_json()
+    assert len(flagged) == 1 and flagged[0]['transaction']['amount'] == 600 and flagged[0]['detail']['ratio'] == 11.9
+
+    # new charges are scored against the stats on insert
+    r = client.post('/api/transactions', json={'type':'expense','category':'Groceries','amount':520,'merchant':'Big Shop','date':today.isoformat()}, headers=headers)
+    assert r.get_json()['anomalies'] == ['outlier']
+    r = client.post('/api/transactions', json={'type':'expense','category':'Groceries','amount':51,'merchant':'Corner Shop','date':today.isoformat()}, headers=headers)
+    assert r.get_json()['anomalies'] == []
+    r = client.post('/api/transactions', json={'type':'expense','category':'Groceries','amount':51,'merchant':'corner shop ','date':today.isoformat()}, headers=headers)
+    assert r.get_json()['anomalies'] == ['duplicate']
+    notes = client.get('/api/notifications', headers=headers).get_json()
+    assert [n['kind'] for n in notes if n['type'] == 'anomaly'] == ['duplicate', 'outlier', 'outlier']
+    assert 'Possible duplicate charge' in notes[0]['message']
+
+    anomaly_id = client.get('/api/anomalies', headers=headers).get_json()[0]['id']
+    assert client.put(f'/api/anomalies/{anomaly_id}', json={'status':'dismissed'}, headers=headers).status_code == 200
+    assert len(client.get('/api/anomalies', headers=headers).get_json()) == 2
+    with app.app_context():
+        assert detect_anomalies()['duplicate'] == 1
+    assert client.get('/api/anomalies?status=dismissed', headers=headers).get_json()[0]['id'] == anomaly_id
+
+def test_anomalies_follow_their_transaction(client):
+    alice = {'Authorization': f'Bearer {register_and_login(client, "alice")}'}
+    bob = {'Authorization': f'Bearer {register_and_login(client, "bob")}'}
+    charge = {'type':'expense','category':'Health','amount':999,'merchant':'Private Clinic','date':datetime.date.today().isoformat()}
+    client.post('/api/transactions', json=charge, headers=alice)
+    r = client.post('/api/transactions', json=charge, headers=alice)
+    assert r.get_json()['anomalies'] == ['duplicate']
+    duplicate = r.get_json()['id']
+    assert client.delete(f'/api/transactions/{duplicate}', headers=alice).status_code == 200
+    assert client.get('/api/anomalies', headers=alice).get_json() == []
+
+    # re-entering the charge flags it again instead of failing on the old flag
+    r = client.post('/api/transactions', json=charge, headers=alice)
+    assert r.status_code == 201 and r.get_json()['anomalies'] == ['duplicate']
+    client.delete(f"/api/transactions/{r.get_json()['id']}", headers=alice)
+
+    # SQLite hands the freed id to bob's next row; a flag of alice's left pointing at it
+    # (from before flags were deleted with their transaction) must not show bob's charge
+    r = client.post('/api/transactions', json={**charge, 'merchant':'Other Clinic'}, headers=bob)
+    assert r.get_json()['id'] == duplicate
+    with app.app_context():
+        from backend.app import Anomaly
+        db.session.add(Anomaly(user_id=1, transaction_id=duplicate, kind='outlier', detail='{}'))
+        db.session.commit()
+    assert client.get('/api/anomalies', headers=alice).get_json() == []
+    assert [n for n in client.get('/api/notifications', headers=alice).get_json() if n['type'] == 'anomaly'] == []
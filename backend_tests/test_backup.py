@@ -0,0 +1,109 @@
+import os
+import sqlite3
+
+import pytest
+from sqlalchemy import create_engine
+from backend.app import db, SYNCED_MODELS
+from backend.backup import BackupError, full_backup, export_changes, restore, copy_database, chain_files, list_chains
+
+LOGGED = {model.__tablename__: resource for model, resource in SYNCED_MODELS.items()}
+
+def dump(path):
+    conn = sqlite3.connect(path)
+    tables = [t for (t,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' ORDER BY name")]
+    rows = {t: conn.execute(f'SELECT rowid, * FROM "{t}" ORDER BY rowid').fetchall() for t in tables}
+    conn.close()
+    return rows
+
+def write(conn, sql, params=(), log=None):
+    """Run an app-style write: the statement plus its change_log entry"""
+    conn.execute(sql, params)
+    if log:
+        conn.execute("INSERT INTO change_log (user_id, resource, object_id, deleted, created_at) "
+                     "VALUES (1, ?, ?, ?, '2026-01-01')", log)
+    conn.commit()
+
+def test_chain_backup_changes_and_verified_restore(tmp_path):
+    source = str(tmp_path / 'live.db')
+    db.metadata.create_all(create_engine(f'sqlite:///{source}'))
+    conn = sqlite3.connect(source)
+    conn.execute("INSERT INTO user (id, username, password_hash) VALUES (1, 'a', 'x')")
+    conn.executemany("INSERT INTO \"transaction\" (id, user_id, type, category, merchant, amount, date) "
+                     "VALUES (?, 1, 'expense', 'Food', 'Shop', ?, '2026-01-01')", [(n, n * 1.5) for n in range(1, 3001)])
+    conn.executemany("INSERT INTO security_price (symbol, price) VALUES (?, ?)", [('AAA', 1.0), ('BBB', 2.0)])
+    conn.execute("INSERT INTO transaction_archive (user_id, first_date, last_date, count, data) "
+                 "VALUES (1, '2020-01-01', '2020-12-31', 3, ?)", (os.urandom(5000),))
+    conn.commit()
+
+    root = str(tmp_path / 'backups')
+    stats = full_backup(source, root, LOGGED, pages=8, pause=0)
+    assert stats['steps'] > 1 and stats['restarts'] == 0 and stats['counts']['transaction'] == 3000
+    chain = list_chains(root)[0]
+
+    write(conn, "UPDATE \"transaction\" SET amount = 99 WHERE id = 7", log=('transactions', 7, 0))
+    write(conn, "DELETE FROM \"transaction\" WHERE id = 8", log=('transactions', 8, 1))
+    write(conn, "INSERT INTO \"transaction\" (id, user_id, type, category, merchant, amount, date) "
+                "VALUES (5000, 1, 'income', 'Pay', 'Work', 10, '2026-01-02')", log=('transactions', 5000, 0))
+    write(conn, "UPDATE security_price SET price = 3.0 WHERE symbol = 'BBB'")
+    write(conn, "ALTER TABLE user ADD COLUMN nickname TEXT")
+    write(conn, "UPDATE user SET nickname = 'al'")
+    changes = export_changes(source, chain)
+    # Only the logged rows plus the changed chunks of the other tables, not the 3000 transactions
+    assert changes['tables']['transaction'] == 2 and changes['rows'] < 20
+    snapshot = dump(source)
+
+    write(conn, "DELETE FROM security_price WHERE symbol = 'AAA'")
+    assert export_changes(source, chain)['tables'] == {'security_price': 1}
+    final = dump(source)
+    conn.close()
+
+    target = str(tmp_path / 'restored.db')
+    assert restore(chain, target, upto=1)['files'] == 2
+    assert dump(target) == snapshot
+    assert restore(chain, target, full_check=True)['counts']['security_price'] == 1
+    assert dump(target) == final
+
+    with open(os.path.join(chain, chain_files(chain)[1]['name']), 'r+b') as f:
+        f.seek(30)
+        f.write(b'\0\0\0\0')
+    with pytest.raises(BackupError, match='checksum'):
+        restore(chain, target)
+    assert dump(target) == final  # untouched
+
+def test_restore_catches_writes_that_bypassed_the_log(tmp_path):
+    source = str(tmp_path / 'live.db')
+    db.metadata.create_all(create_engine(f'sqlite:///{source}'))
+    conn = sqlite3.connect(source)
+    conn.execute("INSERT INTO user (id, username, password_hash) VALUES (1, 'a', 'x')")
+    conn.execute("INSERT INTO account (id, user_id, name, balance, opening_balance) VALUES (1, 1, 'Checking', 50, 100)")
+    conn.commit()
+    chain = full_backup(source, str(tmp_path / 'backups'), LOGGED, pause=0)['chain']
+    write(conn, "UPDATE account SET opening_balance = 60 WHERE id = 1")  # no change_log entry
+    conn.close()
+    export_changes(source, chain)
+    target = str(tmp_path / 'restored.db')
+    with pytest.raises(BackupError, match='contents differ .* account'):
+        restore(chain, target)
+    assert not os.path.exists(target)
+    assert restore(chain, target, upto=0)['files'] == 1  # the base alone still verifies
+
+@pytest.mark.parametrize('journal', ['delete', 'wal'])
+def test_paced_copy_under_writes(tmp_path, journal):
+    source = str(tmp_path / 'live.db')
+    conn = sqlite3.connect(source)
+    conn.execute(f'PRAGMA journal_mode = {journal}')
+    conn.execute('CREATE TABLE t (id INTEGER PRIMARY KEY, v TEXT)')
+    conn.executemany('INSERT INTO t (v) VALUES (?)', [('x' * 200,)] * 2000)
+    conn.commit()
+
+    def progress(done, total):
+        conn.execute('INSERT INTO t (v) VALUES (?)', ('y',))  # another connection writes mid-copy
+        conn.commit()
+    before = dump(source)
+    stats = copy_database(source, str(tmp_path / 'copy.db'), pages=4, pause=0, max_restarts=2, progress=progress)
+    if journal == 'wal':  # paced all the way through, copying the snapshot it started from
+        assert stats['snapshot'] and stats['restarts'] == 0 and stats['steps'] > 10
+        assert dump(str(tmp_path / 'copy.db')) == before
+    else:  # each write started it over, so the rest went in one step
+        assert stats['restarts'] == 2 and stats['final_step']
+        assert dump(str(tmp_path / 'copy.db')) == dump(source)
@@ -0,0 +1,101 @@
+import threading
+import time
+
+import pytest
+from backend.cache import MemoryCache, SQLiteCache, RedisCache, LocalRedis, VersionedCache, create_store
+
+@pytest.fixture(params=['memory', 'sqlite', 'redis'])
+def store(request, tmp_path):
+    if request.param == 'memory':
+        return MemoryCache()
+    if request.param == 'sqlite':
+        return SQLiteCache(str(tmp_path / 'cache.db'))
+    return RedisCache(LocalRedis())
+
+def test_store_operations(store):
+    store.set('a', b'1')
+    assert store.get_many(['a', 'missing']) == [b'1', None]
+    assert store.add('a', b'2') is False and store.add('b', b'2', ttl=0.05) is True
+    assert store.incr('n') == 1 and store.incr('n', 5) == 6
+    assert int(store.get_many(['n'])[0]) == 6
+    store.delete('a')
+    time.sleep(0.1)
+    assert store.get_many(['a', 'b']) == [None, None]
+    assert store.add('b', b'3')  # expired keys can be taken again
+
+def test_counter_ttl_restarts_and_floor(store):
+    store.incr('c', 1, ttl=0.3)
+    time.sleep(0.2)
+    store.incr('c', 1, ttl=0.3)
+    time.sleep(0.2)
+    assert int(store.get_many(['c'])[0]) == 2  # each incr pushed the expiry back
+    assert store.incr('c', -5, ttl=0.3, floor=0) == 0
+    store.delete('c')
+    assert store.incr('c', -1, floor=0) == 0
+
+def test_versioned_invalidation_is_per_user(store):
+    cache = VersionedCache(store)
+    calls = []
+    compute = lambda user: lambda: calls.append(user) or {'user': user, 'n': len(calls)}
+    assert cache.get_or_compute('report', 1, compute(1)) == {'user': 1, 'n': 1}
+    assert cache.get_or_compute('report', 1, compute(1))['n'] == 1
+    cache.get_or_compute('report', 2, compute(2))
+    cache.bump('report', 1)
+    assert cache.get_or_compute('report', 1, compute(1))['n'] == 3
+    assert cache.get_or_compute('report', 2, compute(2))['n'] == 2
+    cache.bump('report')  # everyone
+    assert cache.get_or_compute('report', 2, compute(2))['n'] == 4
+    assert cache.get_or_compute('report', 2, compute(2), key='2024-01-01')['n'] == 5
+
+def test_stampede_computes_once(store):
+    cache = VersionedCache(store)
+    calls = []
+
+    def slow():
+        calls.append(1)
+        time.sleep(0.2)
+        return 'value'
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_compute('slow', 1, slow))) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert results == ['value'] * 8 and len(calls) == 1
+
+def test_sqlite_store_is_shared_between_workers(tmp_path):
+    path = str(tmp_path / 'shared.db')
+    worker_a, worker_b = VersionedCache(SQLiteCache(path)), VersionedCache(SQLiteCache(path))
+    assert worker_a.get_or_compute('forecast', 7, lambda: 'a') == 'a'
+    assert worker_b.get_or_compute('forecast', 7, lambda: 'b') == 'a'
+    worker_b.bump('forecast', 7)
+    assert worker_a.get_or_compute('forecast', 7, lambda: 'c') == 'c'
+
+def test_sqlite_store_keeps_version_counters_when_full(tmp_path):
+    cache = VersionedCache(SQLiteCache(str(tmp_path / 'cache.db'), max_entries=50))
+    cache.bump('report', 1)  # the counter row is older than everything below
+    for n in range(250):
+        cache.store.set(f'k{n}', b'x', ttl=60 + n)
+    assert cache.get_or_compute('report', 1, lambda: 'old') == 'old'
+    cache.bump('report', 1)
+    for n in range(250, 260):  # the 256th write prunes
+        cache.store.set(f'k{n}', b'x', ttl=60 + n)
+    assert cache.store.get_many(['k0', 'k259']) == [None, b'x']  # soonest-expiring evicted first
+    cache.bump('report', 1)  # had the counter been evicted, this would bring back the version of 'old'
+    assert cache.get_or_compute('report', 1, lambda: 'new') == 'new'
+
+def test_memory_store_evicts_least_recently_used():
+    store = MemoryCache(max_entries=2)
+    store.set('a', 1)
+    store.set('b', 2)
+    store.get_many(['a'])
+    store.set('c', 3)
+    assert store.get_many(['a', 'b', 'c']) == [1, None, 3]
+    assert isinstance(create_store('redis', 'local'), RedisCache)
+
+def test_token_bucket_refills(store):
+    assert store.token_bucket('tb', 3, rate=20, capacity=5) == (True, 0.0)
+    allowed, retry_after = store.token_bucket('tb', 3, rate=20, capacity=5)
+    assert not allowed and 0 < retry_after <= 0.05
+    time.sleep(retry_after + 0.01)
+    assert store.token_bucket('tb', 3, rate=20, capacity=5)[0]
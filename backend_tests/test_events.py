@@ -0,0 +1,23 @@
+import pytest
+from backend.cache import LocalRedis
+from backend.events import EventBus, StreamLost
+
+def test_bus_fans_out_per_user_and_caps_connections():
+    bus = EventBus(LocalRedis(), max_connections=2, max_pending=2)
+    alice, bob = bus.subscribe(1), bus.subscribe(2)
+    assert bus.subscribe(3) is None
+    first = bus.publish(1, 'sync', {'resources': ['bills']})
+    bus.publish(2, 'sync', {'resources': ['goals']})
+    assert alice.get(1) == [(first, 'sync', '{"resources":["bills"]}')]
+    assert [e[1:] for e in bob.get(1)] == [('sync', '{"resources":["goals"]}')]
+    assert alice.get(0.01) == []
+
+    for n in range(3):  # alice stops reading and falls behind
+        last = bus.publish(1, 'n', n)
+    with pytest.raises(StreamLost):
+        for _ in range(50):
+            alice.get(0.02)
+    alice.close()
+    resumed = bus.subscribe(1, last_id=first)
+    assert [data for _, _, data in resumed.get(1)] == ['0', '1', '2']
+    assert bus.since(1, last) == [] and bus.connections == 2
@@ -0,0 +1,103 @@
+"""
+Backup and restore for MyMoney Pro's SQLite database
+Takes online backups while the app keeps serving (see backend/backup.py):
+
+  python backup.py full      start a new chain with a paced, compressed full copy
+  python backup.py changes   add the rows changed since the chain's last file
+  python backup.py list      show the chains and their files
+  python backup.py restore   rebuild the database from a chain (stop the app first)
+
+Usage: python backup.py full [--dir backups] [--pages 2048] [--pause 0.02] [--level 1]
+       python backup.py changes [--dir backups] [--chain NAME]
+       python backup.py restore [--dir backups] [--chain NAME] [--upto N] [--to PATH] [--full-check] [--force]
+"""
+
+import argparse
+import os
+import sys
+
+from backend.backup import BackupError, full_backup, export_changes, restore, list_chains, chain_files
+
+def database_path():
+    # Resolved like backend/app.py does, without importing it: the import creates the
+    # tables, which would put a fresh database where restore is about to write
+    uri = os.environ.get('DATABASE_URL') or 'sqlite:///instance/mymoney.db'
+    if not uri.startswith('sqlite:///'):
+        sys.exit(f"backup.py handles SQLite databases; use your server's tools for {uri.split(':')[0]}")
+    return os.path.abspath(uri[len('sqlite:///'):])
+
+def chain_path(args):
+    if args.chain:
+        return os.path.join(args.dir, args.chain)
+    chains = list_chains(args.dir)
+    if not chains:
+        sys.exit(f"No backups in {args.dir}; run 'python backup.py full' first")
+    return chains[-1]
+
+def mb(size):
+    return f'{size / 1e6:,.1f} MB'
+
+def cmd_full(args):
+    from backend.app import SYNCED_MODELS
+    source = database_path()
+    logged = {model.__tablename__: resource for model, resource in SYNCED_MODELS.items()}
+    shown = [-1]
+
+    def progress(done, total):
+        percent = done * 100 // max(total, 1)
+        if percent >= shown[0] + 10:
+            shown[0] = percent
+            print(f'  {percent}% of {total:,} pages', flush=True)
+    print(f'Backing up {source} ({mb(os.path.getsize(source))})...')
+    stats = full_backup(source, args.dir, logged, args.pages, args.pause, args.max_restarts, args.level, progress)
+    note = f", last step unpaced after {stats['restarts']} restarts" if stats['final_step'] else ''
+    print(f"✓ {stats['chain']}: {stats['pages']:,} pages copied in {stats['seconds']:.1f}s "
+          f"({stats['steps']} steps{note}), compressed to {mb(stats['size'])} in {stats['compress_seconds']:.1f}s, "
+          f"{sum(stats['counts'].values()):,} rows")
+
+def cmd_changes(args):
+    chain = chain_path(args)
+    result = export_changes(database_path(), chain, args.level)
+    tables = ', '.join(f'{t} {n}' for t, n in sorted(result['tables'].items())) or 'no changes'
+    print(f"✓ {result['file']}: {result['rows']:,} rows ({tables}), {mb(result['size'])} in {result['seconds']:.1f}s")
+
+def cmd_list(args):
+    for chain in list_chains(args.dir):
+        print(chain)
+        for n, entry in enumerate(chain_files(chain)):
+            print(f"  {n:>4}  {entry['name']:<22} {entry['created'][:19]}  {mb(entry['size']):>12}  "
+                  f"{sum(entry['counts'].values()):>12,} rows")
+
+def cmd_restore(args):
+    chain = chain_path(args)
+    target = args.to or database_path()
+    if os.path.exists(target) and not args.force:
+        sys.exit(f'{target} exists; stop the app and pass --force to replace it')
+    print(f'Restoring {chain} into {target}...')
+    result = restore(chain, target, args.upto, args.full_check, lambda name: print(f'  applied {name}', flush=True))
+    print(f"✓ Restored {sum(result['counts'].values()):,} rows from {result['files']} files "
+          f"in {result['seconds']:.1f}s (file checksums, {'integrity' if args.full_check else 'quick'} check, row counts and contents verified)")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('command', choices=['full', 'changes', 'list', 'restore'])
+    parser.add_argument('--dir', default=os.environ.get('BACKUP_DIR', 'backups'), help='where chains are kept (default: BACKUP_DIR or ./backups)')
+    parser.add_argument('--chain', help='chain directory name (default: the newest)')
+    parser.add_argument('--pages', type=int, default=2048, help='pages copied per step of a full backup')
+    parser.add_argument('--pause', type=float, default=0.02, help='seconds between steps, when writers get the database')
+    parser.add_argument('--max-restarts', type=int, default=3, help='restarts caused by writes before copying the rest in one step')
+    parser.add_argument('--level', type=int, help='gzip level (default 1 for full backups, 6 for changes)')
+    parser.add_argument('--upto', type=int, help='restore up to this file number (see list; default: all)')
+    parser.add_argument('--to', help='database file to restore into (default: the configured database)')
+    parser.add_argument('--full-check', action='store_true', help='run PRAGMA integrity_check instead of quick_check')
+    parser.add_argument('--force', action='store_true', help='replace an existing database file')
+    args = parser.parse_args()
+    if args.level is None:
+        args.level = 1 if args.command == 'full' else 6
+    try:
+        {'full': cmd_full, 'changes': cmd_changes, 'list': cmd_list, 'restore': cmd_restore}[args.command](args)
+    except BackupError as e:
+        sys.exit(f'✗ {e}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+"""
+Anomaly detection benchmark
+Seeds many users' expense histories (with a few planted outliers and duplicate
+charges) and times the all-users batch pass and insert-time scoring.
+
+Usage: python benchmarks/anomaly_bench.py [--users 2000] [--per-user 500]
+"""
+
+import argparse
+import datetime
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+TMP = tempfile.mkdtemp(prefix='mymoney-anomaly-')
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(TMP, 'bench.db')
+
+from backend.app import app, db, User, Transaction, detect_anomalies, score_transaction  # noqa: E402
+
+CATEGORIES = {'Groceries': 60, 'Dining': 25, 'Transport': 12, 'Utilities': 90, 'Fun': 40, 'Shopping': 70}
+
+def seed(users, per_user):
+    rnd = random.Random(11)
+    today = datetime.date.today()
+    db.session.execute(User.__table__.insert(), [{'username': f'u{n}', 'password_hash': 'x'} for n in range(users)])
+    user_ids = [u.id for u in User.query.all()]
+    planted = 0
+    batch = []
+    for user_id in user_ids:
+        for k in range(per_user):
+            category = rnd.choice(list(CATEGORIES))
+            amount = round(rnd.lognormvariate(0, 0.25) * CATEGORIES[category], 2)
+            if rnd.random() < 0.002:
+                amount, planted = amount * 12, planted + 1
+            batch.append({'user_id': user_id, 'type': 'expense', 'category': category, 'amount': amount,
+                          'merchant': f'{category} {rnd.randrange(8)}', 'time': '', 'created_at': datetime.datetime.utcnow(),
+                          'date': (today - datetime.timedelta(days=rnd.randrange(365))).isoformat()})
+        if len(batch) >= 50000:
+            db.session.execute(Transaction.__table__.insert(), batch)
+            batch = []
+    if batch:
+        db.session.execute(Transaction.__table__.insert(), batch)
+    db.session.commit()
+    return user_ids, planted
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--per-user', type=int, default=500)
+    args = parser.parse_args()
+    try:
+        with app.app_context():
+            db.create_all()
+            start = time.perf_counter()
+            user_ids, planted = seed(args.users, args.per_user)
+            print(f'seeded {args.users * args.per_user} transactions for {args.users} users '
+                  f'({planted} planted outliers) in {time.perf_counter() - start:.1f}s')
+            start = time.perf_counter()
+            result = detect_anomalies(since=(datetime.date.today() - datetime.timedelta(days=365)).isoformat())
+            print(f"batch pass: {result['lines']} lines in {time.perf_counter() - start:.1f}s -> "
+                  f"{result['outlier']} outliers, {result['duplicate']} possible duplicates")
+            rnd = random.Random(3)
+            timings = []
+            for _ in range(200):
+                t = Transaction(user_id=rnd.choice(user_ids), type='expense', category='Groceries', merchant='Bench',
+                                amount=round(rnd.uniform(20, 800), 2), date=datetime.date.today().isoformat(), time='')
+                db.session.add(t)
+                db.session.commit()
+                start = time.perf_counter()
+                score_transaction(t)
+                timings.append((time.perf_counter() - start) * 1000)
+            timings.sort()
+            print(f'insert-time scoring: median {timings[100]:.2f} ms, p95 {timings[190]:.2f} ms')
+    finally:
+        shutil.rmtree(TMP, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
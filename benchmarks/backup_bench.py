@@ -0,0 +1,144 @@
+"""
+Backup benchmark
+Builds a multi-GB database with the app's schema and times a full backup
+(paced vs one step) while a writer commits a transaction every few
+milliseconds, then a change set after a day's worth of edits, and a verified
+restore. Reports the writer's commit latency during each backup.
+
+Usage: python benchmarks/backup_bench.py [--gb 2] [--journal wal|delete] [--write-every 0.02] [--keep DIR]
+"""
+
+import argparse
+import datetime
+import os
+import random
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+TMP = tempfile.mkdtemp(prefix='mymoney-backup-')
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(TMP, 'app.db')
+
+from sqlalchemy import create_engine  # noqa: E402
+from backend.app import db, SYNCED_MODELS  # noqa: E402
+from backend.backup import full_backup, export_changes, restore, list_chains  # noqa: E402
+
+CATEGORIES = ['Groceries', 'Rent', 'Dining', 'Transport', 'Utilities', 'Fun', 'Health', 'Shopping', 'Travel', 'Gifts']
+MERCHANTS = [f'Merchant {n}' for n in range(500)]
+INSERT = ('INSERT INTO "transaction" (user_id, type, category, merchant, amount, date, time, created_at, updated_at) '
+          'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)')
+LOG = 'INSERT INTO change_log (user_id, resource, object_id, deleted, created_at) VALUES (?, ?, ?, ?, ?)'
+
+def seed(path, gb, journal):
+    db.metadata.create_all(create_engine(f'sqlite:///{path}'))
+    conn = sqlite3.connect(path)
+    conn.execute(f'PRAGMA journal_mode = {journal}')
+    conn.execute('PRAGMA synchronous = OFF')
+    conn.executemany('INSERT INTO user (id, username, password_hash) VALUES (?, ?, ?)',
+                     [(n, f'user{n}', 'x') for n in range(1, 5001)])
+    rnd = random.Random(7)
+    today = datetime.date.today()
+    now = datetime.datetime.utcnow().isoformat(' ')
+    while os.path.getsize(path) < gb * 1e9:
+        batch = [(rnd.randrange(1, 5001), 'expense', rnd.choice(CATEGORIES), rnd.choice(MERCHANTS),
+                  round(rnd.expovariate(1 / 40), 2), (today - datetime.timedelta(days=rnd.randrange(1500))).isoformat(),
+                  '12:00', now, now) for _ in range(200000)]
+        conn.executemany(INSERT, batch)
+        conn.commit()
+    conn.close()
+
+def writer(path, every, stop, latencies):
+    """App-like traffic: one transaction and its change_log entry per commit"""
+    conn = sqlite3.connect(path, timeout=60)
+    rnd = random.Random(1)
+    while not stop.is_set():
+        start = time.perf_counter()
+        now = datetime.datetime.utcnow().isoformat(' ')
+        cursor = conn.execute(INSERT, (rnd.randrange(1, 5001), 'expense', 'Dining', 'Cafe', 4.5,
+                                       datetime.date.today().isoformat(), '', now, now))
+        conn.execute(LOG, (1, 'transactions', cursor.lastrowid, 0, now))
+        conn.commit()
+        latencies.append(time.perf_counter() - start)
+        time.sleep(every)
+    conn.close()
+
+def under_load(path, every, fn):
+    stop, latencies = threading.Event(), []
+    thread = threading.Thread(target=writer, args=(path, every, stop, latencies))
+    thread.start()
+    time.sleep(0.5)
+    try:
+        result = fn()
+    finally:
+        stop.set()
+        thread.join()
+    return result, latencies
+
+def describe(latencies):
+    ms = sorted(x * 1000 for x in latencies)
+    return (f'{len(ms)} commits, p50 {statistics.median(ms):.1f} ms, '
+            f'p99 {ms[int(len(ms) * 0.99)]:.1f} ms, max {ms[-1]:.0f} ms')
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--gb', type=float, default=2)
+    parser.add_argument('--journal', default='wal', choices=['wal', 'delete'])
+    parser.add_argument('--write-every', type=float, default=0.02, help='seconds between the writer\'s commits')
+    parser.add_argument('--keep', help='reuse/keep the seeded database in this directory')
+    args = parser.parse_args()
+    work = args.keep or TMP
+    os.makedirs(work, exist_ok=True)
+    path = os.path.join(work, f'bench-{args.journal}.db')
+    root = os.path.join(TMP, 'backups')
+    logged = {model.__tablename__: resource for model, resource in SYNCED_MODELS.items()}
+    try:
+        if not os.path.exists(path):
+            start = time.perf_counter()
+            seed(path, args.gb, args.journal)
+            print(f'seeded {os.path.getsize(path) / 1e9:.2f} GB in {time.perf_counter() - start:.0f}s')
+        conn = sqlite3.connect(path)
+        rows = conn.execute('SELECT count(*) FROM "transaction"').fetchone()[0]
+        conn.execute(f'PRAGMA journal_mode = {args.journal}')
+        conn.close()
+        print(f'{os.path.getsize(path) / 1e9:.2f} GB, {rows:,} transactions, journal_mode={args.journal}, '
+              f'writer commits every {args.write_every * 1000:.0f} ms\n')
+
+        _, idle = under_load(path, args.write_every, lambda: time.sleep(5))
+        print(f'no backup:          writer {describe(idle)}')
+        for name, pages in [('one-step copy', -1), ('paced copy', 2048)]:
+            shutil.rmtree(root, ignore_errors=True)
+            stats, latencies = under_load(path, args.write_every,
+                                          lambda: full_backup(path, root, logged, pages=pages, pause=0.02))
+            note = f", finished in one step after {stats['restarts']} restarts" if stats['final_step'] else ''
+            print(f"{name + ':':<19} copy {stats['seconds']:.1f}s ({stats['steps']} steps{note}), gzip -1 "
+                  f"{stats['compress_seconds']:.1f}s -> {stats['size'] / 1e9:.2f} GB; writer {describe(latencies)}")
+        chain = list_chains(root)[-1]
+
+        conn = sqlite3.connect(path, timeout=60)
+        now = datetime.datetime.utcnow().isoformat(' ')
+        edited = conn.execute('SELECT id, user_id FROM "transaction" ORDER BY random() LIMIT 20000').fetchall()
+        conn.executemany('UPDATE "transaction" SET amount = amount + 1, updated_at = ? WHERE id = ?', [(now, i) for i, _ in edited])
+        conn.executemany(LOG, [(u, 'transactions', i, 0, now) for i, u in edited])
+        conn.commit()
+        conn.close()
+        changes, latencies = under_load(path, args.write_every, lambda: export_changes(path, chain))
+        print(f"change set:         {changes['rows']:,} rows in {changes['seconds']:.1f}s -> {changes['size'] / 1e6:.1f} MB; "
+              f"writer {describe(latencies)}")
+
+        target = os.path.join(TMP, 'restored.db')
+        result = restore(chain, target)
+        print(f"restore:            base + 1 change set, quick_check, row counts in {result['seconds']:.1f}s")
+        start = time.perf_counter()
+        shutil.copyfile(path, os.path.join(TMP, 'plain-copy.db'))
+        print(f'(plain file copy:   {time.perf_counter() - start:.1f}s)')
+    finally:
+        shutil.rmtree(TMP, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""
+Columnar store benchmark
+Times the analytics aggregates (category breakdown, spending trend, spending
+report) over one user's transactions: SQL GROUP BY vs the memory-mapped
+columnar store (cold rebuild and warm reads).
+
+Usage: python benchmarks/columnar_bench.py [--rows 1000000] [--repeat 5]
+"""
+
+import argparse
+import datetime
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+TMP = tempfile.mkdtemp(prefix='mymoney-columnar-')
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(TMP, 'bench.db')
+os.environ['COLUMNAR_DIR'] = os.path.join(TMP, 'columnar')
+
+import numpy as np  # noqa: E402
+from sqlalchemy import func, select  # noqa: E402
+from backend.app import (app, db, User, Transaction, split_lines, user_columns, columnar_invalidate,  # noqa: E402
+                         category_totals, monthly_totals, spending_report)
+
+CATEGORIES = ['Groceries', 'Rent', 'Dining', 'Transport', 'Utilities', 'Fun', 'Health', 'Shopping', 'Travel', 'Gifts']
+
+def seed(rows):
+    rnd = random.Random(7)
+    user = User(username='bench', password_hash='x')
+    db.session.add(user)
+    db.session.commit()
+    today = datetime.date.today()
+    now = datetime.datetime.utcnow()
+    for start in range(0, rows, 50000):
+        batch = []
+        for _ in range(min(50000, rows - start)):
+            age = rnd.randrange(1095)
+            batch.append({'user_id': user.id, 'type': 'income' if rnd.random() < 0.05 else 'expense',
+                          'category': rnd.choice(CATEGORIES), 'amount': round(rnd.expovariate(1 / 40), 2),
+                          'merchant': 'Shop', 'date': (today - datetime.timedelta(days=age)).isoformat(),
+                          'time': '', 'created_at': now - datetime.timedelta(days=age)})
+        db.session.execute(Transaction.__table__.insert(), batch)
+    db.session.commit()
+    return user.id
+
+def timed(fn, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    try:
+        with app.app_context():
+            db.create_all()
+            start = time.perf_counter()
+            user_id = seed(args.rows)
+            print(f'seeded {args.rows} transactions in {time.perf_counter() - start:.1f}s')
+            since = datetime.datetime.utcnow() - datetime.timedelta(days=180)
+            today = np.datetime64(datetime.date.today(), 'D')
+
+            def sql_breakdown():
+                lines = split_lines(Transaction.user_id == user_id, Transaction.type == 'expense')
+                return db.session.execute(select(lines.c.category, func.sum(lines.c.amount)).group_by(lines.c.category)).all()
+
+            def sql_trend():
+                t = Transaction.__table__
+                month = func.substr(t.c.date, 1, 7)
+                return db.session.execute(select(month, t.c.type, func.sum(t.c.amount)).where(
+                    t.c.user_id == user_id, t.c.created_at >= since).group_by(month, t.c.type)).all()
+
+            def report(columns):
+                return spending_report(*columns, today - 364, today, 30)
+
+            results = [('category breakdown', 'SQL GROUP BY', timed(sql_breakdown, args.repeat)),
+                       ('spending trend', 'SQL GROUP BY', timed(sql_trend, args.repeat)),
+                       ('365-day report', 'SQL fetch + NumPy', timed(lambda: report(user_columns(user_id)), 1))]
+
+            app.config['COLUMNAR_STORE'] = True
+            columnar_invalidate(user_id)
+            results.append(('store rebuild', 'columnar (cold)', timed(lambda: user_columns(user_id), 1)))
+            results += [
+                ('category breakdown', 'columnar (warm)', timed(lambda: category_totals(*user_columns(user_id)), args.repeat)),
+                ('spending trend', 'columnar (warm)',
+                 timed(lambda: monthly_totals(*user_columns(user_id), np.datetime64(since, 'D')), args.repeat)),
+                ('365-day report', 'columnar (warm)', timed(lambda: report(user_columns(user_id)), args.repeat)),
+            ]
+            size = sum(os.path.getsize(os.path.join(dirpath, f)) for dirpath, _, files in os.walk(os.environ['COLUMNAR_DIR']) for f in files)
+            print(f'columnar store: {size / 1e6:.1f} MB on disk\n')
+            print(f"{'report':<20} {'path':<20} {'best ms':>9}")
+            for name, path, ms in results:
+                print(f'{name:<20} {path:<20} {ms:>9.1f}')
+    finally:
+        shutil.rmtree(TMP, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+"""
+Compression benchmark for API payloads
+Shows bytes-on-wire and CPU cost of gzip/brotli levels at different payload sizes
+
+Usage: python benchmarks/compression_bench.py
+"""
+
+import json
+import random
+import time
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+CATEGORIES = ['Food', 'Groceries', 'Transport', 'Shopping', 'Bills', 'Entertainment', 'Salary', 'Health']
+MERCHANTS = ['Cafe Coffee Day', 'BigBasket', 'Uber', 'Amazon', 'Airtel', 'PVR Cinemas', 'Employer', 'Apollo Pharmacy']
+
+def transactions_payload(rows):
+    """JSON body shaped like GET /api/transactions"""
+    rnd = random.Random(rows)
+    return json.dumps([{
+        'id': i, 'type': 'income' if i % 20 == 0 else 'expense',
+        'category': rnd.choice(CATEGORIES), 'amount': round(rnd.uniform(10, 5000), 2),
+        'merchant': rnd.choice(MERCHANTS), 'date': f'2024-{rnd.randint(1, 12):02d}-{rnd.randint(1, 28):02d}',
+        'time': f'{rnd.randint(0, 23):02d}:{rnd.randint(0, 59):02d}'
+    } for i in range(rows)]).encode('utf-8')
+
+def gzip_compress(data, level):
+    c = zlib.compressobj(level, zlib.DEFLATED, 31)
+    return c.compress(data) + c.flush()
+
+def measure(fn, data):
+    """Best wall time in ms over repeated runs (up to ~0.5s per codec) so small payloads aren't noise"""
+    best, spent, runs = float('inf'), 0.0, 0
+    while runs < 50 and (runs == 0 or spent < 0.5):
+        start = time.perf_counter()
+        out = fn(data)
+        elapsed = time.perf_counter() - start
+        best, spent, runs = min(best, elapsed), spent + elapsed, runs + 1
+    return len(out), best * 1000
+
+def main():
+    codecs = [(f'gzip-{lvl}', lambda d, lvl=lvl: gzip_compress(d, lvl)) for lvl in (1, 6, 9)]
+    if brotli:
+        codecs += [(f'br-{q}', lambda d, q=q: brotli.compress(d, quality=q)) for q in (1, 4, 9)]
+    else:
+        print('brotli not installed; showing gzip only')
+
+    print(f"{'rows':>7} {'raw bytes':>11} {'codec':>8} {'wire bytes':>11} {'ratio':>7} {'ms':>9} {'MB/s':>8}")
+    for rows in (10, 100, 1_000, 10_000, 100_000):
+        data = transactions_payload(rows)
+        for name, fn in codecs:
+            size, ms = measure(fn, data)
+            mbps = len(data) / 1e6 / (ms / 1000) if ms else float('inf')
+            print(f'{rows:>7} {len(data):>11} {name:>8} {size:>11} {len(data) / size:>6.1f}x {ms:>9.3f} {mbps:>8.1f}')
+
+if __name__ == '__main__':
+    main()
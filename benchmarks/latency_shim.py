@@ -0,0 +1,19 @@
+"""
+Adds a fixed delay to every SQL statement to emulate a database across the network
+Used by load_test.py --db-latency-ms; the sleep releases the GIL like a socket wait does
+"""
+
+import os
+import time
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from backend.app import app
+from backend.asgi import asgi_app
+
+DB_LATENCY = float(os.environ.get('BENCH_DB_LATENCY_MS', 0)) / 1000
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _simulated_network_latency(conn, cursor, statement, parameters, context, executemany):
+    time.sleep(DB_LATENCY)
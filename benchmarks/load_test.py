@@ -0,0 +1,129 @@
+"""
+Load test: sync (gunicorn) vs ASGI (uvicorn) serving modes
+Starts each server against a throwaway SQLite database, seeds one user and
+hits the API with N concurrent keep-alive clients, then prints requests/sec
+and latency percentiles for each mode.
+
+Usage: python benchmarks/load_test.py [--clients 200] [--seconds 15] [--workers 3] [--db-latency-ms 5]
+"""
+
+import argparse
+import http.client
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ENDPOINTS = ['/api/notifications', '/api/analytics/category-breakdown', '/api/analytics/spending-trend', '/api/transactions']
+
+MODES = {
+    'sync': lambda module, port, workers: [sys.executable, '-m', 'gunicorn', f'{module[0]}:app', '--workers', str(workers),
+                                           '--bind', f'127.0.0.1:{port}', '--log-level', 'warning'],
+    'asgi': lambda module, port, workers: [sys.executable, '-m', 'uvicorn', f'{module[1]}:asgi_app', '--workers', str(workers),
+                                           '--port', str(port), '--log-level', 'warning'],
+}
+
+def call(conn, method, path, body=None, token=None):
+    headers = {'Content-Type': 'application/json'}
+    if token:
+        headers['Authorization'] = f'Bearer {token}'
+    conn.request(method, path, body=json.dumps(body) if body is not None else None, headers=headers)
+    resp = conn.getresponse()
+    return resp.status, resp.read()
+
+def wait_for(port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=2)
+            if call(conn, 'GET', '/api/health')[0] == 200:
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f'server on port {port} did not start')
+
+def seed(port, transactions=500):
+    conn = http.client.HTTPConnection('127.0.0.1', port)
+    status, body = call(conn, 'POST', '/api/register', {'username': 'loadtest', 'password': 'loadtest'})
+    if status != 201:
+        status, body = call(conn, 'POST', '/api/login', {'username': 'loadtest', 'password': 'loadtest'})
+    token = json.loads(body)['token']
+    for i in range(transactions):
+        call(conn, 'POST', '/api/transactions', {'type': 'expense' if i % 10 else 'income', 'category': f'Cat{i % 12}',
+                                                 'amount': i % 97 + 1, 'merchant': 'Shop', 'date': f'2024-{i % 12 + 1:02d}-15'}, token)
+    for i in range(20):
+        call(conn, 'POST', '/api/bills', {'name': f'Bill {i}', 'amount': 10, 'due_date': '2030-01-01'}, token)
+    return token
+
+def client_loop(port, token, stop_at, latencies, errors):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    i = 0
+    while time.time() < stop_at:
+        path = ENDPOINTS[i % len(ENDPOINTS)]
+        i += 1
+        start = time.perf_counter()
+        try:
+            status, _ = call(conn, 'GET', path, token=token)
+            if status != 200:
+                errors.append(status)
+                continue
+            latencies.append(time.perf_counter() - start)
+        except (OSError, http.client.HTTPException) as e:
+            errors.append(type(e).__name__)
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+
+def run_mode(mode, args, port):
+    db_dir = tempfile.mkdtemp(prefix=f'mymoney-load-{mode}-')
+    env = dict(os.environ, DATABASE_URL='sqlite:///' + os.path.join(db_dir, 'load.db'), PYTHONPATH=ROOT,
+               BENCH_DB_LATENCY_MS=str(args.db_latency_ms))
+    module = ('benchmarks.latency_shim',) * 2 if args.db_latency_ms else ('backend.app', 'backend.asgi')
+    server = subprocess.Popen(MODES[mode](module, port, args.workers), cwd=ROOT, env=env,
+                              stdout=subprocess.DEVNULL, stderr=open(os.path.join(db_dir, "server.log"), "w"))
+    try:
+        wait_for(port)
+        token = seed(port)
+        latencies, errors = [], []
+        stop_at = time.time() + args.seconds
+        threads = [threading.Thread(target=client_loop, args=(port, token, stop_at, latencies, errors))
+                   for _ in range(args.clients)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    finally:
+        server.terminate()
+        try:
+            server.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            server.kill()
+    ms = sorted(x * 1000 for x in latencies)
+    pct = lambda p: ms[min(len(ms) - 1, int(len(ms) * p))] if ms else float('nan')
+    if errors:
+        print(f'{mode}: errors {sorted(set(map(str, errors)))}')
+    return {'mode': mode, 'requests': len(ms), 'errors': len(errors), 'rps': len(ms) / args.seconds,
+            'p50': pct(0.50), 'p95': pct(0.95), 'p99': pct(0.99), 'mean': statistics.fmean(ms) if ms else float('nan')}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--clients', type=int, default=200)
+    parser.add_argument('--seconds', type=int, default=15)
+    parser.add_argument('--workers', type=int, default=3)
+    parser.add_argument('--modes', default='sync,asgi')
+    parser.add_argument('--db-latency-ms', type=float, default=0,
+                        help='delay added to every SQL statement to emulate a remote database')
+    args = parser.parse_args()
+
+    results = [run_mode(mode, args, 5100 + i) for i, mode in enumerate(args.modes.split(','))]
+    print(f"\n{args.clients} clients, {args.workers} workers, {args.seconds}s per mode, "
+          f"{args.db_latency_ms:g} ms simulated DB latency")
+    print(f"{'mode':>5} {'requests':>9} {'errors':>7} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for r in results:
+        print(f"{r['mode']:>5} {r['requests']:>9} {r['errors']:>7} {r['rps']:>8.1f} {r['p50']:>8.1f} {r['p95']:>8.1f} {r['p99']:>8.1f}")
+
+if __name__ == '__main__':
+    main()
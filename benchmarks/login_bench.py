@@ -0,0 +1,98 @@
+"""
+Login benchmark
+Runs the app on a threaded local server, hammers /api/login from many clients
+and probes /api/health alongside them. Compares hashing on an effectively
+unbounded pool (one hash per request thread, as before) with the bounded pool:
+login throughput, login latency, 503s, and how slow the cheap endpoint gets.
+
+Usage: python benchmarks/login_bench.py [--clients 16] [--seconds 10] [--workers 1] [--queue 16]
+"""
+
+import argparse
+import http.client
+import json
+import logging
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+TMP = tempfile.mkdtemp(prefix='mymoney-login-')
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(TMP, 'bench.db')
+os.environ['RATE_LIMIT'] = '0'
+
+from werkzeug.serving import make_server  # noqa: E402
+from backend.app import app, db, password_hasher  # noqa: E402
+
+def request(port, method, path, body=None):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    start = time.perf_counter()
+    conn.request(method, path, body=json.dumps(body) if body else None, headers={'Content-Type': 'application/json'})
+    status = conn.getresponse().status
+    conn.close()
+    return status, time.perf_counter() - start
+
+def run(port, clients, seconds):
+    stop = threading.Event()
+    logins, rejected, health = [], [], []
+
+    def login_client():
+        while not stop.is_set():
+            status, elapsed = request(port, 'POST', '/api/login', {'username': 'bench', 'password': 'correct horse'})
+            (logins if status == 200 else rejected).append(elapsed)
+
+    def probe():
+        while not stop.is_set():
+            health.append(request(port, 'GET', '/api/health')[1])
+            time.sleep(0.05)
+
+    threads = [threading.Thread(target=login_client) for _ in range(clients)] + [threading.Thread(target=probe)]
+    for t in threads:
+        t.start()
+    time.sleep(seconds)
+    stop.set()
+    for t in threads:
+        t.join()
+    return logins, rejected, health
+
+def pct(values, q):
+    return statistics.quantiles(values, n=100)[q - 1] * 1000 if len(values) > 1 else float('nan')
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--workers', type=int, default=1, help='bounded pool size')
+    parser.add_argument('--queue', type=int, default=16, help='bounded pool queue')
+    args = parser.parse_args()
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        with app.app_context():
+            db.create_all()
+        port = server.server_port
+        assert request(port, 'POST', '/api/register', {'username': 'bench', 'password': 'correct horse'})[0] == 201
+        idle = [request(port, 'GET', '/api/health')[1] for _ in range(50)]
+        print(f"{app.config['PASSWORD_HASH_METHOD']} hashes, {os.cpu_count()} CPUs, {args.clients} login clients, "
+              f"idle /api/health p50 {pct(idle, 50):.1f} ms\n")
+        print(f"{'hashing pool':<22} {'logins/s':>9} {'login p50':>10} {'login p95':>10} {'503s':>6} "
+              f"{'health p50':>11} {'health p95':>11} {'health max':>11}")
+        for name, workers, queue in [('unbounded', args.clients, args.clients),
+                                     (f'{args.workers} worker + {args.queue} queue', args.workers, args.queue)]:
+            app.config['PASSWORD_HASH_WORKERS'], app.config['PASSWORD_HASH_QUEUE'] = workers, queue
+            password_hasher()
+            logins, rejected, health = run(port, args.clients, args.seconds)
+            print(f'{name:<22} {len(logins) / args.seconds:>9.1f} {pct(logins, 50):>8.0f}ms {pct(logins, 95):>8.0f}ms '
+                  f'{len(rejected):>6} {pct(health, 50):>9.1f}ms {pct(health, 95):>9.1f}ms {max(health) * 1000:>9.1f}ms')
+    finally:
+        server.shutdown()
+        shutil.rmtree(TMP, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
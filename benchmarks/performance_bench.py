@@ -0,0 +1,69 @@
+"""
+Portfolio performance benchmark
+Times /api/investments/performance math (compute_performance) for a large
+portfolio: thousands of holdings and years of daily closes.
+
+Usage: python benchmarks/performance_bench.py [--holdings 3000] [--symbols 300] [--years 5]
+"""
+
+import argparse
+import datetime
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(prefix='mymoney-perf-'), 'perf.db')
+
+from backend.app import app, db, User, Account, Investment, PriceHistory, SecurityPrice, compute_performance  # noqa: E402
+
+def seed(holdings, symbols, years):
+    rnd = random.Random(42)
+    today = datetime.date.today()
+    days = [today - datetime.timedelta(days=d) for d in range(int(years * 365), 0, -1)]
+    user = User(username='perf', password_hash='x')
+    db.session.add(user)
+    db.session.flush()
+    accounts = [Account(user_id=user.id, name=f'Broker {i}', type='investment') for i in range(5)]
+    db.session.add_all(accounts)
+    db.session.flush()
+
+    history, last = [], {}
+    for s in range(symbols):
+        price = rnd.uniform(20, 500)
+        for day in days:
+            price *= 1 + rnd.gauss(0.0003, 0.015)
+            history.append({'symbol': f'SYM{s}', 'date': day.isoformat(), 'price': round(price, 4)})
+        last[f'SYM{s}'] = price
+    db.session.execute(PriceHistory.__table__.insert(), history)
+    db.session.execute(SecurityPrice.__table__.insert(), [{'symbol': k, 'price': v} for k, v in last.items()])
+    db.session.execute(Investment.__table__.insert(), [{
+        'user_id': user.id, 'account_id': accounts[h % 5].id, 'symbol': f'SYM{h % symbols}', 'name': 'Holding',
+        'type': 'stock', 'quantity': rnd.randint(1, 100), 'purchase_price': rnd.uniform(20, 500),
+        'current_price': 0, 'purchase_date': rnd.choice(days).isoformat()
+    } for h in range(holdings)])
+    db.session.commit()
+    return user.id, len(history)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--holdings', type=int, default=3000)
+    parser.add_argument('--symbols', type=int, default=300)
+    parser.add_argument('--years', type=float, default=5)
+    args = parser.parse_args()
+    with app.app_context():
+        db.create_all()
+        start = time.perf_counter()
+        user_id, points = seed(args.holdings, args.symbols, args.years)
+        print(f'seeded {args.holdings} holdings, {points} daily closes in {time.perf_counter() - start:.1f}s')
+        for run in range(3):
+            start = time.perf_counter()
+            result = compute_performance(user_id)
+            print(f'run {run + 1}: {(time.perf_counter() - start) * 1000:.0f} ms '
+                  f"(portfolio xirr={result['portfolio']['xirr']}, twr={result['portfolio']['twr']})")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""
+Background job worker for MyMoney Pro
+Drains the job queue (exports, imports, reports queued through /api/jobs).
+Run as many worker processes as you like, on any host that reaches the
+database: each job is claimed by exactly one of them, and a job whose worker
+dies is picked up again once its visibility timeout runs out. Between jobs it
+also drops superseded /api/sync log entries every CHANGE_LOG_COMPACT_INTERVAL seconds.
+
+Usage: python worker.py [--concurrency 2] [--poll 2.0] [--once] [--worker-id NAME]
+"""
+
+import argparse
+import os
+import signal
+import socket
+import threading
+import time
+
+from backend.app import app, claim_job, run_job, purge_jobs, compact_change_log
+
+def compact(stop, interval):
+    """Drop superseded sync log entries every `interval` seconds until stopped"""
+    while not stop.wait(interval):
+        with app.app_context():
+            print(f"Compacted {compact_change_log()} superseded sync log entries", flush=True)
+
+def work(worker_id, stop, poll, once):
+    with app.app_context():
+        while not stop.is_set():
+            job = claim_job(worker_id)
+            if job is None:
+                if once:
+                    return
+                stop.wait(poll)
+                continue
+            start = time.perf_counter()
+            print(f"[{worker_id}] job {job.id} ({job.kind}, attempt {job.attempts})...", flush=True)
+            recorded = run_job(job, worker_id)
+            status = job.status if recorded else 'lease lost'
+            print(f"[{worker_id}] job {job.id}: {status} in {time.perf_counter() - start:.1f}s", flush=True)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--concurrency', type=int, default=2, help='jobs run at once by this process (default 2)')
+    parser.add_argument('--poll', type=float, default=2.0, help='seconds to wait when the queue is empty')
+    parser.add_argument('--once', action='store_true', help='exit when the queue is empty')
+    parser.add_argument('--worker-id', default=f'{socket.gethostname()}-{os.getpid()}')
+    args = parser.parse_args()
+
+    stop = threading.Event()
+    # Finish the jobs in hand on SIGTERM/Ctrl-C; anything cut off is retried after its timeout
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(sig, lambda *_: stop.set())
+    with app.app_context():
+        purged, compacted = purge_jobs(), compact_change_log()
+    print(f"Worker {args.worker_id}: {args.concurrency} threads "
+          f"(purged {purged} old jobs, {compacted} superseded sync log entries)", flush=True)
+    threads = [threading.Thread(target=work, args=(f'{args.worker_id}/{n}', stop, args.poll, args.once))
+               for n in range(args.concurrency)]
+    for t in threads:
+        t.start()
+    if not args.once:
+        threading.Thread(target=compact, args=(stop, app.config['CHANGE_LOG_COMPACT_INTERVAL']), daemon=True).start()
+    while any(t.is_alive() for t in threads):
+        for t in threads:
+            t.join(0.5)
+    print(f"✓ Worker {args.worker_id} stopped", flush=True)
+
+if __name__ == '__main__':
+    main()